@@ -0,0 +1,125 @@
+"""Бенчмарк соединения анкет с пользователями, оценками и комментариями
+
+Замеряет get_surveys_with_details на синтетических данных растущего размера и
+печатает время на анкету. При соединении через индексы оно растет медленно
+(только из-за промахов кэша процессора), а при поиске перебором (--naive,
+прежняя реализация) - пропорционально числу анкет.
+
+    python benchmarks/joins_bench.py
+    python benchmarks/joins_bench.py --sizes 10000 20000 40000 --repeat 5
+    python benchmarks/joins_bench.py --sizes 1000 2000 4000 --naive
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot"))
+
+from database.base import QueryResult, StorageBackend  # noqa: E402
+
+MEAL_TYPES = ["первое", "второе", "напиток"]
+
+
+class SyntheticStorage:
+    """Таблицы в памяти: 10 пользователей на 100 анкет, 3 оценки на анкету, комментарий к каждой третьей"""
+
+    def __init__(self, surveys_count, seed=4):
+        rng = random.Random(seed)
+        users_count = max(1, surveys_count // 10)
+        self.users = [
+            {"telegram_id": 10 ** 6 + i, "full_name": f"Ученик {i}", "class": f"{i % 11 + 1}А"}
+            for i in range(users_count)
+        ]
+        self.surveys = [
+            {"id": i, "telegram_id": 10 ** 6 + rng.randrange(users_count), "date": "2026-10-16"}
+            for i in range(surveys_count)
+        ]
+        self.ratings = [
+            {"id": len(MEAL_TYPES) * i + j, "survey_id": i, "meal_type": meal_type, "rating": rng.randint(1, 5)}
+            for i in range(surveys_count)
+            for j, meal_type in enumerate(MEAL_TYPES)
+        ]
+        self.comments = [
+            {"id": i, "survey_id": i, "meal_type": "первое", "reason_comment": "Пересолено"}
+            for i in range(0, surveys_count, 3)
+        ]
+        # Строки из API приходят в произвольном порядке
+        for table in (self.users, self.surveys, self.ratings, self.comments):
+            rng.shuffle(table)
+
+    async def get_all_surveys(self):
+        return QueryResult(self.surveys)
+
+    async def get_all_users(self):
+        return QueryResult(self.users)
+
+    async def get_all_meal_ratings(self):
+        return QueryResult(self.ratings)
+
+    async def get_all_meal_comments(self):
+        return QueryResult(self.comments)
+
+
+async def naive_join(storage):
+    """Соединение перебором списков для каждой анкеты (как до database/joins.py)"""
+    result = []
+    for survey in storage.surveys:
+        user = next((u for u in storage.users if u['telegram_id'] == survey['telegram_id']), {})
+        result.append({
+            **survey,
+            'user': user,
+            'meal_ratings': [r for r in storage.ratings if r['survey_id'] == survey['id']],
+            'meal_comments': [c for c in storage.comments if c['survey_id'] == survey['id']],
+        })
+    return QueryResult(result)
+
+
+async def indexed_join(storage):
+    return await StorageBackend.get_surveys_with_details(storage)
+
+
+async def measure(join, storage, repeat):
+    best = None
+    for _ in range(repeat):
+        # Как timeit: без пауз сборщика мусора, которые растут с числом живых объектов
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            result = await join(storage)
+            elapsed = time.perf_counter() - started
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    assert len(result.data) == len(storage.surveys)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[12500, 25000, 50000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--naive", action="store_true", help="замерить и соединение перебором (только для малых размеров)")
+    args = parser.parse_args()
+    joins = [("индексы", indexed_join)] + ([("перебор", naive_join)] if args.naive else [])
+
+    print(f"{'соединение':>10} {'анкет':>10} {'оценок':>10} {'время, с':>10} {'мкс/анкету':>12}")
+    for name, join in joins:
+        base = None
+        for size in args.sizes:
+            storage = SyntheticStorage(size)
+            elapsed = asyncio.run(measure(join, storage, args.repeat))
+            per_survey = elapsed / size * 1e6
+            base = base or per_survey
+            print(
+                f"{name:>10} {size:>10} {len(storage.ratings):>10} {elapsed:>10.3f} "
+                f"{per_survey:>12.2f}  (x{per_survey / base:.2f})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,88 @@
+import time
+
+# Отсчет времени запуска - до импорта тяжелых модулей
+STARTED_AT = time.perf_counter()
+
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
-from config import TELEGRAM_TOKEN
+from config import TELEGRAM_TOKEN, FSM_STORAGE
 from handlers import start_handler, mark_handler, admin_handler,special_mark_handler 
 from callbacks import type_callback
+from database.storage import storage
+from database.survey_queue import survey_queue
+from database.fsm_storage import create_events_isolation, create_fsm_storage
+from middlewares.state_snapshot import state_snapshot_middleware
+from functions.yandex_disk import yandex_disk
+from functions.menu_prewarm import menu_prewarmer
+from functions.image_pipeline import photo_optimizer
+
+IMPORTED_AT = time.perf_counter()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Ссылки на фоновые задачи запуска, чтобы их не собрал сборщик мусора
+background_tasks = set()
+
+async def _timed_check(name, coro):
+    """Выполняет проверку сервиса и возвращает строку для отчета о запуске"""
+    started = time.perf_counter()
+    try:
+        await coro
+        return f"{name}: {time.perf_counter() - started:.2f} с"
+    except Exception as e:
+        logger.error(f"❌ Проверка «{name}» при запуске не прошла: {e}")
+        return f"{name}: ошибка за {time.perf_counter() - started:.2f} с"
+
+async def check_services():
+    """Параллельная проверка внешних сервисов, не задерживающая начало polling"""
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        _timed_check("Яндекс.Диск", yandex_disk.check_token()),
+        _timed_check("Хранилище", storage.connect()),
+    )
+    logger.info(f"🩺 Сервисы проверены за {time.perf_counter() - started:.2f} с ({'; '.join(results)})")
+
+async def on_startup(bot: Bot):
+    """Запуск фоновых задач и проверки внешних сервисов"""
+    survey_queue.start()
+    menu_prewarmer.start(bot)
+    
+    for coro in (check_services(), photo_optimizer.cleanup()):
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    
+    logger.info(
+        f"🚀 Бот готов принимать апдейты через {time.perf_counter() - STARTED_AT:.2f} с после старта "
+        f"(импорт модулей: {IMPORTED_AT - STARTED_AT:.2f} с)"
+    )
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """Освобождение ресурсов при остановке бота"""
+    # Сначала выгружаем журнал опросов, затем закрываем соединения с БД
+    await menu_prewarmer.stop()
+    await survey_queue.stop()
+    await dispatcher.fsm.close()
+    await storage.close()
+    await yandex_disk.close()
+
 async def main():
     """Основная функция запуска бота"""
     bot = Bot(
         token=TELEGRAM_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN)
     )
-    dp = Dispatcher()
+    # Состояния опросов во внешнем хранилище переживают перезапуск и общие для нескольких процессов
+    fsm_storage = create_fsm_storage()
+    dp = Dispatcher(storage=fsm_storage, events_isolation=create_events_isolation(fsm_storage))
+    logger.info(f"🗂 FSM хранилище: {FSM_STORAGE}")
+    # Одно чтение и одна запись сессии за апдейт вместо обращения на каждый get_data/update_data
+    dp.update.outer_middleware(state_snapshot_middleware)
     
     # Регистрация роутеров
     dp.include_router(start_handler.router)
@@ -26,6 +91,8 @@ async def main():
     dp.include_router(type_callback.router)
     dp.include_router(admin_handler.router)
 
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     
     logger.info("🍽️ FoodBot запущен!")
     
@@ -3,10 +3,14 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from datetime import datetime
 import logging
 
-from functions.yandex_disk import yandex_disk
-from database.db_supabase import supabase_client
+from functions.yandex_disk import MEAL_TYPES, yandex_disk
+from functions.meal_photos import send_meal_card
+from middlewares.state_snapshot import flush_state
+from database.storage import storage
+from database.survey_queue import survey_queue
 from keyboards.survey_keyboards import (
     get_school_confirmation_keyboard,
     get_emoji_rating_keyboard,
@@ -28,9 +32,6 @@ class SurveyStates(StatesGroup):
     waiting_for_meal_comment = State()
 
 
-# Глобальная переменная для хранения user_id
-current_user_id = None
-
 # Хранилище для ID сообщений которые нужно удалять
 message_ids_to_delete = {}
 
@@ -38,12 +39,6 @@ message_ids_to_delete = {}
 @router.callback_query(F.data.startswith("school_"))
 async def process_school_confirmation(callback: CallbackQuery, state: FSMContext):
     """Обработка подтверждения питания в школе"""
-    global current_user_id
-    
-    # Сохраняем ID пользователя
-    current_user_id = callback.from_user.id
-    logger.info(f"👤 Сохранен user_id: {current_user_id}")
-    
     eats_at_school = callback.data == "school_yes"
     
     # Удаляем сообщение с первым вопросом
@@ -83,10 +78,8 @@ async def process_school_confirmation(callback: CallbackQuery, state: FSMContext
 @router.callback_query(F.data == "skip_comment_no_school_reason")
 async def skip_no_school_reason_regular(callback: CallbackQuery, state: FSMContext):
     """Пропуск причины непосещения столовой для обычного маршрута"""
-    global current_user_id
-    
-    # Обновляем user_id
-    current_user_id = callback.from_user.id
+    # Ученик опроса - владелец FSM-сессии, а не общая переменная модуля
+    user_id = state.key.user_id
     
     await callback.answer("Причина пропущена")
     await callback.message.delete()
@@ -94,27 +87,23 @@ async def skip_no_school_reason_regular(callback: CallbackQuery, state: FSMConte
     # Сохраняем пользователя в БД даже если он не питается в столовой
     try:
         user_data = {
-            "telegram_id": current_user_id,
+            "telegram_id": user_id,
             "full_name": "",
             "class": "",
             "has_profile": False  # Отмечаем что профиль не заполнен
         }
         
-        if not await supabase_client.user_exists(current_user_id):
-            await supabase_client.create_user(user_data)
-            logger.info(f"✅ Создан пользователь (не питается в столовой): {current_user_id}")
-        
         # Создаем анкету с пустой причиной
         survey_data = {
-            "telegram_id": current_user_id,
+            "date": datetime.now().date().isoformat(),
             "eats_at_school": False,
             "no_school_reason": "",
             "overall_satisfaction": None,
             "overall_comment": ""
         }
         
-        await supabase_client.create_survey(survey_data)
-        logger.info(f"✅ Создана анкета для непосещающего столовую: {current_user_id}")
+        await survey_queue.enqueue(user_data, survey_data, [], [])
+        logger.info(f"✅ Создана анкета для непосещающего столовую: {user_id}")
         
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения пользователя не посещающего столовую: {e}")
@@ -130,10 +119,7 @@ async def skip_no_school_reason_regular(callback: CallbackQuery, state: FSMConte
 @router.message(SurveyStates.waiting_for_no_school_reason)
 async def process_no_school_reason_regular(message: Message, state: FSMContext):
     """Обработка причины непосещения столовой для обычного маршрута"""
-    global current_user_id
-    
-    # Обновляем user_id
-    current_user_id = message.from_user.id
+    user_id = state.key.user_id
     
     reason = message.text.strip()
     
@@ -165,27 +151,23 @@ async def process_no_school_reason_regular(message: Message, state: FSMContext):
     try:
         # Сохраняем пользователя даже если он не питается в столовой
         user_data = {
-            "telegram_id": current_user_id,
+            "telegram_id": user_id,
             "full_name": "",
             "class": "",
             "has_profile": False  # Отмечаем что профиль не заполнен
         }
         
-        if not await supabase_client.user_exists(current_user_id):
-            await supabase_client.create_user(user_data)
-            logger.info(f"✅ Создан пользователь (не питается в столовой): {current_user_id}")
-        
         # Создаем анкету с причиной
         survey_data = {
-            "telegram_id": current_user_id,
+            "date": datetime.now().date().isoformat(),
             "eats_at_school": False,
             "no_school_reason": reason,
             "overall_satisfaction": None,
             "overall_comment": ""
         }
         
-        await supabase_client.create_survey(survey_data)
-        logger.info(f"✅ Создана анкета с причиной непосещения для {current_user_id}")
+        await survey_queue.enqueue(user_data, survey_data, [], [])
+        logger.info(f"✅ Создана анкета с причиной непосещения для {user_id}")
         
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения анкеты с причиной: {e}")
@@ -233,11 +215,11 @@ async def process_user_info(message: Message, state: FSMContext):
             "has_profile": True
         }
         
-        if not await supabase_client.user_exists(message.from_user.id):
-            await supabase_client.create_user(user_data)
+        if not await storage.user_exists(message.from_user.id):
+            await storage.create_user(user_data)
             logger.info(f"✅ Создан новый пользователь: {message.from_user.id}")
         else:
-            await supabase_client.update_user_info(
+            await storage.update_user_info(
                 message.from_user.id, 
                 full_name, 
                 class_name
@@ -346,9 +328,9 @@ async def start_meal_rating(message: Message, state: FSMContext):
         await state.clear()
         return
     
-    # Сохраняем блюда в состоянии
+    # В состоянии только дата меню и номера блюд: само меню лежит в общем кэше Диска
     await state.update_data(
-        meals=meals,
+        menu_date=meals[0]['date'],
         current_meal_index=0,
         meal_ratings=[],
         low_rated_meals=[]
@@ -361,15 +343,14 @@ async def start_meal_rating(message: Message, state: FSMContext):
 async def show_next_meal(message: Message, state: FSMContext):
     """Показывает следующее блюдо для оценки"""
     data = await state.get_data()
-    meals = data['meals']
     current_index = data['current_meal_index']
     
-    if current_index >= len(meals):
+    if current_index >= len(MEAL_TYPES):
         # Все блюда оценены
         await process_meal_comments(message, state)
         return
     
-    current_meal = meals[current_index]
+    current_meal = await yandex_disk.get_menu_meal(data['menu_date'], current_index)
     
     # КРАСИВЫЕ ТЕКСТЫ в зависимости от наличия фото
     if current_meal.get('has_image', True) and current_meal.get('download_url'):
@@ -386,38 +367,19 @@ async def show_next_meal(message: Message, state: FSMContext):
         else:
             caption = f"🍽 *{current_meal['name']}*\n\nКак вы оцените это блюдо?"
     
-    # Проверяем есть ли изображение у блюда
-    has_image = current_meal.get('has_image', True) and current_meal.get('download_url')
-    
-    try:
-        if has_image:
-            # Отправляем с фото
-            meal_message = await message.answer_photo(
-                photo=current_meal['download_url'],
-                caption=caption,
-                reply_markup=get_emoji_rating_keyboard("meal"),
-                parse_mode="Markdown"
-            )
-        else:
-            # Отправляем только текст
-            meal_message = await message.answer(
-                caption,
-                reply_markup=get_emoji_rating_keyboard("meal"),
-                parse_mode="Markdown"
-            )
-        
-        await state.update_data(current_meal_message_id=meal_message.message_id)
-    except Exception as e:
-        # Если не удалось отправить фото, отправляем текстом
-        logger.error(f"Ошибка отправки фото: {e}")
-        meal_message = await message.answer(
-            caption,
-            reply_markup=get_emoji_rating_keyboard("meal"),
-            parse_mode="Markdown"
-        )
-        await state.update_data(current_meal_message_id=meal_message.message_id)
-    
+    # Оценка и новое состояние сохраняются до показа карточки: ответ на нее
+    # должен застать их уже в хранилище
     await state.set_state(SurveyStates.waiting_for_meal_rating)
+    await flush_state(state)
+    
+    # С фото, если оно есть; при ошибке отправки - текстом
+    meal_message = await send_meal_card(
+        message,
+        current_meal,
+        caption,
+        get_emoji_rating_keyboard("meal")
+    )
+    await state.update_data(current_meal_message_id=meal_message.message_id)
 
 @router.callback_query(F.data.startswith("rating_meal_"))
 async def process_meal_rating(callback: CallbackQuery, state: FSMContext):
@@ -432,23 +394,16 @@ async def process_meal_rating(callback: CallbackQuery, state: FSMContext):
     await callback.message.delete()
     
     data = await state.get_data()
-    meals = data['meals']
     current_index = data['current_meal_index']
     meal_ratings = data['meal_ratings']
     low_rated_meals = data['low_rated_meals']
     
-    current_meal = meals[current_index]
+    # Сохраняем оценку (i-я оценка - блюду MEAL_TYPES[i])
+    meal_ratings.append(rating)
     
-    # Сохраняем оценку
-    meal_rating = {
-        "type": current_meal['type'],
-        "rating": rating
-    }
-    meal_ratings.append(meal_rating)
-    
-    # Если оценка низкая, добавляем в список для комментариев
+    # Если оценка низкая, добавляем номер блюда в список для комментариев
     if rating <= 3:
-        low_rated_meals.append(current_meal['type'])
+        low_rated_meals.append(current_index)
     
     # Обновляем состояние
     await state.update_data(
@@ -493,9 +448,12 @@ async def show_next_comment_request(message: Message, state: FSMContext):
         await finish_survey(message, state)
         return
     
-    meal_type = low_rated_meals[current_index]
+    meal_type = MEAL_TYPES[low_rated_meals[current_index]]
     meal_name = meal_type.capitalize()
     
+    await state.set_state(SurveyStates.waiting_for_meal_comment)
+    await flush_state(state)
+    
     comment_message = await message.answer(
         f"💬 *Комментарий для {meal_name}:*\n\n"
         f"Пожалуйста, напишите:\n"
@@ -507,7 +465,6 @@ async def show_next_comment_request(message: Message, state: FSMContext):
     )
     
     await state.update_data(current_comment_message_id=comment_message.message_id)
-    await state.set_state(SurveyStates.waiting_for_meal_comment)
 
 @router.callback_query(F.data == "skip_meal_comment")
 async def skip_meal_comment(callback: CallbackQuery, state: FSMContext):
@@ -542,19 +499,12 @@ async def process_meal_comment(message: Message, state: FSMContext):
         except Exception as e:
             logger.warning(f"Не удалось удалить сообщение: {e}")
     
-    data = await state.get_data()
     low_rated_meals = data['low_rated_meals']
     current_index = data['current_comment_meal_index']
     meal_comments = data['meal_comments']
     
-    meal_type = low_rated_meals[current_index]
-    
-    # Сохраняем комментарий
-    meal_comment = {
-        "type": meal_type,
-        "comment": comment
-    }
-    meal_comments.append(meal_comment)
+    # Сохраняем комментарий парой [номер блюда, текст]
+    meal_comments.append([low_rated_meals[current_index], comment])
     
     # Обновляем состояние
     await state.update_data(
@@ -566,94 +516,49 @@ async def process_meal_comment(message: Message, state: FSMContext):
 
 async def finish_survey(message: Message, state: FSMContext):
     """Завершение опроса и сохранение/обновление данных"""
-    global current_user_id
-    
+    # message здесь может быть сообщением бота, поэтому ученика берем из ключа FSM
+    user_id = state.key.user_id
     data = await state.get_data()
     
     try:
-        # УБЕЖДАЕМСЯ, что пользователь создан в таблице users
         user_data = {
-            "telegram_id": current_user_id,  # Используем сохраненный ID
+            "telegram_id": user_id,
             "full_name": data.get('full_name', ''),
             "class": data.get('class_name', ''),
             "has_profile": True
         }
         
-        if not await supabase_client.user_exists(current_user_id):
-            await supabase_client.create_user(user_data)
-            logger.info(f"✅ Создан пользователь: {current_user_id}")
-        else:
-            await supabase_client.update_user_info(
-                current_user_id, 
-                data.get('full_name', ''), 
-                data.get('class_name', '')
-            )
-            logger.info(f"✅ Обновлен пользователь: {current_user_id}")
-        
-        # Теперь проверяем, есть ли уже анкета
-        existing_survey = await supabase_client.get_user_survey(current_user_id)  # Используем сохраненный ID
-        
-        if existing_survey.data:
-            # ОБНОВЛЯЕМ существующую анкету
-            survey_id = existing_survey.data[0]['id']
-            
-            # Обновляем анкету
-            survey_data = {
-                "eats_at_school": data['eats_at_school'],
-                "overall_satisfaction": data.get('overall_satisfaction'),
-                "overall_comment": data.get('overall_comment', '')
-            }
-            await supabase_client.update_survey(survey_id, survey_data)
-            
-            # Удаляем старые оценки и комментарии
-            await supabase_client.delete_meal_ratings(survey_id)
-            await supabase_client.delete_meal_comments(survey_id)
-            
-            update_message = "🔄 *Ваш опрос обновлен!*"
-            
-        else:
-            # СОЗДАЕМ новую анкету
-            survey_data = {
-                "telegram_id": current_user_id,  # Используем сохраненный ID
-                "eats_at_school": data['eats_at_school'],
-                "overall_satisfaction": data.get('overall_satisfaction'),
-                "overall_comment": data.get('overall_comment', '')
-            }
-            
-            survey_response = await supabase_client.create_survey(survey_data)
-            survey_id = survey_response.data[0]['id']
-            update_message = "✅ *Спасибо за ваш отзыв!*"
+        survey_data = {
+            "date": datetime.now().date().isoformat(),
+            "eats_at_school": data['eats_at_school'],
+            "overall_satisfaction": data.get('overall_satisfaction'),
+            "overall_comment": data.get('overall_comment', '')
+        }
         
-        # Сохраняем оценки блюд
-        for meal_rating in data['meal_ratings']:
-            rating_data = {
-                "survey_id": survey_id,
-                "meal_type": meal_rating['type'],
-                "rating": meal_rating['rating']
+        # Оценки блюд
+        ratings_data = [
+            {
+                "meal_type": MEAL_TYPES[index],
+                "rating": rating
             }
-            await supabase_client.add_meal_rating(rating_data)
-        
-        # Сохраняем комментарии к блюдам
-        meal_comments = data.get('meal_comments', [])
-        
-        # Получаем типы блюд, которые были оценены
-        rated_meal_types = [rating['type'] for rating in data['meal_ratings']]
+            for index, rating in enumerate(data['meal_ratings'])
+        ]
         
         # Создаем комментарии ТОЛЬКО для оцененных блюд
-        for meal_type in rated_meal_types:
-            # Ищем комментарий для этого типа блюда
-            comment_for_meal = next(
-                (c for c in meal_comments if c['type'] == meal_type), 
-                None
-            )
-            
-            comment_data = {
-                "survey_id": survey_id,
-                "meal_type": meal_type,
-                "reason_comment": comment_for_meal.get('comment', '') if comment_for_meal else "",
+        meal_comments = data.get('meal_comments', [])
+        comments_by_index = {index: comment for index, comment in reversed(meal_comments)}
+        comments_data = [
+            {
+                "meal_type": MEAL_TYPES[index],
+                "reason_comment": comments_by_index.get(index, ""),
                 "alternative_comment": ""
             }
-            await supabase_client.add_meal_comment(comment_data)
+            for index in range(len(data['meal_ratings']))
+        ]
+        
+        # Пишем опрос в локальный журнал, в БД он уйдет фоновой выгрузкой
+        await survey_queue.enqueue(user_data, survey_data, ratings_data, comments_data)
+        update_message = "✅ *Спасибо за ваш отзыв!*"
         
         # Формируем итоговое сообщение
         result_text = f"{update_message}\n\n"
@@ -669,8 +574,8 @@ async def finish_survey(message: Message, state: FSMContext):
         
         # Добавляем смайлики к оценкам блюд
         emoji_map = {1: "😠", 2: "😕", 3: "😐", 4: "😊", 5: "🤩"}
-        for rating in data['meal_ratings']:
-            result_text += f"• {rating['type'].capitalize()}: {rating['rating']} {emoji_map.get(rating['rating'], '')}\n"
+        for index, rating in enumerate(data['meal_ratings']):
+            result_text += f"• {MEAL_TYPES[index].capitalize()}: {rating} {emoji_map.get(rating, '')}\n"
         
         low_rated_count = len(data.get('low_rated_meals', []))
         if low_rated_count > 0:
@@ -688,6 +593,4 @@ async def finish_survey(message: Message, state: FSMContext):
         )
     
     finally:
-        # Очищаем глобальную переменную
-        current_user_id = None
         await state.clear()
\ No newline at end of file
@@ -3,12 +3,69 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Хранилище: supabase или sqlite
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "foodbot.sqlite3")
+
 # Supabase
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "10"))
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "20"))
+SUPABASE_PAGE_SIZE = int(os.getenv("SUPABASE_PAGE_SIZE", "1000"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "3600"))
+
+# Отложенная запись опросов
+SURVEY_JOURNAL_PATH = os.getenv("SURVEY_JOURNAL_PATH", "survey_journal.sqlite3")
+SURVEY_FLUSH_BATCH = int(os.getenv("SURVEY_FLUSH_BATCH", "50"))
+SURVEY_FLUSH_INTERVAL = float(os.getenv("SURVEY_FLUSH_INTERVAL", "1"))
+SURVEY_RETRY_MAX_DELAY = float(os.getenv("SURVEY_RETRY_MAX_DELAY", "60"))
+SURVEY_DRAIN_TIMEOUT = float(os.getenv("SURVEY_DRAIN_TIMEOUT", "10"))
+# Сколько раз БД может отклонить опрос, прежде чем он уйдет в dead_surveys
+SURVEY_MAX_ATTEMPTS = int(os.getenv("SURVEY_MAX_ATTEMPTS", "5"))
+
+# FSM (состояния опросов): memory, redis или sqlite
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "fsm.sqlite3")
+# Время жизни незаконченного опроса (секунды, 0 - без ограничения)
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))
+FSM_DATA_TTL = int(os.getenv("FSM_DATA_TTL", "86400"))
 
 # Yandex Disk
 YANDEX_DISK_TOKEN = os.getenv("YANDEX_DISK_TOKEN")
+YANDEX_DISK_CONCURRENCY = int(os.getenv("YANDEX_DISK_CONCURRENCY", "3"))
+YANDEX_DISK_TIMEOUT = float(os.getenv("YANDEX_DISK_TIMEOUT", "5"))
+YANDEX_LINK_TTL = int(os.getenv("YANDEX_LINK_TTL", "3600"))
+YANDEX_LINK_REFRESH_MARGIN = int(os.getenv("YANDEX_LINK_REFRESH_MARGIN", "300"))
+MEAL_PHOTO_CACHE_SIZE = int(os.getenv("MEAL_PHOTO_CACHE_SIZE", "256"))
+# Оптимизированные копии фото блюд на локальном диске
+PHOTO_CACHE_DIR = os.getenv("PHOTO_CACHE_DIR", "photo_cache")
+PHOTO_MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE", "1280"))
+PHOTO_JPEG_QUALITY = int(os.getenv("PHOTO_JPEG_QUALITY", "85"))
+# Предел кэша фото: сначала удаляются файлы старше PHOTO_CACHE_MAX_AGE_DAYS,
+# затем самые давно использованные, пока кэш не уложится в PHOTO_CACHE_MAX_BYTES
+PHOTO_CACHE_MAX_BYTES = int(os.getenv("PHOTO_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+PHOTO_CACHE_MAX_AGE_DAYS = int(os.getenv("PHOTO_CACHE_MAX_AGE_DAYS", "30"))
+PHOTO_DOWNLOAD_TIMEOUT = float(os.getenv("PHOTO_DOWNLOAD_TIMEOUT", "30"))
+MENU_CACHE_SIZE = int(os.getenv("MENU_CACHE_SIZE", "64"))
+MENU_CACHE_PAST_TTL = int(os.getenv("MENU_CACHE_PAST_TTL", "604800"))
+MENU_CACHE_TODAY_TTL = int(os.getenv("MENU_CACHE_TODAY_TTL", "600"))
+MENU_PREWARM_TIME = os.getenv("MENU_PREWARM_TIME", "07:30")  # МСК
+MENU_PREWARM_INTERVAL = int(os.getenv("MENU_PREWARM_INTERVAL", "300"))
+# Полные повторы прогрева прекращаются после стольких попыток или после этого времени (МСК);
+# дальше новые фото подхватывает только проверка изменений
+MENU_PREWARM_MAX_ATTEMPTS = int(os.getenv("MENU_PREWARM_MAX_ATTEMPTS", "6"))
+MENU_PREWARM_DEADLINE = os.getenv("MENU_PREWARM_DEADLINE", "14:00")  # МСК
+MENU_CHANGE_POLL_INTERVAL = int(os.getenv("MENU_CHANGE_POLL_INTERVAL", "60"))
+# После конца учебного дня Диск не проверяется до следующего прогрева
+MENU_CHANGE_POLL_END = os.getenv("MENU_CHANGE_POLL_END", "17:00")  # МСК
+# Чат для предварительной загрузки фото в Telegram (пусто - не загружать)
+MENU_PREWARM_CHAT_ID = int(os.getenv("MENU_PREWARM_CHAT_ID")) if os.getenv("MENU_PREWARM_CHAT_ID") else None
 
 # Telegram
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
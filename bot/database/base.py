@@ -0,0 +1,195 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+
+from database.joins import index_by, group_by
+
+logger = logging.getLogger(__name__)
+
+
+class QueryResult:
+    """Результат запроса с атрибутом data (как у ответа supabase-py)"""
+
+    def __init__(self, data):
+        self.data = data
+
+
+class StorageBackend(ABC):
+    """Интерфейс хранилища анкет, пользователей, оценок и комментариев
+
+    Методы возвращают QueryResult со списком строк-словарей в data
+    (кроме user_exists, iter_* и user_cache_stats).
+    """
+
+    async def connect(self):
+        """Заранее открывает соединение с хранилищем (вызывается при запуске бота)"""
+
+    async def close(self):
+        """Освобождает ресурсы хранилища"""
+
+    def is_unavailable_error(self, error):
+        """Ошибка говорит о недоступности хранилища (сеть, таймаут), а не о том,
+        что оно отклонило сами данные. Такие записи стоит повторить позже как есть"""
+        return isinstance(error, (OSError, asyncio.TimeoutError))
+
+    # Users methods
+    @abstractmethod
+    async def create_user(self, user_data):
+        """Создает нового пользователя"""
+
+    @abstractmethod
+    async def get_user(self, telegram_id):
+        """Получает пользователя по telegram_id"""
+
+    async def user_exists(self, telegram_id):
+        """Проверяет существует ли пользователь"""
+        response = await self.get_user(telegram_id)
+        return len(response.data) > 0
+
+    @abstractmethod
+    async def update_user_info(self, telegram_id, full_name, class_name):
+        """Обновляет информацию о пользователе"""
+
+    def user_cache_stats(self):
+        """Счетчики кэша пользователей (None, если кэш не используется)"""
+        return None
+
+    # Survey methods
+    @abstractmethod
+    async def save_survey(self, user, survey, ratings, comments):
+        """Сохраняет пользователя, анкету за дату, оценки и комментарии одной транзакцией
+
+        Единственный способ записать анкету, оценки и комментарии: вместе с ними
+        он обновляет daily_meal_stats. Анкета перезаписывается по ключу (telegram_id, date).
+        Возвращает data вида {"survey_id": ..., "created": True/False}.
+        """
+
+    @abstractmethod
+    async def get_user_surveys(self, telegram_id):
+        """Получает анкеты пользователя"""
+
+    @abstractmethod
+    async def get_user_survey(self, telegram_id):
+        """Получает анкету пользователя по telegram_id"""
+
+    @abstractmethod
+    async def get_user_survey_for_date(self, telegram_id, date):
+        """Получает анкету пользователя для конкретной даты"""
+
+    # Meal ratings methods
+    @abstractmethod
+    async def get_meal_ratings_by_survey(self, survey_id):
+        """Получает оценки блюд по ID анкеты"""
+
+    # Statistics methods
+    @abstractmethod
+    async def get_daily_stats(self, date=None):
+        """Получает анкеты за день вместе с users, meal_ratings и meal_comments"""
+
+    @abstractmethod
+    async def daily_summary(self, date=None):
+        """Сводка за день, посчитанная на стороне хранилища
+
+        data: {"date", "total_surveys", "eaters", "non_eaters", "avg_overall",
+        "ratings_count", "avg_meal", "meals": {meal_type: {"count", "avg",
+        "distribution": {оценка: количество}}}}
+        """
+
+    @abstractmethod
+    async def get_daily_meal_stats(self, date_from=None, date_to=None):
+        """Агрегат оценок по (дата, класс, блюдо) за период
+
+        Строки: {"date", "class", "meal_type", "ratings_count", "ratings_sum",
+        "r1", ..., "r5"}; агрегат обновляется в save_survey.
+        """
+
+    # Streaming methods
+    @abstractmethod
+    def iter_surveys(self, page_size=None, columns="*"):
+        """Постранично отдает все анкеты"""
+
+    @abstractmethod
+    def iter_users(self, page_size=None, columns="*"):
+        """Постранично отдает всех пользователей"""
+
+    @abstractmethod
+    def iter_meal_ratings(self, page_size=None, columns="*"):
+        """Постранично отдает все оценки блюд"""
+
+    @abstractmethod
+    def iter_meal_comments(self, page_size=None, columns="*"):
+        """Постранично отдает все комментарии к блюдам"""
+
+    async def get_all_surveys(self):
+        """Получает все анкеты"""
+        try:
+            return QueryResult([row async for row in self.iter_surveys()])
+        except Exception as e:
+            logger.error(f"❌ Error getting all surveys: {e}")
+            raise
+
+    async def get_all_users(self):
+        """Получает всех пользователей"""
+        try:
+            return QueryResult([row async for row in self.iter_users()])
+        except Exception as e:
+            logger.error(f"❌ Error getting all users: {e}")
+            raise
+
+    async def get_all_meal_ratings(self):
+        """Получает все оценки блюд"""
+        try:
+            return QueryResult([row async for row in self.iter_meal_ratings()])
+        except Exception as e:
+            logger.error(f"❌ Error getting all meal ratings: {e}")
+            raise
+
+    async def get_all_meal_comments(self):
+        """Получает все комментарии к блюдам"""
+        try:
+            return QueryResult([row async for row in self.iter_meal_comments()])
+        except Exception as e:
+            logger.error(f"❌ Error getting all meal comments: {e}")
+            raise
+
+    async def get_surveys_with_details(self):
+        """Получает анкеты с деталями (для статистики)"""
+        try:
+            # Получаем отдельно данные параллельно и соединяем в коде
+            (
+                surveys_response,
+                users_response,
+                meal_ratings_response,
+                meal_comments_response,
+            ) = await asyncio.gather(
+                self.get_all_surveys(),
+                self.get_all_users(),
+                self.get_all_meal_ratings(),
+                self.get_all_meal_comments(),
+            )
+
+            # Индексы для соединения за линейное время
+            users_by_id = index_by(users_response.data, 'telegram_id')
+            ratings_by_survey = group_by(meal_ratings_response.data, 'survey_id')
+            comments_by_survey = group_by(meal_comments_response.data, 'survey_id')
+
+            # Собираем данные вручную
+            result_data = []
+            for survey in surveys_response.data:
+                user = users_by_id.get(survey['telegram_id'], {})
+                survey_ratings = ratings_by_survey.get(survey['id'], [])
+                survey_comments = comments_by_survey.get(survey['id'], [])
+
+                survey_with_details = {
+                    **survey,
+                    'user': user,
+                    'meal_ratings': survey_ratings,
+                    'meal_comments': survey_comments
+                }
+                result_data.append(survey_with_details)
+
+            return QueryResult(result_data)
+
+        except Exception as e:
+            logger.error(f"❌ Error getting surveys with details: {e}")
+            raise
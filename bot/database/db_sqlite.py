@@ -0,0 +1,536 @@
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime
+
+import aiosqlite
+
+from config import SQLITE_PATH, SUPABASE_PAGE_SIZE
+from database.base import QueryResult, StorageBackend
+from database.joins import index_by, group_by
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER NOT NULL UNIQUE,
+    full_name TEXT NOT NULL DEFAULT '',
+    class TEXT NOT NULL DEFAULT '',
+    has_profile INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS surveys (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER NOT NULL REFERENCES users (telegram_id),
+    date TEXT NOT NULL,
+    class_name TEXT NOT NULL DEFAULT '',
+    eats_at_school INTEGER NOT NULL DEFAULT 0,
+    no_school_reason TEXT NOT NULL DEFAULT '',
+    overall_satisfaction INTEGER,
+    overall_comment TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (telegram_id, date)
+);
+CREATE INDEX IF NOT EXISTS surveys_date_idx ON surveys (date);
+
+CREATE TABLE IF NOT EXISTS meal_ratings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    survey_id INTEGER NOT NULL REFERENCES surveys (id) ON DELETE CASCADE,
+    meal_type TEXT NOT NULL,
+    rating INTEGER NOT NULL CHECK (typeof(rating) = 'integer' AND rating BETWEEN 1 AND 5)
+);
+CREATE INDEX IF NOT EXISTS meal_ratings_survey_id_idx ON meal_ratings (survey_id);
+
+CREATE TABLE IF NOT EXISTS meal_comments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    survey_id INTEGER NOT NULL REFERENCES surveys (id) ON DELETE CASCADE,
+    meal_type TEXT NOT NULL,
+    reason_comment TEXT NOT NULL DEFAULT '',
+    alternative_comment TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS meal_comments_survey_id_idx ON meal_comments (survey_id);
+
+CREATE TABLE IF NOT EXISTS daily_meal_stats (
+    date TEXT NOT NULL,
+    class TEXT NOT NULL DEFAULT '',
+    meal_type TEXT NOT NULL,
+    ratings_count INTEGER NOT NULL DEFAULT 0,
+    ratings_sum INTEGER NOT NULL DEFAULT 0,
+    r1 INTEGER NOT NULL DEFAULT 0,
+    r2 INTEGER NOT NULL DEFAULT 0,
+    r3 INTEGER NOT NULL DEFAULT 0,
+    r4 INTEGER NOT NULL DEFAULT 0,
+    r5 INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, class, meal_type)
+);
+"""
+
+# Оценки анкеты в разрезе (дата, класс, блюдо) для daily_meal_stats
+DAILY_MEAL_STATS_SELECT = """
+SELECT
+    s.date, s.class_name, r.meal_type,
+    ? * COUNT(*), ? * SUM(r.rating),
+    ? * SUM(r.rating = 1), ? * SUM(r.rating = 2), ? * SUM(r.rating = 3),
+    ? * SUM(r.rating = 4), ? * SUM(r.rating = 5)
+FROM meal_ratings r
+JOIN surveys s ON s.id = r.survey_id
+WHERE {where}
+GROUP BY s.date, s.class_name, r.meal_type
+"""
+
+DAILY_MEAL_STATS_COLUMNS = "date, class, meal_type, ratings_count, ratings_sum, r1, r2, r3, r4, r5"
+
+# Колонки таблиц (имена колонок подставляются в SQL только из этого списка)
+COLUMNS = {
+    "users": ("id", "telegram_id", "full_name", "class", "has_profile", "created_at"),
+    "surveys": (
+        "id", "telegram_id", "date", "class_name", "eats_at_school", "no_school_reason",
+        "overall_satisfaction", "overall_comment", "created_at"
+    ),
+    "meal_ratings": ("id", "survey_id", "meal_type", "rating"),
+    "meal_comments": ("id", "survey_id", "meal_type", "reason_comment", "alternative_comment"),
+    "daily_meal_stats": tuple(DAILY_MEAL_STATS_COLUMNS.split(", ")),
+}
+
+# В SQLite нет bool, приводим эти колонки обратно при чтении
+BOOL_COLUMNS = {"has_profile", "eats_at_school"}
+
+
+def validate_ratings(ratings):
+    """Проверяет, что каждая оценка - целое число от 1 до 5 (иначе ValueError)"""
+    for rating in ratings:
+        value = rating.get("rating")
+        if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 5:
+            raise ValueError(f"Недопустимая оценка блюда {rating.get('meal_type')}: {value!r}")
+
+
+class SQLiteClient(StorageBackend):
+    """Встроенное хранилище на SQLite (локальный режим и нагрузочные тесты)"""
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._db = None
+        # Одно соединение: запросы и транзакции не должны перемежаться
+        self._lock = asyncio.Lock()
+
+    async def _connection(self):
+        if self._db is None:
+            self._db = await aiosqlite.connect(self.path)
+            self._db.row_factory = aiosqlite.Row
+            await self._db.execute("PRAGMA journal_mode=WAL")
+            await self._db.execute("PRAGMA foreign_keys=ON")
+            await self._db.executescript(SCHEMA)
+            await self._migrate(self._db)
+            await self._db.commit()
+            logger.info(f"🗄 SQLite хранилище открыто: {self.path}")
+        return self._db
+
+    async def _migrate(self, db):
+        """Доводит базу, созданную до появления daily_meal_stats, до текущей схемы"""
+        async with db.execute("PRAGMA table_info(surveys)") as cursor:
+            columns = [row["name"] for row in await cursor.fetchall()]
+        if "class_name" in columns:
+            return
+
+        await db.execute("ALTER TABLE surveys ADD COLUMN class_name TEXT NOT NULL DEFAULT ''")
+        await db.execute(
+            "UPDATE surveys SET class_name = COALESCE("
+            "(SELECT class FROM users WHERE users.telegram_id = surveys.telegram_id), '')"
+        )
+        await db.execute("DELETE FROM daily_meal_stats")
+        await db.execute(
+            f"INSERT INTO daily_meal_stats ({DAILY_MEAL_STATS_COLUMNS}) "
+            + DAILY_MEAL_STATS_SELECT.format(where="1"),
+            (1,) * 7
+        )
+        logger.info("🧮 daily_meal_stats заполнена по существующим оценкам")
+
+    @staticmethod
+    async def _apply_daily_meal_stats(db, survey_id, sign):
+        """Прибавляет (sign=1) или вычитает (sign=-1) оценки анкеты из daily_meal_stats"""
+        await db.execute(
+            f"INSERT INTO daily_meal_stats ({DAILY_MEAL_STATS_COLUMNS}) "
+            + DAILY_MEAL_STATS_SELECT.format(where="r.survey_id = ?")
+            + " ON CONFLICT (date, class, meal_type) DO UPDATE SET "
+            "ratings_count = ratings_count + excluded.ratings_count, "
+            "ratings_sum = ratings_sum + excluded.ratings_sum, "
+            "r1 = r1 + excluded.r1, r2 = r2 + excluded.r2, r3 = r3 + excluded.r3, "
+            "r4 = r4 + excluded.r4, r5 = r5 + excluded.r5",
+            (sign,) * 7 + (survey_id,)
+        )
+
+    async def connect(self):
+        """Открывает базу и создает схему"""
+        async with self._lock:
+            await self._connection()
+
+    async def close(self):
+        """Закрывает соединение с базой"""
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+            logger.info("🔌 SQLite хранилище закрыто")
+
+    def is_unavailable_error(self, error):
+        """OperationalError - база заблокирована, диск недоступен и т.п.;
+        IntegrityError и ошибки проверки данных относятся к самой записи"""
+        return isinstance(error, sqlite3.OperationalError) or super().is_unavailable_error(error)
+
+    @staticmethod
+    def _to_dict(row):
+        return {
+            key: bool(row[key]) if key in BOOL_COLUMNS and row[key] is not None else row[key]
+            for key in row.keys()
+        }
+
+    @staticmethod
+    def _columns(table, names):
+        """Проверяет имена колонок по схеме"""
+        unknown = [name for name in names if name not in COLUMNS[table]]
+        if unknown:
+            raise ValueError(f"Неизвестные колонки {table}: {unknown}")
+        return list(names)
+
+    def _where(self, table, filters):
+        columns = self._columns(table, filters)
+        if not columns:
+            return "", []
+        return " WHERE " + " AND ".join(f"{column} = ?" for column in columns), list(filters.values())
+
+    async def _fetchall(self, sql, params=()):
+        async with self._lock:
+            db = await self._connection()
+            async with db.execute(sql, params) as cursor:
+                return [self._to_dict(row) for row in await cursor.fetchall()]
+
+    async def _select(self, table, **filters) -> QueryResult:
+        where, params = self._where(table, filters)
+        return QueryResult(await self._fetchall(f"SELECT * FROM {table}{where} ORDER BY id", params))
+
+    async def _insert(self, table, rows) -> QueryResult:
+        rows = rows if isinstance(rows, list) else [rows]
+        if not rows:
+            return QueryResult([])
+
+        async with self._lock:
+            db = await self._connection()
+            ids = []
+            try:
+                for row in rows:
+                    columns = self._columns(table, row)
+                    cursor = await db.execute(
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        list(row.values())
+                    )
+                    ids.append(cursor.lastrowid)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+
+            placeholders = ", ".join("?" * len(ids))
+            async with db.execute(f"SELECT * FROM {table} WHERE id IN ({placeholders}) ORDER BY id", ids) as cursor:
+                return QueryResult([self._to_dict(row) for row in await cursor.fetchall()])
+
+    async def _update(self, table, data, **filters) -> QueryResult:
+        columns = self._columns(table, data)
+        where, params = self._where(table, filters)
+        async with self._lock:
+            db = await self._connection()
+            await db.execute(
+                f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in columns)}{where}",
+                list(data.values()) + params
+            )
+            await db.commit()
+            async with db.execute(f"SELECT * FROM {table}{where} ORDER BY id", params) as cursor:
+                return QueryResult([self._to_dict(row) for row in await cursor.fetchall()])
+
+    async def _iter_table(self, table, columns="*", page_size=None, key="id"):
+        """Постранично читает таблицу keyset-пагинацией (key > последний ключ)"""
+        page_size = page_size or SUPABASE_PAGE_SIZE
+        if columns != "*":
+            names = [c.strip() for c in columns.split(",")]
+            if key not in names:
+                names.insert(0, key)
+            columns = ", ".join(self._columns(table, names))
+
+        last_key = None
+        while True:
+            if last_key is None:
+                page = await self._fetchall(
+                    f"SELECT {columns} FROM {table} ORDER BY {key} LIMIT ?", (page_size,)
+                )
+            else:
+                page = await self._fetchall(
+                    f"SELECT {columns} FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?",
+                    (last_key, page_size)
+                )
+            if not page:
+                return
+
+            for row in page:
+                yield row
+            last_key = page[-1][key]
+
+    # Users methods
+    async def create_user(self, user_data):
+        """Создает нового пользователя"""
+        try:
+            return await self._insert("users", user_data)
+        except Exception as e:
+            logger.error(f"Ошибка создания пользователя: {e}")
+            raise
+
+    async def get_user(self, telegram_id):
+        """Получает пользователя по telegram_id"""
+        try:
+            return await self._select("users", telegram_id=telegram_id)
+        except Exception as e:
+            logger.error(f"Ошибка получения пользователя: {e}")
+            raise
+
+    async def update_user_info(self, telegram_id, full_name, class_name):
+        """Обновляет информацию о пользователе"""
+        try:
+            return await self._update("users", {
+                "full_name": full_name,
+                "class": class_name,
+                "has_profile": True
+            }, telegram_id=telegram_id)
+        except Exception as e:
+            logger.error(f"Ошибка обновления пользователя: {e}")
+            raise
+
+    # Survey methods
+    async def save_survey(self, user, survey, ratings, comments):
+        """Сохраняет пользователя, анкету за дату, оценки и комментарии одной транзакцией"""
+        telegram_id = user["telegram_id"]
+        date = survey.get("date") or datetime.now().date().isoformat()
+
+        try:
+            # До транзакции: в базах, созданных до CHECK на meal_ratings.rating,
+            # плохая оценка иначе попала бы в daily_meal_stats
+            validate_ratings(ratings)
+            async with self._lock:
+                db = await self._connection()
+                try:
+                    # Профиль перезаписывается только заполненным профилем
+                    await db.execute(
+                        "INSERT INTO users (telegram_id, full_name, class, has_profile) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (telegram_id) DO UPDATE SET "
+                        "full_name = excluded.full_name, class = excluded.class, has_profile = excluded.has_profile "
+                        "WHERE excluded.has_profile",
+                        (telegram_id, user.get("full_name") or "", user.get("class") or "",
+                         bool(user.get("has_profile")))
+                    )
+
+                    async with db.execute(
+                        "SELECT COALESCE(class, '') AS class FROM users WHERE telegram_id = ?", (telegram_id,)
+                    ) as cursor:
+                        class_name = (await cursor.fetchone())["class"]
+
+                    async with db.execute(
+                        "SELECT id FROM surveys WHERE telegram_id = ? AND date = ?", (telegram_id, date)
+                    ) as cursor:
+                        existing = await cursor.fetchone()
+
+                    values = (
+                        class_name,
+                        bool(survey.get("eats_at_school")),
+                        survey.get("no_school_reason") or "",
+                        survey.get("overall_satisfaction"),
+                        survey.get("overall_comment") or "",
+                    )
+                    if existing:
+                        survey_id = existing["id"]
+                        # Старые оценки вычитаются из агрегата по старому классу анкеты
+                        await self._apply_daily_meal_stats(db, survey_id, -1)
+                        await db.execute(
+                            "UPDATE surveys SET class_name = ?, eats_at_school = ?, no_school_reason = ?, "
+                            "overall_satisfaction = ?, overall_comment = ? WHERE id = ?",
+                            values + (survey_id,)
+                        )
+                        await db.execute("DELETE FROM meal_ratings WHERE survey_id = ?", (survey_id,))
+                        await db.execute("DELETE FROM meal_comments WHERE survey_id = ?", (survey_id,))
+                    else:
+                        cursor = await db.execute(
+                            "INSERT INTO surveys (telegram_id, date, class_name, eats_at_school, no_school_reason, "
+                            "overall_satisfaction, overall_comment) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (telegram_id, date) + values
+                        )
+                        survey_id = cursor.lastrowid
+
+                    await db.executemany(
+                        "INSERT INTO meal_ratings (survey_id, meal_type, rating) VALUES (?, ?, ?)",
+                        [(survey_id, r["meal_type"], r["rating"]) for r in ratings]
+                    )
+                    await db.executemany(
+                        "INSERT INTO meal_comments (survey_id, meal_type, reason_comment, alternative_comment) "
+                        "VALUES (?, ?, ?, ?)",
+                        [
+                            (survey_id, c["meal_type"], c.get("reason_comment") or "",
+                             c.get("alternative_comment") or "")
+                            for c in comments
+                        ]
+                    )
+                    await self._apply_daily_meal_stats(db, survey_id, 1)
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    raise
+
+            return QueryResult({"survey_id": survey_id, "created": existing is None})
+        except Exception as e:
+            logger.error(f"Ошибка сохранения опроса: {e}")
+            raise
+
+    async def get_user_surveys(self, telegram_id):
+        """Получает анкеты пользователя"""
+        try:
+            return await self._select("surveys", telegram_id=telegram_id)
+        except Exception as e:
+            logger.error(f"Ошибка получения анкет: {e}")
+            raise
+
+    async def get_user_survey(self, telegram_id):
+        """Получает анкету пользователя по telegram_id"""
+        try:
+            return await self._select("surveys", telegram_id=telegram_id)
+        except Exception as e:
+            logger.error(f"❌ Error getting user survey: {e}")
+            raise
+
+    async def get_user_survey_for_date(self, telegram_id, date):
+        """Получает анкету пользователя для конкретной даты"""
+        try:
+            return await self._select("surveys", telegram_id=telegram_id, date=date)
+        except Exception as e:
+            logger.error(f"❌ Error getting user survey for date: {e}")
+            raise
+
+    # Meal ratings methods
+    async def get_meal_ratings_by_survey(self, survey_id):
+        """Получает оценки блюд по ID анкеты"""
+        try:
+            return await self._select("meal_ratings", survey_id=survey_id)
+        except Exception as e:
+            logger.error(f"Ошибка получения оценок блюд: {e}")
+            raise
+
+    # Statistics methods
+    async def get_daily_stats(self, date=None):
+        """Получает анкеты за день вместе с users, meal_ratings и meal_comments"""
+        try:
+            if not date:
+                date = datetime.now().date().isoformat()
+
+            surveys = await self._fetchall("SELECT * FROM surveys WHERE date = ? ORDER BY id", (date,))
+            users = await self._fetchall(
+                "SELECT u.* FROM users u JOIN surveys s ON s.telegram_id = u.telegram_id WHERE s.date = ?",
+                (date,)
+            )
+            ratings = await self._fetchall(
+                "SELECT r.* FROM meal_ratings r JOIN surveys s ON s.id = r.survey_id WHERE s.date = ?",
+                (date,)
+            )
+            comments = await self._fetchall(
+                "SELECT c.* FROM meal_comments c JOIN surveys s ON s.id = c.survey_id WHERE s.date = ?",
+                (date,)
+            )
+
+            # Вкладываем связанные строки так же, как это делает PostgREST
+            users_by_id = index_by(users, 'telegram_id')
+            ratings_by_survey = group_by(ratings, 'survey_id')
+            comments_by_survey = group_by(comments, 'survey_id')
+            for survey in surveys:
+                survey['users'] = users_by_id.get(survey['telegram_id'])
+                survey['meal_ratings'] = ratings_by_survey.get(survey['id'], [])
+                survey['meal_comments'] = comments_by_survey.get(survey['id'], [])
+
+            return QueryResult(surveys)
+        except Exception as e:
+            logger.error(f"Ошибка получения дневной статистики: {e}")
+            raise
+
+    async def daily_summary(self, date=None):
+        """Сводка за день, посчитанная SQL-агрегацией"""
+        try:
+            if not date:
+                date = datetime.now().date().isoformat()
+
+            totals = (await self._fetchall(
+                "SELECT COUNT(*) AS total_surveys, "
+                "COALESCE(SUM(eats_at_school), 0) AS eaters, "
+                "AVG(CASE WHEN eats_at_school THEN overall_satisfaction END) AS avg_overall "
+                "FROM surveys WHERE date = ?",
+                (date,)
+            ))[0]
+            per_meal = await self._fetchall(
+                "SELECT meal_type, SUM(ratings_count) AS count, SUM(ratings_sum) AS total, "
+                "SUM(r1) AS r1, SUM(r2) AS r2, SUM(r3) AS r3, SUM(r4) AS r4, SUM(r5) AS r5 "
+                "FROM daily_meal_stats WHERE date = ? "
+                "GROUP BY meal_type HAVING SUM(ratings_count) > 0",
+                (date,)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка получения сводки за день: {e}")
+            raise
+
+        meals = {}
+        ratings_count = ratings_sum = 0
+        for row in per_meal:
+            meals[row['meal_type']] = {
+                "count": row['count'],
+                "avg": row['total'] / row['count'],
+                "distribution": {rating: row[f'r{rating}'] for rating in range(1, 6)},
+            }
+            ratings_count += row['count']
+            ratings_sum += row['total']
+
+        return QueryResult({
+            "date": date,
+            "total_surveys": totals['total_surveys'],
+            "eaters": totals['eaters'],
+            "non_eaters": totals['total_surveys'] - totals['eaters'],
+            "avg_overall": totals['avg_overall'],
+            "ratings_count": ratings_count,
+            "avg_meal": ratings_sum / ratings_count if ratings_count else None,
+            "meals": meals,
+        })
+
+    async def get_daily_meal_stats(self, date_from=None, date_to=None):
+        """Строки daily_meal_stats за период (границы включительно)"""
+        try:
+            conditions, params = [], []
+            if date_from:
+                conditions.append("date >= ?")
+                params.append(date_from)
+            if date_to:
+                conditions.append("date <= ?")
+                params.append(date_to)
+            where = " WHERE " + " AND ".join(conditions) if conditions else ""
+            return QueryResult(await self._fetchall(
+                f"SELECT * FROM daily_meal_stats{where} ORDER BY date, class, meal_type", params
+            ))
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики по блюдам: {e}")
+            raise
+
+    # Streaming methods
+    def iter_surveys(self, page_size=None, columns="*"):
+        """Постранично отдает все анкеты"""
+        return self._iter_table("surveys", columns, page_size)
+
+    def iter_users(self, page_size=None, columns="*"):
+        """Постранично отдает всех пользователей"""
+        return self._iter_table("users", columns, page_size, key="telegram_id")
+
+    def iter_meal_ratings(self, page_size=None, columns="*"):
+        """Постранично отдает все оценки блюд"""
+        return self._iter_table("meal_ratings", columns, page_size)
+
+    def iter_meal_comments(self, page_size=None, columns="*"):
+        """Постранично отдает все комментарии к блюдам"""
+        return self._iter_table("meal_comments", columns, page_size)
@@ -1,293 +1,334 @@
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
+import asyncio
 import logging
+from datetime import datetime
+
+import httpx
+
+from config import (
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    SUPABASE_TIMEOUT,
+    SUPABASE_CONNECT_TIMEOUT,
+    SUPABASE_MAX_CONNECTIONS,
+    SUPABASE_MAX_KEEPALIVE,
+    SUPABASE_MAX_CONCURRENCY,
+    SUPABASE_PAGE_SIZE,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+)
+from database.base import QueryResult, StorageBackend
+from functions.cache import LRUCache
 
-load_dotenv()
 logger = logging.getLogger(__name__)
 
-class SupabaseClient:
+
+class SupabaseError(Exception):
+    """Ошибка, которую вернул PostgREST"""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+class SupabaseClient(StorageBackend):
+    """Асинхронный клиент PostgREST поверх общего пула соединений httpx"""
+
     def __init__(self):
-        self.client: Client = create_client(
-            supabase_url=os.getenv("SUPABASE_URL"),
-            supabase_key=os.getenv("SUPABASE_KEY")
+        self.url = SUPABASE_URL
+        self.key = SUPABASE_KEY
+        self._http = None
+        # Ограничиваем число одновременных запросов к БД
+        self._semaphore = asyncio.Semaphore(SUPABASE_MAX_CONCURRENCY)
+        # Кэш строк users по telegram_id (write-through)
+        self._users = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+    def _get_http(self) -> httpx.AsyncClient:
+        """Возвращает общий keep-alive клиент, создавая его при первом обращении"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                base_url=f"{self.url}/rest/v1",
+                headers={
+                    "apikey": self.key,
+                    "Authorization": f"Bearer {self.key}",
+                },
+                limits=httpx.Limits(
+                    max_connections=SUPABASE_MAX_CONNECTIONS,
+                    max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+                ),
+                timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+            )
+        return self._http
+
+    async def connect(self):
+        """Открывает пул и устанавливает первое соединение легким запросом"""
+        await self._request("GET", "/users", params={"select": "telegram_id", "limit": 1})
+        logger.info("✅ Соединение с Supabase установлено")
+
+    async def close(self):
+        """Закрывает пул соединений"""
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+            logger.info("🔌 Соединения с Supabase закрыты")
+
+    def is_unavailable_error(self, error):
+        """Сетевые ошибки и ответы 5xx (а также 408 и 429) - PostgREST недоступен;
+        остальные 4xx означают, что он отклонил сам запрос"""
+        if isinstance(error, SupabaseError):
+            return error.status_code >= 500 or error.status_code in (408, 429)
+        return isinstance(error, httpx.TransportError) or super().is_unavailable_error(error)
+
+    async def _request(self, method, path, *, params=None, json=None, prefer=None) -> QueryResult:
+        """Выполняет запрос к PostgREST и возвращает QueryResult"""
+        headers = {"Prefer": prefer} if prefer else None
+        async with self._semaphore:
+            response = await self._get_http().request(
+                method, path, params=params, json=json, headers=headers
+            )
+
+        if response.is_error:
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise SupabaseError(response.status_code, message)
+
+        return QueryResult(response.json() if response.content else [])
+
+    @staticmethod
+    def _filters(**filters):
+        """Преобразует фильтры равенства в параметры PostgREST"""
+        return {column: f"eq.{value}" for column, value in filters.items()}
+
+    async def _select(self, table, columns="*", **filters) -> QueryResult:
+        params = {"select": columns, **self._filters(**filters)}
+        return await self._request("GET", f"/{table}", params=params)
+
+    async def _insert(self, table, data) -> QueryResult:
+        return await self._request("POST", f"/{table}", json=data, prefer="return=representation")
+
+    async def _update(self, table, data, **filters) -> QueryResult:
+        return await self._request(
+            "PATCH", f"/{table}", params=self._filters(**filters), json=data, prefer="return=representation"
         )
-    
+
+    async def _iter_table(self, table, columns="*", page_size=None, key="id"):
+        """Постранично читает таблицу keyset-пагинацией (key > последний ключ)"""
+        page_size = page_size or SUPABASE_PAGE_SIZE
+        if columns != "*" and key not in [c.strip() for c in columns.split(",")]:
+            columns = f"{key},{columns}"
+
+        last_key = None
+        while True:
+            params = {"select": columns, "order": f"{key}.asc", "limit": page_size}
+            if last_key is not None:
+                params[key] = f"gt.{last_key}"
+
+            page = (await self._request("GET", f"/{table}", params=params)).data
+            # Пустая страница - признак конца: короткая страница может быть
+            # вызвана лимитом строк PostgREST, а не концом таблицы
+            if not page:
+                return
+
+            for row in page:
+                yield row
+            last_key = page[-1][key]
+
+    async def _rpc(self, function, params) -> QueryResult:
+        return await self._request("POST", f"/rpc/{function}", json=params)
+
     # Users methods
     async def create_user(self, user_data):
         """Создает нового пользователя"""
         try:
-            return self.client.table("users").insert(user_data).execute()
+            response = await self._insert("users", user_data)
         except Exception as e:
             logger.error(f"Ошибка создания пользователя: {e}")
             raise
-    
+
+        self._cache_user(user_data["telegram_id"], response)
+        return response
+
     async def get_user(self, telegram_id):
-        """Получает пользователя по telegram_id"""
+        """Получает пользователя по telegram_id (сначала из кэша)"""
+        cached = self._users.get(telegram_id)
+        if cached is not None:
+            return QueryResult([cached])
+
         try:
-            return self.client.table("users").select("*").eq("telegram_id", telegram_id).execute()
+            response = await self._select("users", telegram_id=telegram_id)
         except Exception as e:
             logger.error(f"Ошибка получения пользователя: {e}")
             raise
-    
-    async def user_exists(self, telegram_id):
-        """Проверяет существует ли пользователь"""
-        response = await self.get_user(telegram_id)
-        return len(response.data) > 0
-    
+
+        if response.data:
+            self._users.set(telegram_id, response.data[0])
+        return response
+
     async def update_user_info(self, telegram_id, full_name, class_name):
-        """Обновляет информацию о пользователе"""
+        """Обновляет информацию о пользователе
+
+        PATCH отправляется всегда: кэш может отставать от строки, измененной
+        другим воркером, поэтому сравнивать с ним нельзя.
+        """
+        changes = {
+            "full_name": full_name,
+            "class": class_name,
+            "has_profile": True
+        }
+
         try:
-            return self.client.table("users").update({
-                "full_name": full_name,
-                "class": class_name,
-                "has_profile": True
-            }).eq("telegram_id", telegram_id).execute()
+            response = await self._update("users", changes, telegram_id=telegram_id)
         except Exception as e:
             logger.error(f"Ошибка обновления пользователя: {e}")
             raise
-    
+
+        self._cache_user(telegram_id, response)
+        return response
+
+    def _cache_user(self, telegram_id, response):
+        """Кэширует только полную строку из ответа PostgREST, иначе сбрасывает ключ"""
+        if response.data:
+            self._users.set(telegram_id, response.data[0])
+        else:
+            self._users.pop(telegram_id)
+
+    def user_cache_stats(self):
+        """Счетчики кэша пользователей (попадания, промахи, вытеснения)"""
+        return self._users.stats()
+
     # Survey methods
-    # db_supabase.py - исправляем метод create_survey
-    async def create_survey(self, survey_data):
-        """Создает новую анкету"""
+    async def save_survey(self, user, survey, ratings, comments):
+        """Сохраняет пользователя, анкету за дату, оценки и комментарии одной транзакцией
+
+        Выполняется серверной функцией save_survey (migrations/001_save_survey.sql),
+        анкета перезаписывается по ключу (telegram_id, date).
+        Возвращает data вида {"survey_id": ..., "created": True/False}.
+        """
         try:
-            # Добавляем дату создания если не указана
-            if 'date' not in survey_data:
-                from datetime import datetime
-                survey_data['date'] = datetime.now().date().isoformat()
-            
-            # Убедимся, что все необходимые поля есть
-            default_fields = {
-                'no_school_reason': '',
-                'overall_comment': '',
-                'overall_satisfaction': None
-            }
-            
-            for field, default_value in default_fields.items():
-                if field not in survey_data:
-                    survey_data[field] = default_value
-                    
-            return self.client.table("surveys").insert(survey_data).execute()
+            response = await self._rpc("save_survey", {
+                "p_user": user,
+                "p_survey": survey,
+                "p_ratings": ratings,
+                "p_comments": comments
+            })
         except Exception as e:
-            logger.error(f"Ошибка создания анкеты: {e}")
+            logger.error(f"Ошибка сохранения опроса: {e}")
             raise
-    
+
+        # Функция могла изменить строку пользователя, а полную строку она не
+        # возвращает: следующий get_user перечитает ее из базы
+        self._users.pop(user["telegram_id"])
+        return response
+
     async def get_user_surveys(self, telegram_id):
         """Получает анкеты пользователя"""
         try:
-            return self.client.table("surveys").select("*").eq("telegram_id", telegram_id).execute()
+            return await self._select("surveys", telegram_id=telegram_id)
         except Exception as e:
             logger.error(f"Ошибка получения анкет: {e}")
             raise
-    
+
     # Meal ratings methods
-    async def add_meal_rating(self, rating_data):
-        """Добавляет оценку блюда"""
-        try:
-            return self.client.table("meal_ratings").insert(rating_data).execute()
-        except Exception as e:
-            logger.error(f"Ошибка добавления оценки блюда: {e}")
-            raise
-    
     async def get_meal_ratings_by_survey(self, survey_id):
         """Получает оценки блюд по ID анкеты"""
         try:
-            return self.client.table("meal_ratings").select("*").eq("survey_id", survey_id).execute()
+            return await self._select("meal_ratings", survey_id=survey_id)
         except Exception as e:
             logger.error(f"Ошибка получения оценок блюд: {e}")
             raise
-    
-    # Comments methods
-    async def add_meal_comment(self, comment_data):
-        """Добавляет комментарий к блюду"""
-        try:
-            return self.client.table("meal_comments").insert(comment_data).execute()
-        except Exception as e:
-            logger.error(f"Ошибка добавления комментария: {e}")
-            raise
 
     # Statistics methods
-    async def get_all_surveys(self):
-        """Получает все анкеты"""
-        try:
-            return self.client.table("surveys").select("*, users(*), meal_ratings(*), meal_comments(*)").execute()
-        except Exception as e:
-            logger.error(f"Ошибка получения анкет: {e}")
-            raise
-    
     async def get_daily_stats(self, date=None):
         """Получает статистику за день"""
         try:
             if not date:
-                from datetime import datetime
                 date = datetime.now().date().isoformat()
-            
-            return self.client.table("surveys").select("*, users(*), meal_ratings(*), meal_comments(*)").eq("date", date).execute()
+
+            return await self._select(
+                "surveys", "*, users(*), meal_ratings(*), meal_comments(*)", date=date
+            )
         except Exception as e:
             logger.error(f"Ошибка получения дневной статистики: {e}")
             raise
-        
-    async def update_survey(self, survey_id, survey_data):
-        """Обновляет существующую анкету"""
-        try:
-            return self.client.table("surveys").update(survey_data).eq("id", survey_id).execute()
-        except Exception as e:
-            logger.error(f"❌ Error updating survey: {e}")
-            raise
 
-    async def delete_meal_ratings(self, survey_id):
-        """Удаляет все оценки блюд для анкеты"""
+    async def daily_summary(self, date=None):
+        """Сводка за день (серверная функция daily_summary, migrations/003_daily_meal_stats.sql)"""
         try:
-            return self.client.table("meal_ratings").delete().eq("survey_id", survey_id).execute()
-        except Exception as e:
-            logger.error(f"❌ Error deleting meal ratings: {e}")
-            raise
+            if not date:
+                date = datetime.now().date().isoformat()
 
-    async def delete_meal_comments(self, survey_id):
-        """Удаляет все комментарии для анкеты"""
-        try:
-            return self.client.table("meal_comments").delete().eq("survey_id", survey_id).execute()
+            summary = (await self._rpc("daily_summary", {"p_date": date})).data
         except Exception as e:
-            logger.error(f"❌ Error deleting meal comments: {e}")
+            logger.error(f"Ошибка получения сводки за день: {e}")
             raise
+
+        # JSON отдает ключи распределения строками, а средние - числами произвольной точности
+        summary["non_eaters"] = summary["total_surveys"] - summary["eaters"]
+        for field in ("avg_overall", "avg_meal"):
+            if summary[field] is not None:
+                summary[field] = float(summary[field])
+        for meal in summary["meals"].values():
+            meal["avg"] = float(meal["avg"])
+            meal["distribution"] = {int(rating): n for rating, n in meal["distribution"].items()}
+        return QueryResult(summary)
+
     async def get_user_survey(self, telegram_id):
         """Получает анкету пользователя по telegram_id"""
         try:
-            return self.client.table("surveys").select("*").eq("telegram_id", telegram_id).execute()
+            return await self._select("surveys", telegram_id=telegram_id)
         except Exception as e:
             logger.error(f"❌ Error getting user survey: {e}")
             raise
-    async def get_surveys_with_details(self):
-        """Получает анкеты с деталями (для статистики)"""
-        try:
-            # Получаем отдельно данные и соединяем в коде
-            surveys_response = self.client.table("surveys").select("*").execute()
-            users_response = self.client.table("users").select("*").execute()
-            meal_ratings_response = self.client.table("meal_ratings").select("*").execute()
-            meal_comments_response = self.client.table("meal_comments").select("*").execute()
-            
-            # Собираем данные вручную
-            result_data = []
-            for survey in surveys_response.data:
-                # Находим пользователя
-                user = next((u for u in users_response.data if u['telegram_id'] == survey['telegram_id']), {})
-                
-                # Находим оценки блюд для этой анкеты
-                survey_ratings = [r for r in meal_ratings_response.data if r['survey_id'] == survey['id']]
-                
-                # Находим комментарии для этой анкеты
-                survey_comments = [c for c in meal_comments_response.data if c['survey_id'] == survey['id']]
-                
-                survey_with_details = {
-                    **survey,
-                    'user': user,
-                    'meal_ratings': survey_ratings,
-                    'meal_comments': survey_comments
-                }
-                result_data.append(survey_with_details)
-            
-            # Создаем объект с атрибутом data для совместимости
-            class Result:
-                def __init__(self, data):
-                    self.data = data
-            
-            return Result(result_data)
-            
-        except Exception as e:
-            logger.error(f"❌ Error getting surveys with details: {e}")
-            raise
 
-    async def get_all_surveys(self):
-        """Получает все анкеты"""
+    async def get_daily_meal_stats(self, date_from=None, date_to=None):
+        """Строки daily_meal_stats за период (границы включительно)"""
         try:
-            return self.client.table("surveys").select("*").execute()
-        except Exception as e:
-            logger.error(f"❌ Error getting all surveys: {e}")
-            raise
+            filters = []
+            if date_from:
+                filters.append(("date", f"gte.{date_from}"))
+            if date_to:
+                filters.append(("date", f"lte.{date_to}"))
 
-    async def get_all_users(self):
-        """Получает всех пользователей"""
-        try:
-            return self.client.table("users").select("*").execute()
+            # У агрегата составной ключ, поэтому страницы идут по offset:
+            # строк в нем на порядки меньше, чем в meal_ratings
+            rows = []
+            while True:
+                params = filters + [
+                    ("select", "*"),
+                    ("order", "date.asc,class.asc,meal_type.asc"),
+                    ("limit", SUPABASE_PAGE_SIZE),
+                    ("offset", len(rows)),
+                ]
+                page = (await self._request("GET", "/daily_meal_stats", params=params)).data
+                if not page:
+                    return QueryResult(rows)
+                rows.extend(page)
         except Exception as e:
-            logger.error(f"❌ Error getting all users: {e}")
+            logger.error(f"Ошибка получения статистики по блюдам: {e}")
             raise
 
-    async def get_all_meal_ratings(self):
-        """Получает все оценки блюд"""
-        try:
-            return self.client.table("meal_ratings").select("*").execute()
-        except Exception as e:
-            logger.error(f"❌ Error getting all meal ratings: {e}")
-            raise
+    # Streaming methods
+    def iter_surveys(self, page_size=None, columns="*"):
+        """Постранично отдает все анкеты"""
+        return self._iter_table("surveys", columns, page_size)
+
+    def iter_users(self, page_size=None, columns="*"):
+        """Постранично отдает всех пользователей"""
+        return self._iter_table("users", columns, page_size, key="telegram_id")
+
+    def iter_meal_ratings(self, page_size=None, columns="*"):
+        """Постранично отдает все оценки блюд"""
+        return self._iter_table("meal_ratings", columns, page_size)
+
+    def iter_meal_comments(self, page_size=None, columns="*"):
+        """Постранично отдает все комментарии к блюдам"""
+        return self._iter_table("meal_comments", columns, page_size)
 
-    async def get_all_meal_comments(self):
-        """Получает все комментарии к блюдам"""
-        try:
-            return self.client.table("meal_comments").select("*").execute()
-        except Exception as e:
-            logger.error(f"❌ Error getting all meal comments: {e}")
-            raise
-    
-    async def create_survey(self, survey_data):
-        """Создает новую анкету"""
-        try:
-            # Добавляем дату создания если не указана
-            if 'date' not in survey_data:
-                from datetime import datetime
-                survey_data['date'] = datetime.now().date().isoformat()
-            
-            # Убедимся, что все необходимые поля есть
-            default_fields = {
-                'no_school_reason': '',
-                'overall_comment': '',
-                'overall_satisfaction': None
-            }
-            
-            for field, default_value in default_fields.items():
-                if field not in survey_data:
-                    survey_data[field] = default_value
-                    
-            return self.client.table("surveys").insert(survey_data).execute()
-        except Exception as e:
-            logger.error(f"Ошибка создания анкеты: {e}")
-            raise
-    
     async def get_user_survey_for_date(self, telegram_id, date):
         """Получает анкету пользователя для конкретной даты"""
         try:
-            return self.client.table("surveys").select("*").eq("telegram_id", telegram_id).eq("date", date).execute()
+            return await self._select("surveys", telegram_id=telegram_id, date=date)
         except Exception as e:
             logger.error(f"❌ Error getting user survey for date: {e}")
             raise
-    
-    async def update_survey_for_date(self, telegram_id, date, survey_data):
-        """Обновляет анкету для конкретной даты"""
-        try:
-            return self.client.table("surveys").update(survey_data).eq("telegram_id", telegram_id).eq("date", date).execute()
-        except Exception as e:
-            logger.error(f"❌ Error updating survey for date: {e}")
-            raise
-    
-    async def create_or_update_survey_for_date(self, telegram_id, date, survey_data):
-        """Создает или обновляет анкету для конкретной даты"""
-        try:
-            # Проверяем существующую анкету
-            existing_survey = await self.get_user_survey_for_date(telegram_id, date)
-            
-            if existing_survey.data:
-                # Обновляем существующую
-                survey_id = existing_survey.data[0]['id']
-                return self.client.table("surveys").update(survey_data).eq("id", survey_id).execute()
-            else:
-                # Создаем новую
-                survey_data['telegram_id'] = telegram_id
-                survey_data['date'] = date
-                return await self.create_survey(survey_data)
-                
-        except Exception as e:
-            logger.error(f"❌ Error creating/updating survey for date: {e}")
-            raise
-
-supabase_client = SupabaseClient()
\ No newline at end of file
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseEventIsolation,
+    BaseStorage,
+    DefaultKeyBuilder,
+    KeyBuilder,
+    StateType,
+    StorageKey,
+)
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+
+from config import FSM_STORAGE, FSM_SQLITE_PATH, FSM_STATE_TTL, FSM_DATA_TTL, REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+FSM_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm_sessions (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    state_expires_at REAL,
+    data TEXT,
+    data_expires_at REAL
+);
+"""
+
+# Как часто удалять просроченные сессии (секунды)
+PURGE_INTERVAL = 60
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище на SQLite: опросы переживают перезапуск бота, ключи истекают по TTL"""
+
+    def __init__(self, path=FSM_SQLITE_PATH, state_ttl=FSM_STATE_TTL, data_ttl=FSM_DATA_TTL,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.path = path
+        self.state_ttl = state_ttl
+        self.data_ttl = data_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._db = None
+        self._lock = asyncio.Lock()
+        self._purged_at = 0.0
+
+    async def _connection(self):
+        if self._db is None:
+            self._db = await aiosqlite.connect(self.path)
+            await self._db.execute("PRAGMA journal_mode=WAL")
+            await self._db.executescript(FSM_SCHEMA)
+            await self._db.commit()
+            logger.info(f"🗄 FSM хранилище SQLite открыто: {self.path}")
+        return self._db
+
+    @staticmethod
+    def _expires_at(ttl):
+        return time.time() + ttl if ttl else None
+
+    async def _purge_expired(self, db):
+        """Удаляет сессии, у которых истекли и состояние, и данные"""
+        now = time.time()
+        if now - self._purged_at < PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        await db.execute(
+            "DELETE FROM fsm_sessions WHERE "
+            "(state IS NULL OR state_expires_at < ?) AND (data IS NULL OR data_expires_at < ?)",
+            (now, now)
+        )
+
+    async def _read(self, key: StorageKey, column):
+        async with self._lock:
+            db = await self._connection()
+            async with db.execute(
+                f"SELECT {column}, {column}_expires_at FROM fsm_sessions WHERE key = ?",
+                (self.key_builder.build(key),)
+            ) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return value
+
+    async def _write(self, key: StorageKey, column, value, ttl):
+        async with self._lock:
+            db = await self._connection()
+            await db.execute(
+                f"INSERT INTO fsm_sessions (key, {column}, {column}_expires_at) VALUES (?, ?, ?) "
+                f"ON CONFLICT (key) DO UPDATE SET {column} = excluded.{column}, "
+                f"{column}_expires_at = excluded.{column}_expires_at",
+                (self.key_builder.build(key), value, self._expires_at(ttl) if value is not None else None)
+            )
+            await self._purge_expired(db)
+            await db.commit()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._write(key, "state", value, self.state_ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._read(key, "state")
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        value = json.dumps(data, ensure_ascii=False) if data else None
+        await self._write(key, "data", value, self.data_ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self._read(key, "data")
+        return json.loads(value) if value else {}
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+            logger.info("🔌 FSM хранилище SQLite закрыто")
+
+
+def create_fsm_storage(backend: str = FSM_STORAGE) -> BaseStorage:
+    """Создает FSM-хранилище, выбранное в конфигурации (FSM_STORAGE)"""
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(REDIS_URL, state_ttl=FSM_STATE_TTL or None, data_ttl=FSM_DATA_TTL or None)
+    if backend == "sqlite":
+        return SQLiteStorage()
+    raise ValueError(f"❌ Неизвестное FSM хранилище: {backend} (ожидается memory, redis или sqlite)")
+
+
+def create_events_isolation(storage: BaseStorage) -> BaseEventIsolation:
+    """Изоляция апдейтов одной сессии: следующий апдейт пользователя ждет, пока
+    предыдущий обработан и его снимок состояния записан. С Redis блокировка общая
+    для всех процессов бота, иначе - в пределах процесса"""
+    create_isolation = getattr(storage, "create_isolation", None)
+    if create_isolation is not None:
+        return create_isolation()
+    return SimpleEventIsolation()
@@ -0,0 +1,17 @@
+from collections import defaultdict
+
+
+def index_by(rows, key):
+    """Строит индекс {значение ключа: строка} (при повторах остается первая строка)"""
+    index = {}
+    for row in rows:
+        index.setdefault(row.get(key), row)
+    return index
+
+
+def group_by(rows, key):
+    """Строит мультииндекс {значение ключа: [строки]} с сохранением порядка"""
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row.get(key)].append(row)
+    return groups
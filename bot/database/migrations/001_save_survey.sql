@@ -0,0 +1,95 @@
+-- 001_save_survey.sql
+-- Одна анкета на пользователя в день и сохранение опроса одним RPC-вызовом.
+
+BEGIN;
+
+-- Перед добавлением ограничения убираем дубликаты анкет за один день,
+-- оставляя самую новую (с наибольшим id)
+CREATE TEMP TABLE duplicate_surveys ON COMMIT DROP AS
+SELECT s.id
+FROM surveys s
+JOIN surveys newer
+  ON newer.telegram_id = s.telegram_id
+ AND newer.date = s.date
+ AND newer.id > s.id;
+
+DELETE FROM meal_ratings WHERE survey_id IN (SELECT id FROM duplicate_surveys);
+DELETE FROM meal_comments WHERE survey_id IN (SELECT id FROM duplicate_surveys);
+DELETE FROM surveys WHERE id IN (SELECT id FROM duplicate_surveys);
+
+ALTER TABLE surveys
+    ADD CONSTRAINT surveys_telegram_id_date_key UNIQUE (telegram_id, date);
+
+CREATE INDEX IF NOT EXISTS meal_ratings_survey_id_idx ON meal_ratings (survey_id);
+CREATE INDEX IF NOT EXISTS meal_comments_survey_id_idx ON meal_comments (survey_id);
+
+-- Сохраняет пользователя, анкету за дату, оценки и комментарии в одной транзакции.
+-- Профиль пользователя перезаписывается только заполненным профилем (has_profile = true),
+-- старые оценки и комментарии анкеты заменяются новыми.
+CREATE OR REPLACE FUNCTION save_survey(
+    p_user jsonb,
+    p_survey jsonb,
+    p_ratings jsonb DEFAULT '[]'::jsonb,
+    p_comments jsonb DEFAULT '[]'::jsonb
+) RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_telegram_id bigint := (p_user->>'telegram_id')::bigint;
+    v_survey_id surveys.id%TYPE;
+    v_created boolean;
+BEGIN
+    INSERT INTO users (telegram_id, full_name, class, has_profile)
+    VALUES (
+        v_telegram_id,
+        coalesce(p_user->>'full_name', ''),
+        coalesce(p_user->>'class', ''),
+        coalesce((p_user->>'has_profile')::boolean, false)
+    )
+    ON CONFLICT (telegram_id) DO UPDATE
+        SET full_name = EXCLUDED.full_name,
+            class = EXCLUDED.class,
+            has_profile = EXCLUDED.has_profile
+        WHERE EXCLUDED.has_profile
+          AND (users.full_name, users.class, users.has_profile)
+              IS DISTINCT FROM (EXCLUDED.full_name, EXCLUDED.class, EXCLUDED.has_profile);
+
+    INSERT INTO surveys (
+        telegram_id, date, eats_at_school, no_school_reason,
+        overall_satisfaction, overall_comment
+    )
+    VALUES (
+        v_telegram_id,
+        coalesce((p_survey->>'date')::date, current_date),
+        coalesce((p_survey->>'eats_at_school')::boolean, false),
+        coalesce(p_survey->>'no_school_reason', ''),
+        (p_survey->>'overall_satisfaction')::int,
+        coalesce(p_survey->>'overall_comment', '')
+    )
+    ON CONFLICT (telegram_id, date) DO UPDATE
+        SET eats_at_school = EXCLUDED.eats_at_school,
+            no_school_reason = EXCLUDED.no_school_reason,
+            overall_satisfaction = EXCLUDED.overall_satisfaction,
+            overall_comment = EXCLUDED.overall_comment
+    RETURNING id, (xmax = 0) INTO v_survey_id, v_created;
+
+    DELETE FROM meal_ratings WHERE survey_id = v_survey_id;
+    DELETE FROM meal_comments WHERE survey_id = v_survey_id;
+
+    INSERT INTO meal_ratings (survey_id, meal_type, rating)
+    SELECT v_survey_id, r->>'meal_type', (r->>'rating')::int
+    FROM jsonb_array_elements(coalesce(p_ratings, '[]'::jsonb)) AS r;
+
+    INSERT INTO meal_comments (survey_id, meal_type, reason_comment, alternative_comment)
+    SELECT
+        v_survey_id,
+        c->>'meal_type',
+        coalesce(c->>'reason_comment', ''),
+        coalesce(c->>'alternative_comment', '')
+    FROM jsonb_array_elements(coalesce(p_comments, '[]'::jsonb)) AS c;
+
+    RETURN jsonb_build_object('survey_id', v_survey_id, 'created', v_created);
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,62 @@
+-- 002_daily_summary.sql
+-- Сводка за день одним небольшим ответом вместо выгрузки всех оценок.
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS surveys_date_idx ON surveys (date);
+
+-- Возвращает число анкет, средние оценки и распределение оценок по блюдам за дату
+CREATE OR REPLACE FUNCTION daily_summary(p_date date DEFAULT current_date)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+AS $$
+    WITH day_surveys AS (
+        SELECT id, eats_at_school, overall_satisfaction
+        FROM surveys
+        WHERE date = p_date
+    ),
+    day_ratings AS (
+        SELECT r.meal_type, r.rating
+        FROM meal_ratings r
+        JOIN day_surveys s ON s.id = r.survey_id
+    ),
+    meal_buckets AS (
+        SELECT meal_type, rating, count(*) AS n
+        FROM day_ratings
+        GROUP BY meal_type, rating
+    ),
+    per_meal AS (
+        SELECT
+            meal_type,
+            sum(n) AS cnt,
+            sum(rating * n)::numeric / sum(n) AS avg_rating,
+            jsonb_object_agg(rating, n) AS distribution
+        FROM meal_buckets
+        GROUP BY meal_type
+    )
+    SELECT jsonb_build_object(
+        'date', p_date,
+        'total_surveys', (SELECT count(*) FROM day_surveys),
+        'eaters', (SELECT count(*) FROM day_surveys WHERE eats_at_school),
+        'avg_overall', (
+            SELECT avg(overall_satisfaction)
+            FROM day_surveys
+            WHERE eats_at_school AND overall_satisfaction IS NOT NULL
+        ),
+        'ratings_count', (SELECT count(*) FROM day_ratings),
+        'avg_meal', (SELECT avg(rating) FROM day_ratings),
+        'meals', coalesce(
+            (
+                SELECT jsonb_object_agg(
+                    meal_type,
+                    jsonb_build_object('count', cnt, 'avg', avg_rating, 'distribution', distribution)
+                )
+                FROM per_meal
+            ),
+            '{}'::jsonb
+        )
+    );
+$$;
+
+COMMIT;
@@ -0,0 +1,220 @@
+-- 003_daily_meal_stats.sql
+-- Инкрементально поддерживаемая статистика оценок по (дата, класс, блюдо).
+
+BEGIN;
+
+-- Класс на момент сохранения анкеты: по нему же вычитаются старые оценки
+-- при повторной отправке, даже если ученик успел сменить класс в профиле
+ALTER TABLE surveys ADD COLUMN IF NOT EXISTS class_name text;
+
+UPDATE surveys s
+SET class_name = coalesce(u.class, '')
+FROM users u
+WHERE u.telegram_id = s.telegram_id
+  AND s.class_name IS NULL;
+
+UPDATE surveys SET class_name = '' WHERE class_name IS NULL;
+
+CREATE TABLE IF NOT EXISTS daily_meal_stats (
+    date date NOT NULL,
+    class text NOT NULL DEFAULT '',
+    meal_type text NOT NULL,
+    ratings_count integer NOT NULL DEFAULT 0,
+    ratings_sum integer NOT NULL DEFAULT 0,
+    r1 integer NOT NULL DEFAULT 0,
+    r2 integer NOT NULL DEFAULT 0,
+    r3 integer NOT NULL DEFAULT 0,
+    r4 integer NOT NULL DEFAULT 0,
+    r5 integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, class, meal_type)
+);
+
+-- Заполняем агрегат по уже сохраненным оценкам
+TRUNCATE daily_meal_stats;
+
+INSERT INTO daily_meal_stats (date, class, meal_type, ratings_count, ratings_sum, r1, r2, r3, r4, r5)
+SELECT
+    s.date,
+    s.class_name,
+    r.meal_type,
+    count(*),
+    sum(r.rating),
+    count(*) FILTER (WHERE r.rating = 1),
+    count(*) FILTER (WHERE r.rating = 2),
+    count(*) FILTER (WHERE r.rating = 3),
+    count(*) FILTER (WHERE r.rating = 4),
+    count(*) FILTER (WHERE r.rating = 5)
+FROM meal_ratings r
+JOIN surveys s ON s.id = r.survey_id
+GROUP BY s.date, s.class_name, r.meal_type;
+
+-- Прибавляет (p_sign = 1) или вычитает (p_sign = -1) оценки анкеты из агрегата
+CREATE OR REPLACE FUNCTION apply_daily_meal_stats(p_survey_id bigint, p_sign integer)
+RETURNS void
+LANGUAGE sql
+AS $$
+    INSERT INTO daily_meal_stats AS d (date, class, meal_type, ratings_count, ratings_sum, r1, r2, r3, r4, r5)
+    SELECT
+        s.date,
+        s.class_name,
+        r.meal_type,
+        p_sign * count(*),
+        p_sign * sum(r.rating),
+        p_sign * count(*) FILTER (WHERE r.rating = 1),
+        p_sign * count(*) FILTER (WHERE r.rating = 2),
+        p_sign * count(*) FILTER (WHERE r.rating = 3),
+        p_sign * count(*) FILTER (WHERE r.rating = 4),
+        p_sign * count(*) FILTER (WHERE r.rating = 5)
+    FROM meal_ratings r
+    JOIN surveys s ON s.id = r.survey_id
+    WHERE r.survey_id = p_survey_id
+    GROUP BY s.date, s.class_name, r.meal_type
+    ON CONFLICT (date, class, meal_type) DO UPDATE
+        SET ratings_count = d.ratings_count + EXCLUDED.ratings_count,
+            ratings_sum = d.ratings_sum + EXCLUDED.ratings_sum,
+            r1 = d.r1 + EXCLUDED.r1,
+            r2 = d.r2 + EXCLUDED.r2,
+            r3 = d.r3 + EXCLUDED.r3,
+            r4 = d.r4 + EXCLUDED.r4,
+            r5 = d.r5 + EXCLUDED.r5;
+$$;
+
+-- save_survey из 001 + поддержка daily_meal_stats в той же транзакции
+CREATE OR REPLACE FUNCTION save_survey(
+    p_user jsonb,
+    p_survey jsonb,
+    p_ratings jsonb DEFAULT '[]'::jsonb,
+    p_comments jsonb DEFAULT '[]'::jsonb
+) RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_telegram_id bigint := (p_user->>'telegram_id')::bigint;
+    v_date date := coalesce((p_survey->>'date')::date, current_date);
+    v_class text;
+    v_old_survey_id surveys.id%TYPE;
+    v_survey_id surveys.id%TYPE;
+BEGIN
+    -- Параллельные сохранения одной анкеты выполняются по очереди
+    PERFORM pg_advisory_xact_lock(hashtextextended(v_telegram_id::text || ':' || v_date::text, 0));
+
+    INSERT INTO users (telegram_id, full_name, class, has_profile)
+    VALUES (
+        v_telegram_id,
+        coalesce(p_user->>'full_name', ''),
+        coalesce(p_user->>'class', ''),
+        coalesce((p_user->>'has_profile')::boolean, false)
+    )
+    ON CONFLICT (telegram_id) DO UPDATE
+        SET full_name = EXCLUDED.full_name,
+            class = EXCLUDED.class,
+            has_profile = EXCLUDED.has_profile
+        WHERE EXCLUDED.has_profile
+          AND (users.full_name, users.class, users.has_profile)
+              IS DISTINCT FROM (EXCLUDED.full_name, EXCLUDED.class, EXCLUDED.has_profile);
+
+    SELECT coalesce(class, '') INTO v_class FROM users WHERE telegram_id = v_telegram_id;
+
+    -- При повторной отправке сначала вычитаем старые оценки
+    SELECT id INTO v_old_survey_id
+    FROM surveys
+    WHERE telegram_id = v_telegram_id AND date = v_date
+    FOR UPDATE;
+
+    IF v_old_survey_id IS NOT NULL THEN
+        PERFORM apply_daily_meal_stats(v_old_survey_id, -1);
+    END IF;
+
+    INSERT INTO surveys (
+        telegram_id, date, class_name, eats_at_school, no_school_reason,
+        overall_satisfaction, overall_comment
+    )
+    VALUES (
+        v_telegram_id,
+        v_date,
+        v_class,
+        coalesce((p_survey->>'eats_at_school')::boolean, false),
+        coalesce(p_survey->>'no_school_reason', ''),
+        (p_survey->>'overall_satisfaction')::int,
+        coalesce(p_survey->>'overall_comment', '')
+    )
+    ON CONFLICT (telegram_id, date) DO UPDATE
+        SET class_name = EXCLUDED.class_name,
+            eats_at_school = EXCLUDED.eats_at_school,
+            no_school_reason = EXCLUDED.no_school_reason,
+            overall_satisfaction = EXCLUDED.overall_satisfaction,
+            overall_comment = EXCLUDED.overall_comment
+    RETURNING id INTO v_survey_id;
+
+    DELETE FROM meal_ratings WHERE survey_id = v_survey_id;
+    DELETE FROM meal_comments WHERE survey_id = v_survey_id;
+
+    INSERT INTO meal_ratings (survey_id, meal_type, rating)
+    SELECT v_survey_id, r->>'meal_type', (r->>'rating')::int
+    FROM jsonb_array_elements(coalesce(p_ratings, '[]'::jsonb)) AS r;
+
+    INSERT INTO meal_comments (survey_id, meal_type, reason_comment, alternative_comment)
+    SELECT
+        v_survey_id,
+        c->>'meal_type',
+        coalesce(c->>'reason_comment', ''),
+        coalesce(c->>'alternative_comment', '')
+    FROM jsonb_array_elements(coalesce(p_comments, '[]'::jsonb)) AS c;
+
+    PERFORM apply_daily_meal_stats(v_survey_id, 1);
+
+    RETURN jsonb_build_object('survey_id', v_survey_id, 'created', v_old_survey_id IS NULL);
+END;
+$$;
+
+-- daily_summary из 002: оценки блюд берутся из агрегата, а не из meal_ratings
+CREATE OR REPLACE FUNCTION daily_summary(p_date date DEFAULT current_date)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+AS $$
+    WITH day_surveys AS (
+        SELECT eats_at_school, overall_satisfaction
+        FROM surveys
+        WHERE date = p_date
+    ),
+    per_meal AS (
+        SELECT
+            meal_type,
+            sum(ratings_count) AS cnt,
+            sum(ratings_sum) AS total,
+            sum(r1) AS r1, sum(r2) AS r2, sum(r3) AS r3, sum(r4) AS r4, sum(r5) AS r5
+        FROM daily_meal_stats
+        WHERE date = p_date
+        GROUP BY meal_type
+        HAVING sum(ratings_count) > 0
+    )
+    SELECT jsonb_build_object(
+        'date', p_date,
+        'total_surveys', (SELECT count(*) FROM day_surveys),
+        'eaters', (SELECT count(*) FROM day_surveys WHERE eats_at_school),
+        'avg_overall', (
+            SELECT avg(overall_satisfaction)
+            FROM day_surveys
+            WHERE eats_at_school AND overall_satisfaction IS NOT NULL
+        ),
+        'ratings_count', (SELECT coalesce(sum(cnt), 0) FROM per_meal),
+        'avg_meal', (SELECT sum(total)::numeric / nullif(sum(cnt), 0) FROM per_meal),
+        'meals', coalesce(
+            (
+                SELECT jsonb_object_agg(
+                    meal_type,
+                    jsonb_build_object(
+                        'count', cnt,
+                        'avg', total::numeric / cnt,
+                        'distribution', jsonb_build_object('1', r1, '2', r2, '3', r3, '4', r4, '5', r5)
+                    )
+                )
+                FROM per_meal
+            ),
+            '{}'::jsonb
+        )
+    );
+$$;
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- 004_meal_rating_check.sql
+-- Оценка блюда - целое от 1 до 5, как в SQLite-хранилище: иначе save_survey
+-- записал бы оценку, которую daily_meal_stats учтет в ratings_count, но не в r1..r5.
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'meal_ratings_rating_range'
+    ) THEN
+        -- NOT VALID: проверяются новые строки, старые не блокируют миграцию
+        ALTER TABLE meal_ratings
+            ADD CONSTRAINT meal_ratings_rating_range CHECK (rating BETWEEN 1 AND 5) NOT VALID;
+    END IF;
+END
+$$;
+
+COMMIT;
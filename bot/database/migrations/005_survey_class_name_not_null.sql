@@ -0,0 +1,20 @@
+-- 005_survey_class_name_not_null.sql
+-- surveys.class_name из 003 остался nullable без значения по умолчанию: анкета,
+-- вставленная в обход save_survey, получала NULL, и ее оценки в daily_meal_stats
+-- не совпадали ни с одним классом. Теперь колонка обязательна, как в SQLite.
+
+BEGIN;
+
+UPDATE surveys s
+SET class_name = coalesce(u.class, '')
+FROM users u
+WHERE u.telegram_id = s.telegram_id
+  AND s.class_name IS NULL;
+
+UPDATE surveys SET class_name = '' WHERE class_name IS NULL;
+
+ALTER TABLE surveys
+    ALTER COLUMN class_name SET DEFAULT '',
+    ALTER COLUMN class_name SET NOT NULL;
+
+COMMIT;
@@ -0,0 +1,16 @@
+from config import STORAGE_BACKEND
+from database.base import StorageBackend
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> StorageBackend:
+    """Создает хранилище, выбранное в конфигурации (STORAGE_BACKEND)"""
+    if backend == "supabase":
+        from database.db_supabase import SupabaseClient
+        return SupabaseClient()
+    if backend == "sqlite":
+        from database.db_sqlite import SQLiteClient
+        return SQLiteClient()
+    raise ValueError(f"❌ Неизвестное хранилище: {backend} (ожидается supabase или sqlite)")
+
+
+storage = create_storage()
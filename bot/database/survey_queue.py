@@ -0,0 +1,321 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from config import (
+    SURVEY_JOURNAL_PATH,
+    SURVEY_FLUSH_BATCH,
+    SURVEY_FLUSH_INTERVAL,
+    SURVEY_RETRY_MAX_DELAY,
+    SURVEY_DRAIN_TIMEOUT,
+    SURVEY_MAX_ATTEMPTS,
+)
+from database.storage import storage
+
+logger = logging.getLogger(__name__)
+
+
+class SurveyJournal:
+    """Локальный журнал завершенных опросов на SQLite (переживает перезапуск)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_surveys ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " telegram_id INTEGER NOT NULL,"
+                " date TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS pending_surveys_key_idx"
+                " ON pending_surveys (telegram_id, date, seq)"
+            )
+            # Журналы, созданные до появления счетчика попыток
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(pending_surveys)")}
+            if "attempts" not in columns:
+                self._conn.execute("ALTER TABLE pending_surveys ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            # Опросы, которые БД раз за разом отклоняла: ждут ручного разбора
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_surveys ("
+                " seq INTEGER PRIMARY KEY,"
+                " telegram_id INTEGER NOT NULL,"
+                " date TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " attempts INTEGER NOT NULL,"
+                " last_error TEXT,"
+                " failed_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def append(self, telegram_id, date, payload):
+        """Добавляет опрос в журнал и возвращает его порядковый номер"""
+        with self._lock:
+            cursor = self._connection().execute(
+                "INSERT INTO pending_surveys (telegram_id, date, payload, created_at) VALUES (?, ?, ?, ?)",
+                (telegram_id, date, payload, time.time())
+            )
+            return cursor.lastrowid
+
+    def fetch(self, limit, after_seq=0):
+        """Возвращает самые старые записи журнала с seq > after_seq в порядке поступления"""
+        with self._lock:
+            return self._connection().execute(
+                "SELECT seq, telegram_id, date, payload FROM pending_surveys"
+                " WHERE seq > ? ORDER BY seq LIMIT ?",
+                (after_seq, limit)
+            ).fetchall()
+
+    def delete_upto(self, telegram_id, date, seq):
+        """Удаляет записи ключа (telegram_id, date) до seq включительно"""
+        with self._lock:
+            self._connection().execute(
+                "DELETE FROM pending_surveys WHERE telegram_id = ? AND date = ? AND seq <= ?",
+                (telegram_id, date, seq)
+            )
+
+    def record_failure(self, telegram_id, date, seq, error, max_attempts):
+        """Засчитывает неудачную попытку записи seq; после max_attempts переносит
+        эту и более старые версии опроса в dead_surveys. Возвращает True, если перенесли"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE pending_surveys SET attempts = attempts + 1 WHERE seq = ?", (seq,))
+            row = conn.execute("SELECT attempts FROM pending_surveys WHERE seq = ?", (seq,)).fetchone()
+            if row is None or row[0] < max_attempts:
+                return False
+
+            conn.execute("BEGIN")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO dead_surveys"
+                    " (seq, telegram_id, date, payload, created_at, attempts, last_error, failed_at)"
+                    " SELECT seq, telegram_id, date, payload, created_at, attempts, ?, ?"
+                    " FROM pending_surveys WHERE telegram_id = ? AND date = ? AND seq <= ?",
+                    (error, time.time(), telegram_id, date, seq)
+                )
+                conn.execute(
+                    "DELETE FROM pending_surveys WHERE telegram_id = ? AND date = ? AND seq <= ?",
+                    (telegram_id, date, seq)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return True
+
+    def dead_depth(self):
+        """Число опросов в dead_surveys"""
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM dead_surveys").fetchone()[0]
+
+    def depth(self):
+        """Число записей, еще не сохраненных в БД"""
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM pending_surveys").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class SurveyWriteBehind:
+    """Отложенная запись опросов: журнал -> фоновая пачечная выгрузка в БД"""
+
+    def __init__(self, storage, journal, batch_size=SURVEY_FLUSH_BATCH,
+                 flush_interval=SURVEY_FLUSH_INTERVAL, retry_max_delay=SURVEY_RETRY_MAX_DELAY,
+                 max_attempts=SURVEY_MAX_ATTEMPTS):
+        self.storage = storage
+        self.journal = journal
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_max_delay = retry_max_delay
+        self.max_attempts = max_attempts
+
+        self._task = None
+        self._wake = asyncio.Event()
+        # Прерывает паузу после ошибок; новые опросы ее не прерывают
+        self._stop_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+
+        # Метрики
+        self.enqueued = 0
+        self.flushed = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.last_flush_latency = None
+        self.last_error = None
+
+    async def enqueue(self, user, survey, ratings, comments):
+        """Записывает опрос в журнал; в БД он попадет фоновой выгрузкой"""
+        payload = json.dumps({
+            "user": user,
+            "survey": survey,
+            "ratings": ratings,
+            "comments": comments
+        }, ensure_ascii=False)
+        seq = await asyncio.to_thread(
+            self.journal.append, user["telegram_id"], survey["date"], payload
+        )
+        self.enqueued += 1
+        self._wake.set()
+        logger.info(f"📥 Опрос {user['telegram_id']} за {survey['date']} записан в журнал (#{seq})")
+        return seq
+
+    def start(self):
+        """Запускает фоновую выгрузку (включая остатки журнала с прошлого запуска)"""
+        if self._task is None:
+            self._stopping = False
+            self._stop_requested.clear()
+            self._task = asyncio.create_task(self._run())
+            logger.info("🚚 Фоновая выгрузка опросов запущена")
+
+    async def stop(self, timeout=SURVEY_DRAIN_TIMEOUT):
+        """Останавливает выгрузку, стараясь сбросить журнал за timeout секунд"""
+        if self._task is None:
+            return
+
+        self._stopping = True
+        self._stop_requested.set()
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("⏱ Не успели выгрузить журнал опросов, остаток будет выгружен при следующем запуске")
+        finally:
+            self._task = None
+
+        depth = await asyncio.to_thread(self.journal.depth)
+        logger.info(f"🛑 Выгрузка опросов остановлена, в журнале осталось: {depth}")
+        self.journal.close()
+
+    async def _run(self):
+        delay = self.flush_interval
+        while True:
+            if not self._stopping:
+                # После ошибки ждем всю паузу: иначе каждый новый опрос заново
+                # отправлял бы в недоступную БД всю пачку
+                event = self._stop_requested if delay > self.flush_interval else self._wake
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+            ok = await self.flush()
+
+            if self._stopping:
+                # При остановке повторяем попытки, пока нас не прервут по таймауту
+                if ok:
+                    return
+                await asyncio.sleep(1)
+                continue
+
+            # Экспоненциальная задержка при недоступности БД
+            delay = self.flush_interval if ok else min(max(delay, 1) * 2, self.retry_max_delay)
+
+    async def flush(self):
+        """Выгружает журнал в БД пачками; возвращает False, если БД была недоступна
+
+        Опросы, которые БД отклонила, остаются в журнале до следующего прохода
+        (или переносятся в dead_surveys) и не задерживают остальные.
+        """
+        async with self._flush_lock:
+            # Курсор по seq: отклоненные записи не перечитываются в этом же проходе
+            last_seq = 0
+            rejected_keys = set()
+            while True:
+                rows = await asyncio.to_thread(self.journal.fetch, self.batch_size, last_seq)
+                if not rows:
+                    return True
+                last_seq = rows[-1][0]
+
+                # save_survey полностью перезаписывает анкету за дату,
+                # поэтому для каждого ключа достаточно последней версии.
+                # Ключи, уже отклоненные в этом проходе, ждут следующего
+                latest = {}
+                for seq, telegram_id, date, payload in rows:
+                    if (telegram_id, date) not in rejected_keys:
+                        latest[(telegram_id, date)] = (seq, payload)
+                if not latest:
+                    continue
+
+                started = time.perf_counter()
+                errors = await asyncio.gather(*(
+                    self._save(key, seq, payload) for key, (seq, payload) in latest.items()
+                ))
+                self.last_flush_latency = time.perf_counter() - started
+
+                unavailable = False
+                for (key, (seq, _)), error in zip(latest.items(), errors):
+                    if error is None:
+                        continue
+                    if self.storage.is_unavailable_error(error):
+                        # Сеть или 5xx: опрос ни в чем не виноват, попытку не считаем
+                        # и ждем в журнале сколько угодно
+                        unavailable = True
+                    else:
+                        # БД отклонила сами данные (4xx, ошибка проверки)
+                        rejected_keys.add(key)
+                        await self._reject(key, seq, str(error))
+                if unavailable:
+                    return False
+
+    async def _save(self, key, seq, payload):
+        """Сохраняет опрос в БД; возвращает исключение или None"""
+        telegram_id, date = key
+        item = json.loads(payload)
+        try:
+            await self.storage.save_survey(item["user"], item["survey"], item["ratings"], item["comments"])
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            logger.error(f"❌ Ошибка выгрузки опроса {telegram_id} за {date}: {e}")
+            return e
+
+        # Удаляем эту и все более старые версии опроса за ту же дату
+        await asyncio.to_thread(self.journal.delete_upto, telegram_id, date, seq)
+        self.flushed += 1
+        return None
+
+    async def _reject(self, key, seq, error):
+        telegram_id, date = key
+        moved = await asyncio.to_thread(
+            self.journal.record_failure, telegram_id, date, seq, error, self.max_attempts
+        )
+        if moved:
+            self.dead_lettered += 1
+            logger.error(
+                f"☠️ Опрос {telegram_id} за {date} отклонен {self.max_attempts} раз и перенесен в dead_surveys"
+            )
+
+    async def stats(self):
+        """Метрики очереди: глубина журнала, задержка выгрузки, счетчики"""
+        return {
+            "depth": await asyncio.to_thread(self.journal.depth),
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "failures": self.failures,
+            "dead": await asyncio.to_thread(self.journal.dead_depth),
+            "last_flush_latency": self.last_flush_latency,
+            "last_error": self.last_error,
+        }
+
+
+survey_queue = SurveyWriteBehind(storage, SurveyJournal(SURVEY_JOURNAL_PATH))
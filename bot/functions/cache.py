@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """LRU-кэш с ограничением размера, временем жизни записей и счетчиками"""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl  # Время жизни по умолчанию в секундах (None - бессрочно)
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _lookup(self, key):
+        """Возвращает запись или None, удаляя просроченную"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        expires_at, _ = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            return None
+
+        return item
+
+    def get(self, key, default=None):
+        """Получает значение и отмечает его как недавно использованное"""
+        item = self._lookup(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def peek(self, key, default=None):
+        """Получает значение, не меняя порядок вытеснения и счетчики"""
+        item = self._lookup(key)
+        return default if item is None else item[1]
+
+    def set(self, key, value, ttl=None):
+        """Сохраняет значение; ttl переопределяет время жизни по умолчанию"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Удаляет запись и возвращает ее значение"""
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def keys(self):
+        return [key for key in list(self._data) if self._lookup(key) is not None]
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Счетчики кэша"""
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,180 @@
+# image_pipeline.py
+import asyncio
+import io
+import logging
+import os
+import time
+
+from PIL import Image, ImageOps
+
+from config import (
+    PHOTO_CACHE_DIR,
+    PHOTO_MAX_SIDE,
+    PHOTO_JPEG_QUALITY,
+    PHOTO_CACHE_MAX_BYTES,
+    PHOTO_CACHE_MAX_AGE_DAYS,
+)
+from functions.yandex_disk import yandex_disk
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoOptimizer:
+    """Скачивает фото блюда один раз, уменьшает до размера Telegram и хранит JPEG на диске по md5"""
+
+    def __init__(self, disk, cache_dir=PHOTO_CACHE_DIR, max_side=PHOTO_MAX_SIDE, quality=PHOTO_JPEG_QUALITY,
+                 max_bytes=PHOTO_CACHE_MAX_BYTES, max_age_days=PHOTO_CACHE_MAX_AGE_DAYS):
+        self.disk = disk
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 3600
+
+        # Обработка, идущая прямо сейчас: md5 -> задача
+        self._inflight = {}
+
+        self.disk_hits = 0
+        self.processed = 0
+        self.errors = 0
+        self.original_bytes = 0
+        self.optimized_bytes = 0
+        self.evicted = 0
+
+    def _cache_path(self, md5):
+        return os.path.join(self.cache_dir, f"{md5}.jpg")
+
+    def _read_cached(self, md5):
+        path = self._cache_path(md5)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        # mtime - время последнего использования: по нему cleanup() выбирает, что удалить
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write_cached(self, md5, data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Через временный файл: при сбое в кэше не останется обрезанного JPEG
+        tmp_path = self._cache_path(md5) + ".tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, self._cache_path(md5))
+
+    def _cleanup(self):
+        """Удаляет устаревшие файлы кэша, затем самые давно использованные сверх max_bytes.
+        Возвращает (число удаленных файлов, освобождено байт)"""
+        try:
+            entries = list(os.scandir(self.cache_dir))
+        except FileNotFoundError:
+            return 0, 0
+
+        expire_before = time.time() - self.max_age
+        files = []
+        for entry in entries:
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            # .tmp может прямо сейчас дописываться - удаляем только брошенные
+            if entry.name.endswith(".tmp") and stat.st_mtime >= expire_before:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        removed = freed = 0
+        for mtime, size, path in files:
+            if mtime >= expire_before and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+    async def cleanup(self):
+        """Ограничивает размер и возраст кэша фото на диске"""
+        try:
+            removed, freed = await asyncio.to_thread(self._cleanup)
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки кэша фото: {e}")
+            return
+        if removed:
+            self.evicted += removed
+            logger.info(f"🧹 Из кэша фото удалено файлов: {removed} ({freed // 1024} КБ)")
+
+    def _optimize(self, original):
+        """Поворачивает по EXIF, уменьшает и перекодирует в JPEG"""
+        with Image.open(io.BytesIO(original)) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=self.quality, optimize=True, progressive=True)
+            return output.getvalue()
+
+    async def get_photo(self, meal):
+        """Оптимизированный JPEG блюда (None, если фото нет или обработать не удалось)"""
+        md5 = meal.get('md5')
+        if not md5 or not meal.get('path'):
+            return None
+
+        task = self._inflight.get(md5)
+        if task is None:
+            task = asyncio.create_task(self._load(meal))
+            self._inflight[md5] = task
+            task.add_done_callback(lambda _: self._inflight.pop(md5, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, meal):
+        md5 = meal['md5']
+        data = await asyncio.to_thread(self._read_cached, md5)
+        if data is not None:
+            self.disk_hits += 1
+            return data
+
+        try:
+            original = await self.disk.download_photo(meal['path'])
+            data = await asyncio.to_thread(self._optimize, original)
+            await asyncio.to_thread(self._write_cached, md5, data)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Ошибка обработки фото {meal['type']} за {meal['date']}: {e}")
+            return None
+        await self.cleanup()
+
+        self.processed += 1
+        self.original_bytes += len(original)
+        self.optimized_bytes += len(data)
+        logger.info(
+            f"🖼 Фото {meal['type']} за {meal['date']} оптимизировано: "
+            f"{len(original) // 1024} КБ → {len(data) // 1024} КБ"
+        )
+        return data
+
+    def stats(self):
+        """Счетчики обработки фото"""
+        return {
+            "processed": self.processed,
+            "disk_hits": self.disk_hits,
+            "errors": self.errors,
+            "original_bytes": self.original_bytes,
+            "optimized_bytes": self.optimized_bytes,
+            "evicted": self.evicted,
+        }
+
+
+photo_optimizer = PhotoOptimizer(yandex_disk)
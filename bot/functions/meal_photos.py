@@ -0,0 +1,112 @@
+# meal_photos.py
+import logging
+from functools import partial
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+from config import MEAL_PHOTO_CACHE_SIZE
+from functions.cache import LRUCache
+from functions.image_pipeline import photo_optimizer
+from functions.yandex_disk import yandex_disk
+
+logger = logging.getLogger(__name__)
+
+# file_id уже загруженных в Telegram фото: (дата, тип блюда, md5 на Диске) -> file_id.
+# md5 в ключе: если фото на Диске заменят, старый file_id просто не найдется
+photo_file_ids = LRUCache(maxsize=MEAL_PHOTO_CACHE_SIZE)
+
+# Отправки карточек блюд: с фото и текстом вместо фото из-за ошибки
+send_counters = {"photo": 0, "text_fallback": 0}
+
+
+def photo_cache_key(meal):
+    """Ключ кэша file_id для блюда (None, если у фото нет md5)"""
+    if not meal.get('md5'):
+        return None
+    return (meal['date'], meal['type'], meal['md5'])
+
+
+async def send_meal_photo(message: types.Message, meal, **kwargs) -> types.Message:
+    """Отправляет фото блюда: по file_id, если оно уже загружалось, иначе загружает в Telegram"""
+    key = photo_cache_key(meal)
+
+    file_id = photo_file_ids.get(key) if key else None
+    if file_id:
+        try:
+            return await message.answer_photo(photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            # file_id стал недействительным - загружаем фото заново
+            logger.warning(f"⚠️ file_id для {meal['type']} за {meal['date']} отклонен: {e}")
+            photo_file_ids.pop(key)
+
+    sent = await _upload_photo(message.answer_photo, meal, **kwargs)
+
+    if key and sent.photo:
+        # Самый большой размер фото - последний в списке
+        photo_file_ids.set(key, sent.photo[-1].file_id)
+        logger.info(f"📸 file_id для {meal['type']} за {meal['date']} сохранен")
+    return sent
+
+
+async def _upload_photo(send, meal, **kwargs) -> types.Message:
+    """Первая загрузка фото в Telegram: оптимизированным JPEG, а если его нет - по ссылке Диска"""
+    data = await photo_optimizer.get_photo(meal)
+    if data is not None:
+        photo = types.BufferedInputFile(data, filename=f"{meal['type']}.jpg")
+        return await send(photo=photo, **kwargs)
+
+    # Ссылка Диска могла истечь, пока меню лежало в кэше
+    meal = await yandex_disk.ensure_fresh_link(meal)
+    try:
+        return await send(photo=meal['download_url'], **kwargs)
+    except TelegramBadRequest as e:
+        # Telegram не смог скачать фото - пробуем один раз с новой ссылкой
+        logger.warning(f"⚠️ Telegram не загрузил фото {meal['type']} за {meal['date']}: {e}")
+        meal = await yandex_disk.ensure_fresh_link(meal, force=True)
+        return await send(photo=meal['download_url'], **kwargs)
+
+
+async def preupload_meal_photo(bot, chat_id, meal) -> bool:
+    """Загружает фото блюда в служебный чат, чтобы ученикам оно ушло уже по file_id"""
+    key = photo_cache_key(meal)
+    if key is None:
+        return False
+    if key in photo_file_ids:
+        return True
+
+    sent = await _upload_photo(partial(bot.send_photo, chat_id), meal, disable_notification=True)
+    photo_file_ids.set(key, sent.photo[-1].file_id)
+    logger.info(f"📸 Фото {meal['type']} за {meal['date']} загружено заранее")
+
+    # Служебное сообщение больше не нужно, file_id остается действительным
+    try:
+        await bot.delete_message(chat_id, sent.message_id)
+    except Exception as e:
+        logger.warning(f"Не удалось удалить служебное фото: {e}")
+    return True
+
+
+async def send_meal_card(message: types.Message, meal, caption, reply_markup) -> types.Message:
+    """Отправляет карточку блюда: с фото, если оно есть, иначе (или при ошибке) текстом"""
+    if meal.get('has_image', True) and meal.get('download_url'):
+        try:
+            sent = await send_meal_photo(
+                message,
+                meal,
+                caption=caption,
+                reply_markup=reply_markup,
+                parse_mode="Markdown"
+            )
+            send_counters["photo"] += 1
+            return sent
+        except Exception as e:
+            # Если не удалось отправить фото, отправляем текстом
+            send_counters["text_fallback"] += 1
+            logger.error(f"Ошибка отправки фото: {e}")
+
+    return await message.answer(
+        caption,
+        reply_markup=reply_markup,
+        parse_mode="Markdown"
+    )
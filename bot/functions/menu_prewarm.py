@@ -0,0 +1,220 @@
+# menu_prewarm.py
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from config import (
+    MENU_PREWARM_TIME,
+    MENU_PREWARM_INTERVAL,
+    MENU_PREWARM_MAX_ATTEMPTS,
+    MENU_PREWARM_DEADLINE,
+    MENU_PREWARM_CHAT_ID,
+    MENU_CHANGE_POLL_INTERVAL,
+    MENU_CHANGE_POLL_END,
+)
+from functions.meal_photos import photo_cache_key, photo_file_ids, preupload_meal_photo
+from functions.yandex_disk import yandex_disk
+
+logger = logging.getLogger(__name__)
+
+
+class MenuPrewarmer:
+    """Фоновый прогрев меню на день: загрузка с Диска и фото в Telegram до начала опросов,
+    затем периодическая проверка Диска на новые фото до конца учебного дня"""
+
+    def __init__(self, disk, prewarm_time=MENU_PREWARM_TIME, interval=MENU_PREWARM_INTERVAL,
+                 chat_id=MENU_PREWARM_CHAT_ID, change_interval=MENU_CHANGE_POLL_INTERVAL,
+                 max_attempts=MENU_PREWARM_MAX_ATTEMPTS, deadline=MENU_PREWARM_DEADLINE,
+                 poll_end=MENU_CHANGE_POLL_END):
+        self.disk = disk
+        self.prewarm_time = datetime.strptime(prewarm_time, "%H:%M").time()
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.deadline = datetime.strptime(deadline, "%H:%M").time()
+        self.chat_id = chat_id
+        self.change_interval = change_interval
+        self.poll_end = datetime.strptime(poll_end, "%H:%M").time()
+
+        self._task = None
+        self._bot = None
+
+        # Состояние прогрева (для /menu_status)
+        self.date = None
+        self.ready = False
+        self.ready_at = None
+        # Полные повторы на сегодня прекращены (лимит попыток или дедлайн)
+        self.gave_up = False
+        self.last_run = None
+        self.attempts = 0
+        self.meals_with_images = 0
+        self.photos_uploaded = 0
+        self.last_error = None
+
+    def start(self, bot):
+        """Запускает планировщик прогрева"""
+        if self._task is None:
+            self._bot = bot
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🔥 Прогрев меню запланирован на {self.prewarm_time.strftime('%H:%M')} МСК")
+
+    async def stop(self):
+        """Останавливает планировщик"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _finished_today(self):
+        """Сегодняшний прогрев завершен: меню готово или полные повторы прекращены"""
+        return self.date == self.disk._get_moscow_time().date() and (self.ready or self.gave_up)
+
+    def _seconds_until_next_window(self):
+        """Секунды до следующего прогрева (0, если сегодняшний еще не завершен)"""
+        now = self.disk._get_moscow_time()
+        start = now.replace(
+            hour=self.prewarm_time.hour, minute=self.prewarm_time.minute, second=0, microsecond=0
+        )
+        if now >= start and not self._finished_today():
+            return 0
+        if now >= start:
+            start += timedelta(days=1)
+        return (start - now).total_seconds()
+
+    def _seconds_until_poll_end(self):
+        """Секунды до конца учебного дня (0, если он уже закончился)"""
+        now = self.disk._get_moscow_time()
+        end = now.replace(hour=self.poll_end.hour, minute=self.poll_end.minute, second=0, microsecond=0)
+        return max((end - now).total_seconds(), 0)
+
+    async def _run(self):
+        while True:
+            delay = self._seconds_until_next_window()
+            if delay == 0:
+                try:
+                    await self.warm()
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"❌ Ошибка прогрева меню: {e}")
+
+                if not self.ready and not self._give_up_if_due():
+                    # Фото могли еще не выложить - полный прогрев повторяем через интервал,
+                    # а пока следим за изменениями в уже найденных папках
+                    await self._poll_changes_for(self.interval)
+                continue
+
+            # Меню прогрето (или повторы прекращены): до конца учебного дня следим
+            # за заменой фото, а ночью и до следующего прогрева Диск не трогаем
+            poll_for = min(delay, self._seconds_until_poll_end()) if self._finished_today() else 0
+            if poll_for > 0:
+                await self._poll_changes_for(poll_for)
+            else:
+                await asyncio.sleep(delay)
+
+    def _give_up_if_due(self):
+        """Прекращает полные повторы после max_attempts попыток или после дедлайна.
+        Блюда без фото бывают законно (выходной, нет фото напитка), а каждый повтор
+        сбрасывает дневной кэш и заново обходит все папки"""
+        now = self.disk._get_moscow_time()
+        if self.attempts < self.max_attempts and now.time() < self.deadline:
+            return False
+        
+        self.gave_up = True
+        logger.info(
+            f"🛑 Полный прогрев меню на {self.date.strftime('%d.%m.%Y')} прекращен после "
+            f"{self.attempts} попыток, новые фото подхватит проверка изменений"
+        )
+        return True
+
+    async def _poll_changes_for(self, seconds):
+        """Проверяет изменения меню каждые change_interval секунд в течение seconds"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(self.change_interval, remaining))
+            try:
+                await self.check_changes()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"❌ Ошибка проверки изменений меню: {e}")
+
+    async def check_changes(self):
+        """Подхватывает фото, замененные на Диске после прогрева"""
+        for old, new in await self.disk.detect_changes():
+            old_key = photo_cache_key(old)
+            if old_key:
+                photo_file_ids.pop(old_key)
+            if self.chat_id is not None and new.get('has_image'):
+                try:
+                    await preupload_meal_photo(self._bot, self.chat_id, new)
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"❌ Не удалось заранее загрузить фото {new['type']}: {e}")
+
+    async def warm(self):
+        """Один проход прогрева: свежее меню с Диска и загрузка фото в Telegram"""
+        today = self.disk._get_moscow_time().date()
+        if self.date != today:
+            self.date = today
+            self.ready = False
+            self.ready_at = None
+            self.gave_up = False
+            self.attempts = 0
+            self.last_error = None
+
+        self.attempts += 1
+        self.last_run = self.disk._get_moscow_time()
+
+        meals = await self.disk.refresh_and_get_meals()
+        with_images = [meal for meal in meals if meal.get('has_image') and meal.get('download_url')]
+        self.meals_with_images = len(with_images)
+
+        uploaded = 0
+        if self.chat_id is not None:
+            for meal in with_images:
+                try:
+                    if await preupload_meal_photo(self._bot, self.chat_id, meal):
+                        uploaded += 1
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"❌ Не удалось заранее загрузить фото {meal['type']}: {e}")
+        self.photos_uploaded = uploaded
+
+        # Готово, когда у всех блюд есть фото и (если задан чат) их file_id
+        self.ready = len(with_images) == len(meals) and (self.chat_id is None or uploaded == len(meals))
+        if self.ready:
+            self.ready_at = self.last_run
+            logger.info(
+                f"🔥 Меню на {today.strftime('%d.%m.%Y')} прогрето "
+                f"(попыток: {self.attempts}, фото загружено: {uploaded})"
+            )
+        else:
+            logger.info(
+                f"⏳ Меню на {today.strftime('%d.%m.%Y')} прогрето не полностью: "
+                f"фото {len(with_images)}/{len(meals)}, повтор через {self.interval} с"
+            )
+
+    def status(self):
+        """Состояние прогрева"""
+        return {
+            "date": self.date,
+            "ready": self.ready,
+            "ready_at": self.ready_at,
+            "gave_up": self.gave_up,
+            "last_run": self.last_run,
+            "attempts": self.attempts,
+            "meals_with_images": self.meals_with_images,
+            "photos_uploaded": self.photos_uploaded,
+            "upload_enabled": self.chat_id is not None,
+            "last_error": self.last_error,
+            **{f"change_{key}": value for key, value in self.disk.change_stats().items()},
+        }
+
+
+menu_prewarmer = MenuPrewarmer(yandex_disk)
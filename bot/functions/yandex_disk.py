@@ -1,23 +1,88 @@
 # yandex_disk.py
+import asyncio
+import io
+import time
 import yadisk
 from datetime import datetime, timezone, timedelta
-from config import YANDEX_DISK_TOKEN
+from config import (
+    YANDEX_DISK_TOKEN,
+    YANDEX_DISK_CONCURRENCY,
+    YANDEX_DISK_TIMEOUT,
+    MENU_CACHE_SIZE,
+    MENU_CACHE_PAST_TTL,
+    MENU_CACHE_TODAY_TTL,
+    YANDEX_LINK_TTL,
+    YANDEX_LINK_REFRESH_MARGIN,
+    PHOTO_DOWNLOAD_TIMEOUT,
+)
+from functions.cache import LRUCache
 from typing import List, Dict
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Только нужные поля листинга; file - готовая ссылка на скачивание
+LISTING_FIELDS = ["name", "path", "type", "md5", "size", "modified", "file"]
+LISTING_LIMIT = 1000
+# Для проверки изменений достаточно имен и md5 файлов в папках блюд
+CHANGE_FIELDS = ["name", "type", "md5"]
+# Блюда меню в порядке показа: сессии опроса ссылаются на блюдо по номеру в этом списке
+MEAL_TYPES = ["первое", "второе", "напиток"]
+
+
+class MealFolderError(Exception):
+    """Папку блюда не удалось прочитать (таймаут или ошибка Диска) - в отличие от отсутствующей папки"""
+
 class YandexDiskManager:
     def __init__(self):
         self.token = YANDEX_DISK_TOKEN
-        self.y = yadisk.YaDisk(token=self.token)
+        # Асинхронный клиент создается при первом обращении (импорт модуля не трогает сеть)
+        self._y = None
         
         # Храним только дату последней проверки, а не все данные
         self.last_check_date = None
         self.cached_meals = None  # Только текущие блюда, не накапливаем
         
-        if not self.y.check_token():
+        # Меню других дат (/mark_special): дата "ДД.ММ.ГГГГ" -> список блюд
+        self.menu_cache = LRUCache(maxsize=MENU_CACHE_SIZE)
+        
+        # Ссылки на скачивание живут недолго и перевыпускаются по мере надобности
+        self.link_refreshes = 0
+        self.link_refresh_errors = 0
+        
+        # Загрузки меню, идущие прямо сейчас: дата -> задача.
+        # Одновременные запросы одной даты ждут одну загрузку
+        self._inflight = {}
+        self.coalesced_requests = 0
+        
+        # Проверка изменений меню (detect_changes)
+        self.change_checks = 0
+        self.changes_detected = 0
+
+    @property
+    def y(self) -> yadisk.AsyncClient:
+        """Асинхронный клиент Диска: запросы не блокируют обработку апдейтов"""
+        if self._y is None:
+            self._y = yadisk.AsyncClient(token=self.token)
+        return self._y
+
+    @y.setter
+    def y(self, client):
+        self._y = client
+
+    async def check_token(self):
+        """Проверяет токен Яндекс.Диска (вызывается при запуске бота)"""
+        if not await self.y.check_token():
             raise Exception("❌ Невалидный токен Яндекс.Диска")
+        logger.info("✅ Токен Яндекс.Диска действителен")
+
+    async def close(self):
+        """Закрывает соединения с Яндекс.Диском"""
+        if self._y is None:
+            return
+        await self._y.close()
+        self._y = None
+        logger.info("🔌 Соединения с Яндекс.Диском закрыты")
 
     def _get_moscow_time(self):
         """Получает текущее время по Москве"""
@@ -53,102 +118,227 @@ class YandexDiskManager:
     async def _fetch_actual_meals(self) -> List[Dict]:
         """Получает актуальные данные с Яндекс.Диска"""
         today_str = self._get_moscow_time().strftime("%d.%m.%Y")
-        return await self._get_meals_for_date_internal(today_str)
+        return await self._fetch_meals(today_str)
+
+    async def _fetch_meals(self, date_str: str) -> List[Dict]:
+        """Загружает меню даты с Диска, объединяя одновременные запросы в один"""
+        task = self._inflight.get(date_str)
+        if task is None:
+            task = asyncio.create_task(self._get_meals_for_date_internal(date_str))
+            self._inflight[date_str] = task
+            task.add_done_callback(lambda _: self._inflight.pop(date_str, None))
+        else:
+            self.coalesced_requests += 1
+            logger.info(f"⏳ Ждем уже идущую загрузку меню на {date_str}")
+        
+        # shield: отмена одного ожидающего не отменяет общую загрузку
+        return await asyncio.shield(task)
 
     async def get_meals_for_date(self, date_str: str) -> List[Dict]:
-        """Получает блюда для конкретной даты (без кэширования)"""
+        """Получает блюда для конкретной даты (с кэшированием по датам)"""
+        date = datetime.strptime(date_str, "%d.%m.%Y").date()
+        today = self._get_moscow_time().date()
+        
+        # Меню на сегодня уже может лежать в дневном кэше
+        if date == today and self.last_check_date == today and self.cached_meals is not None:
+            logger.info(f"✅ Меню на {date_str} взято из дневного кэша")
+            return self.cached_meals
+        
+        meals = self.menu_cache.get(date_str)
+        if meals is not None:
+            logger.info(f"✅ Меню на {date_str} взято из кэша")
+            return meals
+        
         logger.info(f"🔄 Получаем блюда для даты: {date_str}")
-        return await self._get_meals_for_date_internal(date_str)
+        meals = await self._fetch_meals(date_str)
+        
+        # Прошедшие дни уже не меняются, сегодняшнее и будущее меню еще могут дополнить.
+        # Меню с непрочитанными папками надолго не кэшируем: фото там могут быть
+        complete = not any(meal.get('fetch_failed') for meal in meals)
+        ttl = MENU_CACHE_PAST_TTL if date < today and complete else MENU_CACHE_TODAY_TTL
+        if not complete:
+            logger.warning(f"⚠️ Меню на {date_str} загружено не полностью, кэшируем на {ttl} с")
+        self.menu_cache.set(date_str, meals, ttl=ttl)
+        return meals
+
+    async def get_menu_meal(self, date_str: str, index: int) -> Dict:
+        """Блюдо меню даты по номеру в MEAL_TYPES (меню берется из общего кэша)"""
+        meals = await self.get_meals_for_date(date_str)
+        return meals[index]
+
+    def invalidate_date(self, date_str: str) -> bool:
+        """Удаляет меню даты из кэшей; возвращает True, если оно было закэшировано"""
+        removed = self.menu_cache.pop(date_str) is not None
+        
+        date = datetime.strptime(date_str, "%d.%m.%Y").date()
+        if self.cached_meals is not None and self.last_check_date == date:
+            self.force_refresh()
+            removed = True
+        
+        logger.info(f"🗑 Кэш меню на {date_str} сброшен")
+        return removed
+
+    def menu_cache_stats(self):
+        """Счетчики кэша меню по датам и объединенных загрузок"""
+        return {**self.menu_cache.stats(), "coalesced": self.coalesced_requests}
 
     async def _get_meals_for_date_internal(self, date_str: str) -> List[Dict]:
         """Внутренний метод для получения блюд для даты"""
-        meal_types = ["первое", "второе", "напиток"]
-        all_meals = []
+        # Папки блюд разрешаем параллельно; отдельной проверки папки даты нет:
+        # если ее нет, каждая папка блюда вернет PathNotFoundError
+        semaphore = asyncio.Semaphore(YANDEX_DISK_CONCURRENCY)
+        return list(await asyncio.gather(*(
+            self._resolve_meal(date_str, meal_type, semaphore) for meal_type in MEAL_TYPES
+        )))
+
+    async def _resolve_meal(self, date_str: str, meal_type: str, semaphore) -> Dict:
+        """Блюдо из папки; без фото - заглушка, а если папку прочитать не удалось,
+        заглушка с пометкой fetch_failed"""
+        try:
+            meal = await self._get_meal_from_folder(date_str, meal_type, semaphore)
+        except MealFolderError:
+            return {**self._meal_without_image(date_str, meal_type), "fetch_failed": True}
+        
+        if meal:
+            logger.info(f"✅ Найдено фото для {meal_type}")
+            return meal
+        
+        # Добавляем тип блюда даже если фото нет
+        logger.info(f"✅ Добавлен тип блюда без фото: {meal_type}")
+        return self._meal_without_image(date_str, meal_type)
+
+    @staticmethod
+    def _meal_without_image(date_str: str, meal_type: str) -> Dict:
+        """Тип блюда без фото"""
+        return {
+            "type": meal_type,
+            "name": meal_type.capitalize(),
+            "full_name": f"{meal_type}.jpg",
+            "download_url": None,
+            "size": 0,
+            "md5": None,
+            "path": None,
+            "modified": None,
+            "link_issued_at": None,
+            "link_expires_at": None,
+            "date": date_str,
+            "has_image": False
+        }
+
+    @staticmethod
+    def _link_times() -> Dict:
+        """Время выдачи и истечения только что полученной ссылки"""
+        issued_at = time.time()
+        return {"link_issued_at": issued_at, "link_expires_at": issued_at + YANDEX_LINK_TTL}
+
+    def _cached_copies(self, meal: Dict) -> List[Dict]:
+        """Закэшированные экземпляры того же блюда (дневной кэш и кэш по датам)"""
+        menus = [self.menu_cache.peek(meal['date'])]
+        if self.cached_meals and self.cached_meals[0]['date'] == meal['date']:
+            menus.append(self.cached_meals)
+        return [
+            cached for menu in menus if menu
+            for cached in menu if cached['type'] == meal['type'] and cached is not meal
+        ]
+
+    async def ensure_fresh_link(self, meal: Dict, force: bool = False) -> Dict:
+        """Перевыпускает ссылку на фото, если она истекает (или force=True)"""
+        if not meal.get('path'):
+            return meal
+        
+        expires_at = meal.get('link_expires_at')
+        if not force and expires_at and time.time() < expires_at - YANDEX_LINK_REFRESH_MARGIN:
+            return meal
         
-        # Проверяем существует ли папка для указанной даты
-        date_folder_path = f"/FoodSchool64/{date_str}"
         try:
-            self.y.get_meta(date_folder_path)
-            folder_exists = True
-            logger.info(f"✅ Папка для даты {date_str} найдена")
-        except yadisk.exceptions.PathNotFoundError:
-            logger.info(f"❌ Папка для даты {date_str} не найдена")
-            folder_exists = False
-        
-        if folder_exists:
-            for meal_type in meal_types:
-                meal = await self._get_meal_from_folder(date_str, meal_type)
-                if meal:
-                    all_meals.append(meal)
-                    logger.info(f"✅ Найдено фото для {meal_type}")
-                else:
-                    # Добавляем тип блюда даже если фото нет
-                    all_meals.append({
-                        "type": meal_type,
-                        "name": meal_type.capitalize(),
-                        "full_name": f"{meal_type}.jpg",
-                        "download_url": None,
-                        "size": 0,
-                        "date": date_str,
-                        "has_image": False
-                    })
-                    logger.info(f"✅ Добавлен тип блюда без фото: {meal_type}")
-        else:
-            # Только типы блюд без фото
-            logger.info(f"📝 Создаем стандартные типы блюд без фото для {date_str}")
-            for meal_type in meal_types:
-                all_meals.append({
-                    "type": meal_type,
-                    "name": meal_type.capitalize(),
-                    "full_name": f"{meal_type}.jpg",
-                    "download_url": None,
-                    "size": 0,
-                    "date": date_str,
-                    "has_image": False
-                })
-                
-        return all_meals
+            download_url = await asyncio.wait_for(
+                self.y.get_download_link(meal['path']), timeout=YANDEX_DISK_TIMEOUT
+            )
+        except Exception as e:
+            self.link_refresh_errors += 1
+            logger.error(f"Ошибка обновления ссылки для {meal['path']}: {e}")
+            return meal
+        
+        self.link_refreshes += 1
+        fresh = {"download_url": download_url, **self._link_times()}
+        # Обновляем и кэш, чтобы следующие ученики получили новую ссылку
+        for cached in [meal] + self._cached_copies(meal):
+            if cached.get('md5') == meal.get('md5'):
+                cached.update(fresh)
+        logger.info(f"🔗 Ссылка на фото {meal['type']} за {meal['date']} обновлена")
+        return meal
 
-    async def _get_meal_from_folder(self, date_str: str, meal_type: str) -> Dict:
-        """Получает блюдо из папки конкретного типа"""
+    async def download_photo(self, path: str) -> bytes:
+        """Скачивает файл с Диска в память"""
+        buffer = io.BytesIO()
+        await asyncio.wait_for(self.y.download(path, buffer), timeout=PHOTO_DOWNLOAD_TIMEOUT)
+        return buffer.getvalue()
+
+    def link_stats(self):
+        """Счетчики перевыпуска ссылок"""
+        return {"refreshes": self.link_refreshes, "errors": self.link_refresh_errors}
+
+    async def _call(self, semaphore, coro):
+        """Запрос к Диску с ограничением параллельности и таймаутом"""
+        async with semaphore:
+            return await asyncio.wait_for(coro, timeout=YANDEX_DISK_TIMEOUT)
+
+    async def _listdir(self, path: str, fields=LISTING_FIELDS) -> List:
+        """Листинг папки одним запросом, только нужные поля"""
+        return [item async for item in self.y.listdir(path, fields=fields, limit=LISTING_LIMIT)]
+
+    async def _get_meal_from_folder(self, date_str: str, meal_type: str, semaphore) -> Dict:
+        """Получает блюдо из папки конкретного типа (None, если папки или фото нет;
+        MealFolderError, если Диск не ответил)"""
+        meal_folder_name = meal_type.capitalize()
+        meal_folder_path = f"/FoodSchool64/{date_str}/{meal_folder_name}"
         try:
-            meal_folder_name = meal_type.capitalize()
-            meal_folder_path = f"/FoodSchool64/{date_str}/{meal_folder_name}"
-            
-            # Проверяем существование папки
-            try:
-                self.y.get_meta(meal_folder_path)
-            except yadisk.exceptions.PathNotFoundError:
-                logger.info(f"Папка типа блюда не найдена: {meal_folder_path}")
-                return None
-            
             # Получаем все файлы из папки
-            folder_items = list(self.y.listdir(meal_folder_path))
-            
-            # Берем первое изображение
-            for item in folder_items:
-                if item.type == "file" and self._is_image_file(item.name):
+            folder_items = await self._call(semaphore, self._listdir(meal_folder_path))
+        except yadisk.exceptions.PathNotFoundError:
+            logger.info(f"Папка типа блюда не найдена: {meal_folder_path}")
+            return None
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱ Таймаут чтения папки {meal_folder_path}")
+            raise MealFolderError(meal_folder_path)
+        except Exception as e:
+            logger.error(f"Ошибка получения блюда для {meal_type}: {e}")
+            raise MealFolderError(meal_folder_path) from e
+        
+        # Берем первое изображение; ссылка на скачивание уже есть в листинге
+        link_failed = False
+        for item in folder_items:
+            if item.type == "file" and self._is_image_file(item.name):
+                download_url = item.file
+                if not download_url:
                     try:
-                        download_url = self.y.get_download_link(item.path)
-                        
-                        return {
-                            "type": meal_type,
-                            "name": meal_type.capitalize(),
-                            "full_name": item.name,
-                            "download_url": download_url,
-                            "size": item.size,
-                            "date": date_str,
-                            "has_image": True
-                        }
+                        download_url = await self._call(semaphore, self.y.get_download_link(item.path))
+                    except asyncio.TimeoutError:
+                        logger.warning(f"⏱ Таймаут получения ссылки для {item.name}")
+                        raise MealFolderError(meal_folder_path)
                     except Exception as e:
                         logger.error(f"Ошибка получения ссылки для {item.name}: {e}")
+                        link_failed = True
                         continue
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Ошибка получения блюда для {meal_type}: {e}")
-            return None
+                
+                return {
+                    "type": meal_type,
+                    "name": meal_type.capitalize(),
+                    "full_name": item.name,
+                    "download_url": download_url,
+                    "size": item.size,
+                    "md5": item.md5,
+                    "path": item.path,
+                    "modified": item.modified.isoformat() if item.modified else None,
+                    **self._link_times(),
+                    "date": date_str,
+                    "has_image": True
+                }
+        
+        if link_failed:
+            # Фото в папке есть, но ни для одного не выдали ссылку
+            raise MealFolderError(meal_folder_path)
+        return None
 
     def _is_image_file(self, filename: str) -> bool:
         """Проверяет, является ли файл изображением"""
@@ -156,6 +346,81 @@ class YandexDiskManager:
         filename_lower = filename.lower()
         return any(filename_lower.endswith(ext) for ext in image_extensions)
 
+    async def _first_image_md5(self, date_str: str, meal_type: str, semaphore):
+        """md5 фото, которое _get_meal_from_folder выбрал бы в папке блюда
+        (None, если папки или фото нет; MealFolderError, если Диск не ответил)"""
+        meal_folder_path = f"/FoodSchool64/{date_str}/{meal_type.capitalize()}"
+        try:
+            folder_items = await self._call(semaphore, self._listdir(meal_folder_path, CHANGE_FIELDS))
+        except yadisk.exceptions.PathNotFoundError:
+            return None
+        except Exception as e:
+            raise MealFolderError(meal_folder_path) from e
+        
+        for item in folder_items:
+            if item.type == "file" and self._is_image_file(item.name):
+                return item.md5
+        return None
+
+    async def detect_changes(self) -> List[tuple]:
+        """Дешевая проверка сегодняшнего меню на новые или замененные фото
+
+        Листинги папок блюд только с именами и md5 сравниваются с md5 блюд в кэше:
+        файл, замененный под тем же именем, меняет md5, но не дату изменения
+        папки. Полностью (со ссылкой на скачивание) заново читаются только
+        изменившиеся блюда. Возвращает список пар (старое блюдо, новое блюдо).
+        """
+        if self.cached_meals is None or self.last_check_date is None:
+            return []
+        
+        date_str = self.last_check_date.strftime("%d.%m.%Y")
+        self.change_checks += 1
+        semaphore = asyncio.Semaphore(YANDEX_DISK_CONCURRENCY)
+        listed = await asyncio.gather(*(
+            self._first_image_md5(date_str, meal['type'], semaphore) for meal in self.cached_meals
+        ), return_exceptions=True)
+        
+        changed_types = []
+        for meal, md5 in zip(self.cached_meals, listed):
+            if isinstance(md5, Exception):
+                # Папку не прочитали - проверим в следующий раз
+                logger.warning(f"⚠️ Не удалось проверить папку {meal['type']} за {date_str}: {md5}")
+                continue
+            if meal.get('fetch_failed') or md5 != meal.get('md5'):
+                changed_types.append(meal['type'])
+        if not changed_types:
+            return []
+        
+        found = await asyncio.gather(*(
+            self._resolve_meal(date_str, meal_type, semaphore) for meal_type in changed_types
+        ))
+        
+        changes = []
+        for meal_type, meal in zip(changed_types, found):
+            index = next(i for i, cached in enumerate(self.cached_meals) if cached['type'] == meal_type)
+            old = self.cached_meals[index]
+            
+            if meal.get('fetch_failed'):
+                # Прочитать папку не удалось - оставляем блюдо как есть и проверим в следующий раз
+                continue
+            
+            if (old.get('md5') == meal.get('md5') and old.get('has_image') == meal.get('has_image')
+                    and not old.get('fetch_failed')):
+                continue
+            
+            self.cached_meals[index] = meal
+            changes.append((old, meal))
+            logger.info(f"🆕 Фото {meal_type} за {date_str} изменилось на Диске")
+        
+        if changes:
+            self.changes_detected += len(changes)
+            self.menu_cache.pop(date_str)
+        return changes
+
+    def change_stats(self):
+        """Счетчики проверки изменений меню"""
+        return {"checks": self.change_checks, "changes": self.changes_detected}
+
     def force_refresh(self):
         """Принудительное обновление кэша - полностью сбрасываем"""
         logger.info("🔄 Принудительное обновление кэша - полный сброс")
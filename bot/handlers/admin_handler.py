@@ -2,12 +2,18 @@ import os
 import tempfile
 from aiogram import Router, types
 from aiogram.filters import Command
+from aiogram.utils.formatting import Bold, Code, Text
 from config import ADMINS
-import pandas as pd
-import io
 import logging
+from collections import Counter
 from datetime import datetime
-from database.db_supabase import supabase_client
+from database.storage import storage
+from database.survey_queue import survey_queue
+from functions.meal_photos import photo_file_ids, send_counters
+from functions.image_pipeline import photo_optimizer
+from functions.yandex_disk import yandex_disk
+from functions.menu_prewarm import menu_prewarmer
+from middlewares.state_snapshot import state_snapshot_middleware
 from aiogram.fsm.context import FSMContext
 
 router = Router()
@@ -17,6 +23,24 @@ def is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором"""
     return user_id in ADMINS
 
+class _SheetStream:
+    """Лист отчета, который заполняется строго сверху вниз (режим constant_memory)"""
+    
+    def __init__(self, workbook, name, header=None):
+        self.sheet = workbook.add_worksheet(name)
+        self.header = None
+        self.rows = 0
+        if header is not None:
+            self.write_header(header)
+    
+    def write_header(self, header):
+        self.header = header
+        self.sheet.write_row(0, 0, header)
+    
+    def append(self, values):
+        self.rows += 1
+        self.sheet.write_row(self.rows, 0, values)
+
 # admin_handler.py - обновляем функцию get_statistics
 
 @router.message(Command("stats"))
@@ -36,7 +60,7 @@ async def get_statistics(message: types.Message, state: FSMContext):
         await message.answer("❌ У вас нет доступа к этой команде.")
         return
     
-    if not supabase_client:
+    if not storage:
         await message.answer("❌ База данных не доступна.")
         return
     
@@ -46,206 +70,203 @@ async def get_statistics(message: types.Message, state: FSMContext):
     try:
         await message.answer("📊 Формирую отчет... Это может занять некоторое время.")
         
-        # Получаем данные отдельными запросами
-        surveys_response = await supabase_client.get_all_surveys()
-        users_response = await supabase_client.get_all_users()
-        meal_ratings_response = await supabase_client.get_all_meal_ratings()
-        meal_comments_response = await supabase_client.get_all_meal_comments()
-        
-        surveys_data = surveys_response.data
-        users_data = users_response.data
-        meal_ratings_data = meal_ratings_response.data
-        meal_comments_data = meal_comments_response.data
+        # xlsxwriter нужен только для отчета - не замедляем им запуск бота
+        import xlsxwriter
         
-        if not surveys_data:
-            await message.answer("📭 Нет данных для отчета.")
-            return
-        
-        # Создаем временный файл
-        with tempfile.NamedTemporaryFile(mode='wb', suffix='.xlsx', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp:
             temp_file = tmp.name
+        
+        # constant_memory: каждая строка листа сбрасывается на диск, как только
+        # начата следующая, поэтому строки пишутся сразу из iter_* по порядку.
+        # В памяти остаются только индексы (ФИО и класс по telegram_id, дата по
+        # id анкеты) и счетчики для сводных листов.
+        workbook = xlsxwriter.Workbook(temp_file, {'constant_memory': True})
+        try:
+            # Листы создаются сразу, чтобы сохранить их порядок в файле
+            surveys_sheet = _SheetStream(workbook, 'Опросы', [
+                'ID анкеты', 'Дата', 'Telegram ID', 'ФИО', 'Класс', 'Питается в школе',
+                'Причина непосещения', 'Общая оценка', 'Общий комментарий'
+            ])
+            users_sheet = _SheetStream(workbook, 'Пользователи')
+            ratings_sheet = _SheetStream(workbook, 'Оценки блюд', ['ID анкеты', 'Дата', 'Тип блюда', 'Оценка'])
+            summary_sheet = _SheetStream(workbook, 'Сводка по блюдам', [
+                'Тип блюда', 'Средняя оценка', 'Количество', 'Минимум', 'Максимум'
+            ])
+            daily_sheet = _SheetStream(workbook, 'Сводка по дням и классам', [
+                'Дата', 'Класс', 'Тип блюда', 'Средняя оценка', 'Количество',
+                *(f'{rating}★' for rating in range(1, 6))
+            ])
+            comments_sheet = _SheetStream(workbook, 'Комментарии', [
+                'ID анкеты', 'Дата', 'Тип блюда', 'Причина', 'Альтернатива'
+            ])
+            non_eaters_sheet = _SheetStream(workbook, 'Непосещающие столовую', [
+                'Дата', 'Telegram ID', 'ФИО', 'Класс', 'Причина', 'Длина причины'
+            ])
+            reasons_sheet = _SheetStream(workbook, 'Анализ причин', ['Причина', 'Количество'])
+            stats_sheet = _SheetStream(workbook, 'Статистика', ['Метрика', 'Значение'])
+            chart_sheet = workbook.add_worksheet('Графики')
             
-            with pd.ExcelWriter(temp_file, engine='xlsxwriter') as writer:
-                workbook = writer.book
-                
-                # Лист с основными данными опросов
-                basic_data = []
-                for survey in surveys_data:
-                    user = next((u for u in users_data if u['telegram_id'] == survey['telegram_id']), {})
-                    
-                    # Определяем статус питания
-                    eats_at_school = survey.get('eats_at_school', False)
-                    status = "Да" if eats_at_school else "Нет"
-                    
-                    # Формируем причину если не питается
-                    reason = ""
-                    if not eats_at_school:
-                        reason = survey.get('no_school_reason', 'Причина не указана')
-                        if not reason:
-                            reason = "Причина не указана"
-                    
-                    basic_data.append({
-                        'ID анкеты': survey.get('id'),
-                        'Дата': survey.get('date'),
-                        'Telegram ID': survey.get('telegram_id'),
-                        'ФИО': user.get('full_name', 'Не указано'),
-                        'Класс': user.get('class', 'Не указан'),
-                        'Питается в школе': status,
-                        'Причина непосещения': reason,
-                        'Общая оценка': survey.get('overall_satisfaction', 'Не оценено'),
-                        'Общий комментарий': survey.get('overall_comment', '')[:100] + '...' if survey.get('overall_comment') else ''
-                    })
-                
-                basic_df = pd.DataFrame(basic_data)
-                basic_df.to_excel(writer, sheet_name='Опросы', index=False)
-                
-                # Лист с пользователями
-                users_df = pd.DataFrame(users_data)
-                if not users_df.empty:
-                    users_df.to_excel(writer, sheet_name='Пользователи', index=False)
-                
-                # Лист с оценками блюд
-                if meal_ratings_data:
-                    ratings_data = []
-                    for rating in meal_ratings_data:
-                        # Находим анкету для этой оценки
-                        survey = next((s for s in surveys_data if s['id'] == rating['survey_id']), {})
-                        ratings_data.append({
-                            'ID анкеты': rating.get('survey_id'),
-                            'Дата': survey.get('date', 'Неизвестно'),
-                            'Тип блюда': rating.get('meal_type'),
-                            'Оценка': rating.get('rating')
-                        })
-                    
-                    ratings_df = pd.DataFrame(ratings_data)
-                    ratings_df.to_excel(writer, sheet_name='Оценки блюд', index=False)
-                    
-                    # Сводка по оценкам блюд
-                    if not ratings_df.empty:
-                        pivot_df = ratings_df.groupby('Тип блюда').agg({
-                            'Оценка': ['mean', 'count', 'min', 'max']
-                        }).round(2)
-                        pivot_df.to_excel(writer, sheet_name='Сводка по блюдам')
-                
-                # Лист с комментариями
-                if meal_comments_data:
-                    comments_data = []
-                    for comment in meal_comments_data:
-                        # Находим анкету для этого комментария
-                        survey = next((s for s in surveys_data if s['id'] == comment['survey_id']), {})
-                        comments_data.append({
-                            'ID анкеты': comment.get('survey_id'),
-                            'Дата': survey.get('date', 'Неизвестно'),
-                            'Тип блюда': comment.get('meal_type'),
-                            'Причина': comment.get('reason_comment', '')[:200] + '...',
-                            'Альтернатива': comment.get('alternative_comment', '')[:200] + '...'
-                        })
-                    
-                    comments_df = pd.DataFrame(comments_data)
-                    comments_df.to_excel(writer, sheet_name='Комментарии', index=False)
-                
-                # НОВЫЙ ЛИСТ: Статистика по непосещающим столовую
-                non_eaters_data = []
-                for survey in surveys_data:
-                    if not survey.get('eats_at_school', True):
-                        user = next((u for u in users_data if u['telegram_id'] == survey['telegram_id']), {})
-                        reason = survey.get('no_school_reason', '')
-                        
-                        non_eaters_data.append({
-                            'Дата': survey.get('date'),
-                            'Telegram ID': survey.get('telegram_id'),
-                            'ФИО': user.get('full_name', 'Не указано'),
-                            'Класс': user.get('class', 'Не указан'),
-                            'Причина': reason,
-                            'Длина причины': len(reason) if reason else 0
-                        })
-                
-                if non_eaters_data:
-                    non_eaters_df = pd.DataFrame(non_eaters_data)
-                    non_eaters_df.to_excel(writer, sheet_name='Непосещающие столовую', index=False)
-                    
-                    # Анализ причин
-                    reasons_analysis = non_eaters_df['Причина'].value_counts().head(10)
-                    reasons_df = pd.DataFrame({
-                        'Причина': reasons_analysis.index,
-                        'Количество': reasons_analysis.values
-                    })
-                    reasons_df.to_excel(writer, sheet_name='Анализ причин', index=False)
-                
-                # Статистика и графики
-                worksheet = workbook.add_worksheet('Статистика')
-                
-                # Базовая статистика
-                total_surveys = len(surveys_data)
-                total_users = len(users_data)
-                eaters_count = sum(1 for s in surveys_data if s.get('eats_at_school', True))
-                non_eaters_count = total_surveys - eaters_count
+            # Пользователи: строка листа + компактный индекс для анкет
+            users_by_id = {}
+            async for user in storage.iter_users():
+                if users_sheet.header is None:
+                    users_sheet.write_header(list(user))
+                users_sheet.append([user.get(column) for column in users_sheet.header])
+                users_by_id[user['telegram_id']] = (
+                    user.get('full_name', 'Не указано'), user.get('class', 'Не указан')
+                )
+            
+            # Анкеты: листы опросов и непосещающих пишутся за один проход
+            survey_dates = {}
+            eaters_count = 0
+            overall_counts = Counter()
+            reasons = Counter()
+            async for survey in storage.iter_surveys(
+                columns="id,date,telegram_id,eats_at_school,no_school_reason,overall_satisfaction,overall_comment"
+            ):
+                survey_dates[survey['id']] = survey.get('date')
+                full_name, class_name = users_by_id.get(survey['telegram_id'], ('Не указано', 'Не указан'))
                 
-                stats_data = {
-                    'Метрика': [
-                        'Всего опросов',
-                        'Всего пользователей', 
-                        'Всего оценок блюд',
-                        'Всего комментариев',
-                        'Питаются в столовой',
-                        'Не питаются в столовой',
-                        'Процент непосещающих',
-                        'Средняя общая оценка',
-                        'Дата отчета'
-                    ],
-                    'Значение': [
-                        total_surveys,
-                        total_users,
-                        len(meal_ratings_data),
-                        len(meal_comments_data),
-                        eaters_count,
-                        non_eaters_count,
-                        f"{(non_eaters_count/total_surveys*100):.1f}%" if total_surveys > 0 else "0%",
-                        basic_df[basic_df['Общая оценка'] != 'Не оценено']['Общая оценка'].mean() if not basic_df.empty else 0,
-                        datetime.now().strftime('%d.%m.%Y %H:%M')
-                    ]
-                }
+                # Формируем причину если не питается
+                eats_at_school = survey.get('eats_at_school', False)
+                reason = ""
+                if eats_at_school:
+                    eaters_count += 1
+                else:
+                    raw_reason = survey.get('no_school_reason') or ''
+                    reason = raw_reason or "Причина не указана"
+                    reasons[raw_reason] += 1
+                    non_eaters_sheet.append([
+                        survey.get('date'), survey.get('telegram_id'), full_name, class_name,
+                        raw_reason, len(raw_reason)
+                    ])
                 
-                stats_df = pd.DataFrame(stats_data)
-                stats_df.to_excel(writer, sheet_name='Статистика', index=False)
+                overall = survey.get('overall_satisfaction')
+                if overall is not None:
+                    overall_counts[overall] += 1
                 
-                # Простые графики
-                if not basic_df.empty and 'Общая оценка' in basic_df.columns:
-                    chart_sheet = workbook.add_worksheet('Графики')
-                    
-                    # Распределение общих оценок
-                    rating_counts = basic_df[basic_df['Общая оценка'] != 'Не оценено']['Общая оценка'].value_counts().sort_index()
-                    
-                    if not rating_counts.empty:
-                        chart = workbook.add_chart({'type': 'column'})
-                        chart.add_series({
-                            'name': 'Количество оценок',
-                            'categories': f'=Опросы!$H$2:$H${len(rating_counts)+1}',
-                            'values': f'=Опросы!$H$2:$H${len(rating_counts)+1}',
-                        })
-                        chart.set_title({'name': 'Распределение общих оценок'})
-                        chart_sheet.insert_chart('A1', chart)
-                    
-                    # Распределение по питанию в столовой
-                    nutrition_counts = basic_df['Питается в школе'].value_counts()
-                    if not nutrition_counts.empty:
-                        chart2 = workbook.add_chart({'type': 'pie'})
-                        chart2.add_series({
-                            'name': 'Питание в столовой',
-                            'categories': f'=Статистика!$A$6:$A$7',
-                            'values': f'=Статистика!$B$6:$B$7',
-                        })
-                        chart2.set_title({'name': 'Распределение по питанию в столовой'})
-                        chart_sheet.insert_chart('A20', chart2)
-        
-        # Читаем файл для отправки
-        with open(temp_file, 'rb') as file:
-            file_data = file.read()
+                overall_comment = survey.get('overall_comment')
+                surveys_sheet.append([
+                    survey.get('id'),
+                    survey.get('date'),
+                    survey.get('telegram_id'),
+                    full_name,
+                    class_name,
+                    "Да" if eats_at_school else "Нет",
+                    reason,
+                    overall if overall is not None else 'Не оценено',
+                    overall_comment[:100] + '...' if overall_comment else ''
+                ])
+            del users_by_id
+            
+            total_surveys = surveys_sheet.rows
+            if not total_surveys:
+                await message.answer("📭 Нет данных для отчета.")
+                return
+            
+            # Оценки и комментарии читаем постранично только нужными колонками
+            async for rating in storage.iter_meal_ratings(columns="survey_id,meal_type,rating"):
+                ratings_sheet.append([
+                    rating.get('survey_id'),
+                    survey_dates.get(rating['survey_id'], 'Неизвестно'),
+                    rating.get('meal_type'),
+                    rating.get('rating')
+                ])
+            
+            async for comment in storage.iter_meal_comments(
+                columns="survey_id,meal_type,reason_comment,alternative_comment"
+            ):
+                comments_sheet.append([
+                    comment.get('survey_id'),
+                    survey_dates.get(comment['survey_id'], 'Неизвестно'),
+                    comment.get('meal_type'),
+                    (comment.get('reason_comment') or '')[:200] + '...',
+                    (comment.get('alternative_comment') or '')[:200] + '...'
+                ])
+            del survey_dates
+            
+            # Сводки по блюдам - из готового агрегата daily_meal_stats, без прохода по оценкам
+            meal_stats_response = await storage.get_daily_meal_stats()
+            totals = {}
+            for row in meal_stats_response.data:
+                if not row['ratings_count']:
+                    continue
+                meal_total = totals.setdefault(row['meal_type'], [0, 0, [0] * 5])
+                meal_total[0] += row['ratings_count']
+                meal_total[1] += row['ratings_sum']
+                for rating in range(1, 6):
+                    meal_total[2][rating - 1] += row[f'r{rating}']
+                daily_sheet.append([
+                    row['date'],
+                    row['class'] or 'Не указан',
+                    row['meal_type'],
+                    round(row['ratings_sum'] / row['ratings_count'], 2),
+                    row['ratings_count'],
+                    *(row[f'r{rating}'] for rating in range(1, 6))
+                ])
+            
+            for meal_type, (count, total, buckets) in totals.items():
+                rated = [rating for rating in range(1, 6) if buckets[rating - 1]]
+                summary_sheet.append([meal_type, round(total / count, 2), count, min(rated), max(rated)])
+            
+            for reason, count in reasons.most_common(10):
+                reasons_sheet.append([reason, count])
+            
+            # Базовая статистика
+            non_eaters_count = total_surveys - eaters_count
+            overall_total = sum(overall_counts.values())
+            overall_average = (
+                sum(rating * count for rating, count in overall_counts.items()) / overall_total
+                if overall_total else 0
+            )
+            for metric, value in [
+                ('Всего опросов', total_surveys),
+                ('Всего пользователей', users_sheet.rows),
+                ('Всего оценок блюд', ratings_sheet.rows),
+                ('Всего комментариев', comments_sheet.rows),
+                ('Питаются в столовой', eaters_count),
+                ('Не питаются в столовой', non_eaters_count),
+                ('Процент непосещающих', f"{(non_eaters_count/total_surveys*100):.1f}%"),
+                ('Средняя общая оценка', overall_average),
+                ('Дата отчета', datetime.now().strftime('%d.%m.%Y %H:%M')),
+            ]:
+                stats_sheet.append([metric, value])
+            
+            # Распределение общих оценок - данные для первого графика
+            stats_sheet.append([])
+            stats_sheet.append(['Общая оценка', 'Количество'])
+            distribution_first = stats_sheet.rows + 2
+            for rating in sorted(overall_counts):
+                stats_sheet.append([rating, overall_counts[rating]])
+            distribution_last = stats_sheet.rows + 1
+            
+            # Простые графики
+            if overall_counts:
+                chart = workbook.add_chart({'type': 'column'})
+                chart.add_series({
+                    'name': 'Количество оценок',
+                    'categories': f'=Статистика!$A${distribution_first}:$A${distribution_last}',
+                    'values': f'=Статистика!$B${distribution_first}:$B${distribution_last}',
+                })
+                chart.set_title({'name': 'Распределение общих оценок'})
+                chart_sheet.insert_chart('A1', chart)
+            
+            # Распределение по питанию в столовой
+            chart2 = workbook.add_chart({'type': 'pie'})
+            chart2.add_series({
+                'name': 'Питание в столовой',
+                'categories': f'=Статистика!$A$6:$A$7',
+                'values': f'=Статистика!$B$6:$B$7',
+            })
+            chart2.set_title({'name': 'Распределение по питанию в столовой'})
+            chart_sheet.insert_chart('A20', chart2)
+        finally:
+            workbook.close()
         
-        # Отправляем файл
+        # Отправляем файл с диска, не читая его в память целиком
         await message.answer_document(
-            document=types.BufferedInputFile(
-                file_data,
+            document=types.FSInputFile(
+                temp_file,
                 filename=f"school_food_stats_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
             ),
             caption="📊 *Статистика опросов школьного питания*\n\n"
@@ -253,6 +274,7 @@ async def get_statistics(message: types.Message, state: FSMContext):
                    "• Все опросы (с причинами непосещения)\n" 
                    "• Пользователей\n"
                    "• Оценки блюд\n"
+                   "• Сводки по блюдам, дням и классам\n"
                    "• Комментарии\n"
                    "• Непосещающих столовую\n"
                    "• Анализ причин\n"
@@ -292,47 +314,43 @@ async def get_daily_stats(message: types.Message, state: FSMContext):
         await message.answer("❌ У вас нет доступа к этой команде.")
         return
     
-    if not supabase_client:
+    if not storage:
         await message.answer("❌ База данных не доступна.")
         return
     
     try:
         today = datetime.now().date().isoformat()
-        today_stats = await supabase_client.get_daily_stats(today)
-        stats_data = today_stats.data
+        # Все агрегаты считаются на стороне хранилища одним запросом
+        summary = (await storage.daily_summary(today)).data
         
-        if not stats_data:
+        if not summary['total_surveys']:
             await message.answer("📭 На сегодня нет данных.")
             return
         
-        # Получаем дополнительные данные для расчетов
-        all_ratings = await supabase_client.get_all_meal_ratings()
-        today_ratings = [r for r in all_ratings.data if any(s['id'] == r['survey_id'] for s in stats_data)]
-        
-        total_surveys = len(stats_data)
-        
-        # Статистика по питанию в столовой
-        eaters_count = sum(1 for s in stats_data if s.get('eats_at_school', True))
-        non_eaters_count = total_surveys - eaters_count
-        
-        # Средняя общая оценка (только у тех, кто питается)
-        overall_ratings = [s.get('overall_satisfaction', 0) for s in stats_data if s.get('overall_satisfaction') and s.get('eats_at_school', True)]
-        avg_overall = sum(overall_ratings) / len(overall_ratings) if overall_ratings else 0
-        
-        # Средняя оценка блюд
-        avg_meal = sum(r.get('rating', 0) for r in today_ratings) / len(today_ratings) if today_ratings else 0
+        avg_overall = summary['avg_overall'] or 0
+        avg_meal = summary['avg_meal'] or 0
         
         stats_text = (
             f"📊 *Статистика за сегодня* ({datetime.now().strftime('%d.%m.%Y')})\n\n"
-            f"• Всего опросов: {total_surveys}\n"
-            f"• Питаются в столовой: {eaters_count}\n"
-            f"• Не питаются в столовой: {non_eaters_count}\n"
+            f"• Всего опросов: {summary['total_surveys']}\n"
+            f"• Питаются в столовой: {summary['eaters']}\n"
+            f"• Не питаются в столовой: {summary['non_eaters']}\n"
             f"• Средняя общая оценка: {avg_overall:.1f}/5\n"
             f"• Средняя оценка блюд: {avg_meal:.1f}/5\n"
-            f"• Оценено блюд: {len(today_ratings)}\n\n"
-            f"Для полного отчета используйте /stats"
+            f"• Оценено блюд: {summary['ratings_count']}\n"
         )
         
+        # Распределение оценок по блюдам
+        if summary['meals']:
+            stats_text += "\n*По блюдам:*\n"
+            for meal_type, meal in summary['meals'].items():
+                distribution = " ".join(
+                    f"{rating}★×{meal['distribution'].get(rating, 0)}" for rating in range(1, 6)
+                )
+                stats_text += f"• {meal_type.capitalize()}: {meal['avg']:.1f}/5 ({meal['count']}) — {distribution}\n"
+        
+        stats_text += "\nДля полного отчета используйте /stats"
+        
         await message.answer(stats_text, parse_mode="Markdown")
         
     except Exception as e:
@@ -359,7 +377,6 @@ async def refresh_meals_cache(message: types.Message, state: FSMContext):
     
     try:
         # Принудительно обновляем кэш и получаем АКТУАЛЬНЫЕ данные
-        from functions.yandex_disk import yandex_disk
         meals = await yandex_disk.refresh_and_get_meals()
         
         # Формируем отчет
@@ -388,3 +405,219 @@ async def refresh_meals_cache(message: types.Message, state: FSMContext):
     except Exception as e:
         logger.error(f"❌ Ошибка обновления кэша: {e}")
         await message.answer("❌ Произошла ошибка при обновлении кэша.")
+
+@router.message(Command("cache_stats"))
+async def get_cache_stats(message: types.Message, state: FSMContext):
+    """Статистика кэшей бота"""
+    # Проверяем, не находится ли пользователь в процессе опроса
+    current_state = await state.get_state()
+    if current_state is not None:
+        await message.answer(
+            "⏳ *Вы находитесь в процессе оценки питания!*\n\n"
+            "Завершите опрос или используйте /reset чтобы получить доступ к командам.",
+            parse_mode="Markdown"
+        )
+        return
+    
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде.")
+        return
+    
+    users_stats = storage.user_cache_stats()
+    
+    stats_text = "🗄 *Статистика кэшей*\n\n*Пользователи:*\n"
+    if users_stats is None:
+        stats_text += "• Кэш не используется этим хранилищем\n"
+    else:
+        stats_text += (
+            f"• Записей: {users_stats['size']}/{users_stats['maxsize']}\n"
+            f"• Попаданий: {users_stats['hits']}\n"
+            f"• Промахов: {users_stats['misses']}\n"
+            f"• Доля попаданий: {users_stats['hit_rate']:.0%}\n"
+            f"• Вытеснено: {users_stats['evictions']}\n"
+            f"• Истекло: {users_stats['expirations']}\n"
+        )
+    
+    photos_stats = photo_file_ids.stats()
+    stats_text += (
+        "\n*Фото блюд (file\\_id):*\n"
+        f"• Записей: {photos_stats['size']}/{photos_stats['maxsize']}\n"
+        f"• Отправлено по file\\_id: {photos_stats['hits']}\n"
+        f"• Загружено по ссылке: {photos_stats['misses']}\n"
+        f"• Доля попаданий: {photos_stats['hit_rate']:.0%}\n"
+    )
+    
+    cards_sent = send_counters['photo'] + send_counters['text_fallback']
+    fallback_rate = send_counters['text_fallback'] / cards_sent if cards_sent else 0
+    link_stats = yandex_disk.link_stats()
+    stats_text += (
+        f"• Текстом вместо фото: {send_counters['text_fallback']} из {cards_sent} ({fallback_rate:.0%})\n"
+        f"• Ссылок Диска перевыпущено: {link_stats['refreshes']} (ошибок: {link_stats['errors']})\n"
+    )
+    
+    optimizer_stats = photo_optimizer.stats()
+    stats_text += (
+        f"• Оптимизировано фото: {optimizer_stats['processed']} "
+        f"({optimizer_stats['original_bytes'] // 1024} КБ → {optimizer_stats['optimized_bytes'] // 1024} КБ)\n"
+        f"• Взято с локального диска: {optimizer_stats['disk_hits']} (ошибок: {optimizer_stats['errors']})\n"
+        f"• Удалено из кэша фото: {optimizer_stats['evicted']}\n"
+    )
+    
+    menu_stats = yandex_disk.menu_cache_stats()
+    stats_text += (
+        "\n*Меню по датам:*\n"
+        f"• Записей: {menu_stats['size']}/{menu_stats['maxsize']}\n"
+        f"• Попаданий: {menu_stats['hits']}\n"
+        f"• Промахов: {menu_stats['misses']}\n"
+        f"• Доля попаданий: {menu_stats['hit_rate']:.0%}\n"
+        f"• Вытеснено: {menu_stats['evictions']}\n"
+        f"• Истекло: {menu_stats['expirations']}\n"
+        f"• Запросов, дождавшихся общей загрузки: {menu_stats['coalesced']}\n"
+    )
+    
+    await message.answer(stats_text, parse_mode="Markdown")
+
+@router.message(Command("invalidate_menu"))
+async def invalidate_menu(message: types.Message, state: FSMContext):
+    """Сброс кэша меню на указанную дату"""
+    # Проверяем, не находится ли пользователь в процессе опроса
+    current_state = await state.get_state()
+    if current_state is not None:
+        await message.answer(
+            "⏳ *Вы находитесь в процессе оценки питания!*\n\n"
+            "Завершите опрос или используйте /reset чтобы получить доступ к командам.",
+            parse_mode="Markdown"
+        )
+        return
+    
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде.")
+        return
+    
+    parts = message.text.split()
+    try:
+        if len(parts) != 2:
+            raise ValueError
+        date_str = datetime.strptime(parts[1], "%d.%m.%Y").strftime("%d.%m.%Y")
+    except ValueError:
+        await message.answer(
+            "❌ Укажите дату в формате ДД.ММ.ГГГГ\n\nПример: `/invalidate_menu 15.09.2025`",
+            parse_mode="Markdown"
+        )
+        return
+    
+    if yandex_disk.invalidate_date(date_str):
+        await message.answer(f"🗑 Кэш меню на {date_str} сброшен.")
+    else:
+        await message.answer(f"ℹ️ Меню на {date_str} не было в кэше.")
+
+@router.message(Command("queue_stats"))
+async def get_queue_stats(message: types.Message, state: FSMContext):
+    """Состояние очереди сохранения опросов"""
+    # Проверяем, не находится ли пользователь в процессе опроса
+    current_state = await state.get_state()
+    if current_state is not None:
+        await message.answer(
+            "⏳ *Вы находитесь в процессе оценки питания!*\n\n"
+            "Завершите опрос или используйте /reset чтобы получить доступ к командам.",
+            parse_mode="Markdown"
+        )
+        return
+    
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде.")
+        return
+    
+    stats = await survey_queue.stats()
+    latency = stats['last_flush_latency']
+    
+    stats_text = (
+        "🚚 *Очередь сохранения опросов*\n\n"
+        f"• Ожидают записи в БД: {stats['depth']}\n"
+        f"• Принято с запуска: {stats['enqueued']}\n"
+        f"• Записано в БД: {stats['flushed']}\n"
+        f"• Ошибок записи: {stats['failures']}\n"
+        f"• Отклонены БД (dead_surveys): {stats['dead']}\n"
+        f"• Последняя выгрузка: {f'{latency * 1000:.0f} мс' if latency is not None else 'еще не было'}\n"
+    )
+    
+    await message.answer(stats_text, parse_mode="Markdown")
+
+@router.message(Command("fsm_stats"))
+async def get_fsm_stats(message: types.Message, state: FSMContext):
+    """Обращения к FSM-хранилищу за апдейт"""
+    # Проверяем, не находится ли пользователь в процессе опроса
+    current_state = await state.get_state()
+    if current_state is not None:
+        await message.answer(
+            "⏳ *Вы находитесь в процессе оценки питания!*\n\n"
+            "Завершите опрос или используйте /reset чтобы получить доступ к командам.",
+            parse_mode="Markdown"
+        )
+        return
+    
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде.")
+        return
+    
+    stats = state_snapshot_middleware.stats()
+    
+    stats_text = (
+        "🗂 *FSM хранилище*\n\n"
+        f"• Апдейтов с состоянием: {stats['updates']}\n"
+        f"• Чтений: {stats['reads']}\n"
+        f"• Записей: {stats['writes']}\n"
+        f"• В среднем обращений за апдейт: {stats['avg_ops']:.1f}\n"
+        f"• Максимум за апдейт: {stats['max_ops']}\n"
+    )
+    
+    await message.answer(stats_text, parse_mode="Markdown")
+
+@router.message(Command("menu_status"))
+async def get_menu_status(message: types.Message, state: FSMContext):
+    """Готовность меню на сегодня (фоновый прогрев)"""
+    # Проверяем, не находится ли пользователь в процессе опроса
+    current_state = await state.get_state()
+    if current_state is not None:
+        await message.answer(
+            "⏳ *Вы находитесь в процессе оценки питания!*\n\n"
+            "Завершите опрос или используйте /reset чтобы получить доступ к командам.",
+            parse_mode="Markdown"
+        )
+        return
+    
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде.")
+        return
+    
+    status = menu_prewarmer.status()
+    if status['date'] is None:
+        await message.answer(
+            f"⏳ Прогрев меню еще не запускался (запланирован на {menu_prewarmer.prewarm_time.strftime('%H:%M')} МСК)."
+        )
+        return
+    
+    # Текст ошибки приходит извне (Диск, Telegram), поэтому сообщение собирается
+    # из сущностей, а не Markdown-разметкой: спецсимволы в нем не ломают отправку
+    lines = [
+        f"• Готово: {'✅ да' if status['ready'] else '⏳ нет'}\n",
+        f"• Блюд с фото: {status['meals_with_images']}\n",
+    ]
+    if status['upload_enabled']:
+        lines.append(f"• Фото загружено в Telegram: {status['photos_uploaded']}\n")
+    else:
+        lines.append("• Загрузка фото в Telegram отключена (MENU_PREWARM_CHAT_ID)\n")
+    lines += [
+        f"• Попыток: {status['attempts']}\n",
+        f"• Последняя попытка: {status['last_run'].strftime('%H:%M:%S')}\n",
+        f"• Проверок Диска на новые фото: {status['change_checks']} (изменений: {status['change_changes']})\n",
+    ]
+    if status['ready_at']:
+        lines.append(f"• Готово с: {status['ready_at'].strftime('%H:%M:%S')}\n")
+    elif status['gave_up']:
+        lines.append("• Полные повторы прекращены, новые фото подхватывает проверка изменений\n")
+    if status['last_error']:
+        lines += ["• Последняя ошибка: ", Code(status['last_error'][:200]), "\n"]
+    
+    status_text = Text(Bold(f"🔥 Прогрев меню на {status['date'].strftime('%d.%m.%Y')}"), "\n\n", *lines)
+    await message.answer(**status_text.as_kwargs())
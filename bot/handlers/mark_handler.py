@@ -31,11 +31,7 @@ async def start_survey(message: types.Message, state: FSMContext):
         )
         return
     
-    # Инициализируем глобальную переменную
-    from callbacks.type_callback import current_user_id
-    global current_user_id
-    current_user_id = message.from_user.id
-    logger.info(f"👤 Инициализирован user_id: {current_user_id}")
+    logger.info(f"👤 Начат опрос пользователя {message.from_user.id}")
     
     await message.answer(
         "🏫 *Первый вопрос:*\n\n"
@@ -15,12 +15,13 @@ from keyboards.survey_keyboards import (
     get_comment_skip_keyboard,
     get_meal_comment_keyboard
 )
-from functions.yandex_disk import yandex_disk
-from database.db_supabase import supabase_client
+from functions.yandex_disk import MEAL_TYPES, yandex_disk
+from functions.meal_photos import send_meal_card
+from middlewares.state_snapshot import flush_state
+from database.storage import storage
+from database.survey_queue import survey_queue
 
 
-current_user_id = None
-
 class SpecialSurveyStates(StatesGroup):
     waiting_for_date = State()
     waiting_for_school_confirmation = State()
@@ -34,8 +35,6 @@ class SpecialSurveyStates(StatesGroup):
 @router.message(Command("mark_special"))
 async def start_special_survey(message: types.Message, state: FSMContext):
     """Начало специального опроса для произвольной даты"""
-    global current_user_id
-    
     # Проверяем, не находится ли пользователь уже в процессе опроса
     current_state = await state.get_state()
     if current_state is not None:
@@ -46,10 +45,6 @@ async def start_special_survey(message: types.Message, state: FSMContext):
         )
         return
     
-    # Сохраняем user_id в глобальную переменную
-    current_user_id = message.from_user.id
-    logger.info(f"👤 Инициализирован user_id для специального опроса: {current_user_id}")
-    
     await message.answer(
         "📅 *Оценка питания за конкретный день*\n\n"
         "Введите дату в формате *ДД.ММ.ГГГГ*:\n"
@@ -103,11 +98,6 @@ async def process_special_date(message: types.Message, state: FSMContext):
 @router.callback_query(SpecialSurveyStates.waiting_for_school_confirmation, F.data.startswith("school_"))
 async def process_special_school_confirmation(callback: types.CallbackQuery, state: FSMContext):
     """Обработка подтверждения питания в школе для специальной даты"""
-    global current_user_id
-    
-    # Обновляем user_id из callback
-    current_user_id = callback.from_user.id
-    
     eats_at_school = callback.data == "school_yes"
     
     # Сохраняем в состоянии
@@ -178,8 +168,6 @@ async def process_special_user_info(message: types.Message, state: FSMContext):
     
     # Создаем/обновляем пользователя в БД
     try:
-        from database.db_supabase import supabase_client
-        
         user_data = {
             "telegram_id": message.from_user.id,
             "full_name": full_name,
@@ -187,11 +175,11 @@ async def process_special_user_info(message: types.Message, state: FSMContext):
             "has_profile": True
         }
         
-        if not await supabase_client.user_exists(message.from_user.id):
-            await supabase_client.create_user(user_data)
+        if not await storage.user_exists(message.from_user.id):
+            await storage.create_user(user_data)
             logger.info(f"✅ Создан новый пользователь: {message.from_user.id}")
         else:
-            await supabase_client.update_user_info(
+            await storage.update_user_info(
                 message.from_user.id, 
                 full_name, 
                 class_name
@@ -227,10 +215,8 @@ async def process_special_user_info(message: types.Message, state: FSMContext):
 @router.callback_query(SpecialSurveyStates.waiting_for_no_school_reason, F.data == "skip_comment_no_school_reason")
 async def skip_no_school_reason(callback: types.CallbackQuery, state: FSMContext):
     """Пропуск причины непосещения столовой"""
-    global current_user_id
-    
-    # Обновляем user_id
-    current_user_id = callback.from_user.id
+    # Ученик опроса - владелец FSM-сессии, а не общая переменная модуля
+    user_id = state.key.user_id
     
     await callback.answer("Причина пропущена")
     await callback.message.delete()
@@ -238,33 +224,26 @@ async def skip_no_school_reason(callback: types.CallbackQuery, state: FSMContext
     # Сохраняем пользователя в БД даже если он не питается в столовой
     try:
         user_data = {
-            "telegram_id": current_user_id,
+            "telegram_id": user_id,
             "full_name": "",
             "class": "",
             "has_profile": False
         }
         
-        if not await supabase_client.user_exists(current_user_id):
-            await supabase_client.create_user(user_data)
-            logger.info(f"✅ Создан пользователь для специальной анкеты (не питается): {current_user_id}")
-        
         # Создаем анкету с пустой причиной
         data = await state.get_data()
         survey_date = data.get('survey_date', 'Неизвестная дата')
         
         survey_data = {
+            "date": survey_date,
             "eats_at_school": False,
             "no_school_reason": "",
             "overall_satisfaction": None,
             "overall_comment": ""
         }
         
-        await supabase_client.create_or_update_survey_for_date(
-            current_user_id,
-            survey_date,
-            survey_data
-        )
-        logger.info(f"✅ Создана специальная анкета с пустой причиной для {current_user_id}")
+        await survey_queue.enqueue(user_data, survey_data, [], [])
+        logger.info(f"✅ Создана специальная анкета с пустой причиной для {user_id}")
         
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения специальной анкеты с пустой причиной: {e}")
@@ -284,10 +263,7 @@ async def skip_no_school_reason(callback: types.CallbackQuery, state: FSMContext
 @router.message(SpecialSurveyStates.waiting_for_no_school_reason)
 async def process_no_school_reason(message: types.Message, state: FSMContext):
     """Обработка причины непосещения столовой"""
-    global current_user_id
-    
-    # Обновляем user_id
-    current_user_id = message.from_user.id
+    user_id = state.key.user_id
     
     reason = message.text.strip()
     
@@ -323,30 +299,23 @@ async def process_no_school_reason(message: types.Message, state: FSMContext):
     try:
         # Сохраняем пользователя даже если он не питается в столовой
         user_data = {
-            "telegram_id": current_user_id,
+            "telegram_id": user_id,
             "full_name": "",
             "class": "",
             "has_profile": False
         }
         
-        if not await supabase_client.user_exists(current_user_id):
-            await supabase_client.create_user(user_data)
-            logger.info(f"✅ Создан пользователь для специальной анкеты (не питается): {current_user_id}")
-        
         # Создаем анкету с причиной
         survey_data = {
+            "date": survey_date,
             "eats_at_school": False,
             "no_school_reason": reason,
             "overall_satisfaction": None,
             "overall_comment": ""
         }
         
-        await supabase_client.create_or_update_survey_for_date(
-            current_user_id,
-            survey_date,
-            survey_data
-        )
-        logger.info(f"✅ Создана специальная анкета с причиной для {current_user_id}")
+        await survey_queue.enqueue(user_data, survey_data, [], [])
+        logger.info(f"✅ Создана специальная анкета с причиной для {user_id}")
         
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения специальной анкеты с причиной: {e}")
@@ -434,9 +403,9 @@ async def start_special_meal_rating(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    # Сохраняем блюда в состоянии
+    # В состоянии только дата меню и номера блюд: само меню лежит в общем кэше Диска
     await state.update_data(
-        meals=meals,
+        menu_date=meals[0]['date'],
         current_meal_index=0,
         meal_ratings=[],
         low_rated_meals=[]
@@ -448,15 +417,14 @@ async def start_special_meal_rating(message: types.Message, state: FSMContext):
 async def show_special_next_meal(message: types.Message, state: FSMContext):
     """Показывает следующее блюдо для оценки для специальной даты"""
     data = await state.get_data()
-    meals = data['meals']
     current_index = data['current_meal_index']
     
-    if current_index >= len(meals):
+    if current_index >= len(MEAL_TYPES):
         # Все блюда оценены
         await process_special_meal_comments(message, state)
         return
     
-    current_meal = meals[current_index]
+    current_meal = await yandex_disk.get_menu_meal(data['menu_date'], current_index)
     
     # КРАСИВЫЕ ТЕКСТЫ в зависимости от наличия фото
     if current_meal.get('has_image', True) and current_meal.get('download_url'):
@@ -473,38 +441,19 @@ async def show_special_next_meal(message: types.Message, state: FSMContext):
         else:
             caption = f"🍽 *{current_meal['name']}*\n\nКак вы оцените это блюдо?"
     
-    # Проверяем есть ли изображение у блюда
-    has_image = current_meal.get('has_image', True) and current_meal.get('download_url')
-    
-    try:
-        if has_image:
-            # Отправляем с фото
-            meal_message = await message.answer_photo(
-                photo=current_meal['download_url'],
-                caption=caption,
-                reply_markup=get_emoji_rating_keyboard("meal"),
-                parse_mode="Markdown"
-            )
-        else:
-            # Отправляем только текст
-            meal_message = await message.answer(
-                caption,
-                reply_markup=get_emoji_rating_keyboard("meal"),
-                parse_mode="Markdown"
-            )
-        
-        await state.update_data(current_meal_message_id=meal_message.message_id)
-    except Exception as e:
-        # Если не удалось отправить фото, отправляем текстом
-        logger.error(f"Ошибка отправки фото: {e}")
-        meal_message = await message.answer(
-            caption,
-            reply_markup=get_emoji_rating_keyboard("meal"),
-            parse_mode="Markdown"
-        )
-        await state.update_data(current_meal_message_id=meal_message.message_id)
-    
+    # Оценка и новое состояние сохраняются до показа карточки: ответ на нее
+    # должен застать их уже в хранилище
     await state.set_state(SpecialSurveyStates.waiting_for_meal_rating)
+    await flush_state(state)
+    
+    # С фото, если оно есть; при ошибке отправки - текстом
+    meal_message = await send_meal_card(
+        message,
+        current_meal,
+        caption,
+        get_emoji_rating_keyboard("meal")
+    )
+    await state.update_data(current_meal_message_id=meal_message.message_id)
 
 @router.callback_query(SpecialSurveyStates.waiting_for_meal_rating, F.data.startswith("rating_meal_"))
 async def process_special_meal_rating(callback: types.CallbackQuery, state: FSMContext):
@@ -519,23 +468,16 @@ async def process_special_meal_rating(callback: types.CallbackQuery, state: FSMC
     await callback.message.delete()
     
     data = await state.get_data()
-    meals = data['meals']
     current_index = data['current_meal_index']
     meal_ratings = data['meal_ratings']
     low_rated_meals = data['low_rated_meals']
     
-    current_meal = meals[current_index]
-    
-    # Сохраняем оценку
-    meal_rating = {
-        "type": current_meal['type'],
-        "rating": rating
-    }
-    meal_ratings.append(meal_rating)
+    # Сохраняем оценку (i-я оценка - блюду MEAL_TYPES[i])
+    meal_ratings.append(rating)
     
-    # Если оценка низкая, добавляем в список для комментариев
+    # Если оценка низкая, добавляем номер блюда в список для комментариев
     if rating <= 3:
-        low_rated_meals.append(current_meal['type'])
+        low_rated_meals.append(current_index)
     
     # Обновляем состояние
     await state.update_data(
@@ -580,9 +522,12 @@ async def show_special_next_comment_request(message: types.Message, state: FSMCo
         await finish_special_survey(message, state)
         return
     
-    meal_type = low_rated_meals[current_index]
+    meal_type = MEAL_TYPES[low_rated_meals[current_index]]
     meal_name = meal_type.capitalize()
     
+    await state.set_state(SpecialSurveyStates.waiting_for_meal_comment)
+    await flush_state(state)
+    
     comment_message = await message.answer(
         f"💬 *Комментарий для {meal_name}:*\n\n"
         f"Пожалуйста, напишите:\n"
@@ -594,7 +539,6 @@ async def show_special_next_comment_request(message: types.Message, state: FSMCo
     )
     
     await state.update_data(current_comment_message_id=comment_message.message_id)
-    await state.set_state(SpecialSurveyStates.waiting_for_meal_comment)
 
 @router.callback_query(SpecialSurveyStates.waiting_for_meal_comment, F.data == "skip_meal_comment")
 async def skip_special_meal_comment(callback: types.CallbackQuery, state: FSMContext):
@@ -625,19 +569,12 @@ async def process_special_meal_comment(message: types.Message, state: FSMContext
         except Exception as e:
             logger.warning(f"Не удалось удалить сообщение: {e}")
     
-    data = await state.get_data()
     low_rated_meals = data['low_rated_meals']
     current_index = data['current_comment_meal_index']
     meal_comments = data['meal_comments']
     
-    meal_type = low_rated_meals[current_index]
-    
-    # Сохраняем комментарий
-    meal_comment = {
-        "type": meal_type,
-        "comment": comment
-    }
-    meal_comments.append(meal_comment)
+    # Сохраняем комментарий парой [номер блюда, текст]
+    meal_comments.append([low_rated_meals[current_index], comment])
     
     # Обновляем состояние
     await state.update_data(
@@ -649,31 +586,22 @@ async def process_special_meal_comment(message: types.Message, state: FSMContext
 
 async def finish_special_survey(message: types.Message, state: FSMContext):
     """Завершение специального опроса и сохранение данных"""
-    global current_user_id
-    
+    # message здесь может быть сообщением бота, поэтому ученика берем из ключа FSM
+    user_id = state.key.user_id
     data = await state.get_data()
     survey_date = data.get('survey_date')
     
     try:
-        # Используем глобальную переменную current_user_id
-        user_id = current_user_id
-        
-        # ПЕРВОЕ: Убедимся, что пользователь существует в таблице users
-        user_exists = await supabase_client.user_exists(user_id)
-        if not user_exists:
-            # Создаем базового пользователя
-            user_data = {
-                "telegram_id": user_id,
-                "full_name": data.get('full_name', 'Не указано'),
-                "class": data.get('class_name', 'Не указан'),
-                "has_profile": True
-            }
-            await supabase_client.create_user(user_data)
-            logger.info(f"✅ Создан пользователь для специальной анкеты: {user_id}")
+        # ПЕРВОЕ: Пользователь (создается, если его еще нет)
+        user_data = {
+            "telegram_id": user_id,
+            "full_name": data.get('full_name', 'Не указано'),
+            "class": data.get('class_name', 'Не указан'),
+            "has_profile": True
+        }
         
-        # ВТОРОЕ: Создаем/обновляем анкету для указанной даты
+        # ВТОРОЕ: Анкета для указанной даты с оценками и комментариями
         survey_data = {
-            "telegram_id": user_id,  # ИСПРАВЛЕНО: используем user_id, а не message.from_user.id
             "eats_at_school": True,
             "overall_satisfaction": data.get('overall_satisfaction'),
             "overall_comment": data.get('overall_comment', ''),
@@ -681,51 +609,28 @@ async def finish_special_survey(message: types.Message, state: FSMContext):
             "date": survey_date  # Добавляем дату
         }
         
-        # Проверяем существующую анкету для этой даты
-        existing_survey = await supabase_client.get_user_survey_for_date(user_id, survey_date)  # ИСПРАВЛЕНО
-        
-        if existing_survey.data:
-            # Обновляем существующую анкету
-            survey_id = existing_survey.data[0]['id']
-            await supabase_client.update_survey(survey_id, survey_data)
-            
-            # Удаляем старые оценки и комментарии
-            await supabase_client.delete_meal_ratings(survey_id)
-            await supabase_client.delete_meal_comments(survey_id)
-            
-            update_message = "🔄 Ваш опрос обновлен!"
-        else:
-            # Создаем новую анкету
-            survey_response = await supabase_client.create_survey(survey_data)
-            survey_id = survey_response.data[0]['id']
-            update_message = "✅ Спасибо за ваш отзыв!"
-        
-        # Сохраняем оценки блюд
-        for meal_rating in data['meal_ratings']:
-            rating_data = {
-                "survey_id": survey_id,
-                "meal_type": meal_rating['type'],
-                "rating": meal_rating['rating']
+        ratings_data = [
+            {
+                "meal_type": MEAL_TYPES[index],
+                "rating": rating
             }
-            await supabase_client.add_meal_rating(rating_data)
+            for index, rating in enumerate(data['meal_ratings'])
+        ]
         
-        # Сохраняем комментарии к блюдам
         meal_comments = data.get('meal_comments', [])
-        rated_meal_types = [rating['type'] for rating in data['meal_ratings']]
-        
-        for meal_type in rated_meal_types:
-            comment_for_meal = next(
-                (c for c in meal_comments if c['type'] == meal_type), 
-                None
-            )
-            
-            comment_data = {
-                "survey_id": survey_id,
-                "meal_type": meal_type,
-                "reason_comment": comment_for_meal.get('comment', '') if comment_for_meal else "",
+        comments_by_index = {index: comment for index, comment in reversed(meal_comments)}
+        comments_data = [
+            {
+                "meal_type": MEAL_TYPES[index],
+                "reason_comment": comments_by_index.get(index, ""),
                 "alternative_comment": ""
             }
-            await supabase_client.add_meal_comment(comment_data)
+            for index in range(len(data['meal_ratings']))
+        ]
+        
+        # Пишем опрос в локальный журнал, в БД он уйдет фоновой выгрузкой
+        await survey_queue.enqueue(user_data, survey_data, ratings_data, comments_data)
+        update_message = "✅ Спасибо за ваш отзыв!"
         
         # ТРЕТЬЕ: Формируем сообщение
         formatted_date = datetime.strptime(survey_date, "%Y-%m-%d").strftime("%d.%m.%Y")
@@ -743,8 +648,8 @@ async def finish_special_survey(message: types.Message, state: FSMContext):
         
         # Добавляем смайлики к оценкам блюд
         emoji_map = {1: "😠", 2: "😕", 3: "😐", 4: "😊", 5: "🤩"}
-        for rating in data['meal_ratings']:
-            result_text += f"• {rating['type'].capitalize()}: {rating['rating']} {emoji_map.get(rating['rating'], '')}\n"
+        for index, rating in enumerate(data['meal_ratings']):
+            result_text += f"• {MEAL_TYPES[index].capitalize()}: {rating} {emoji_map.get(rating, '')}\n"
         
         low_rated_count = len(data.get('low_rated_meals', []))
         if low_rated_count > 0:
@@ -71,11 +71,6 @@ async def reset_command(message: types.Message, state: FSMContext):
     # Сбрасываем состояние
     await state.clear()
     
-    # Очищаем глобальную переменную user_id
-    from callbacks.type_callback import current_user_id
-    global current_user_id
-    current_user_id = None
-    
     await message.answer(
         "🔄 *Опрос сброшен!*\n\n"
         "Вы можете начать заново с помощью команды /mark",
@@ -0,0 +1,133 @@
+# state_snapshot.py
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotFSMContext(FSMContext):
+    """FSMContext поверх снимка сессии: данные читаются из хранилища один раз за апдейт,
+    изменения копятся в памяти и записываются в flush()"""
+
+    def __init__(self, storage: BaseStorage, key: StorageKey, raw_state: Optional[str]):
+        super().__init__(storage, key)
+        # Состояние уже прочитано FSMContextMiddleware - это первое обращение к хранилищу
+        self._state = raw_state
+        self._data = None
+        self._state_changed = False
+        self._data_changed = False
+        self.reads = 1
+        self.writes = 0
+
+    async def set_state(self, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        if state != self._state:
+            self._state = state
+            self._state_changed = True
+
+    async def get_state(self) -> Optional[str]:
+        return self._state
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        if data != self._data:
+            self._data = copy.deepcopy(data)
+            self._data_changed = True
+
+    async def get_data(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = await self.storage.get_data(key=self.key)
+            self.reads += 1
+        # Глубокая копия: списки, измененные обработчиком на месте, не должны
+        # менять снимок в обход update_data (иначе изменение не заметить)
+        return copy.deepcopy(self._data)
+
+    async def update_data(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        if self._data is None:
+            self._data = await self.storage.get_data(key=self.key)
+            self.reads += 1
+        # Запись только если что-то действительно изменилось
+        if any(key not in self._data or self._data[key] != value for key, value in kwargs.items()):
+            self._data.update(kwargs)
+            self._data_changed = True
+        return copy.deepcopy(self._data)
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения: не больше одной записи состояния и одной записи данных.
+        Обработчик вызывает его (через flush_state) перед отправкой сообщения, на которое
+        пользователь может ответить: следующий апдейт должен увидеть уже новое состояние"""
+        if self._state_changed:
+            await self.storage.set_state(key=self.key, state=self._state)
+            self.writes += 1
+            self._state_changed = False
+        if self._data_changed:
+            await self.storage.set_data(key=self.key, data=self._data)
+            self.writes += 1
+            self._data_changed = False
+
+
+async def flush_state(state: FSMContext) -> None:
+    """Сохраняет изменения снимка сейчас, не дожидаясь конца апдейта
+    (для обычного FSMContext ничего не делает: он пишет в хранилище сразу)"""
+    if isinstance(state, SnapshotFSMContext):
+        await state.flush()
+
+
+class StateSnapshotMiddleware(BaseMiddleware):
+    """Подменяет FSMContext апдейта снимком и сохраняет его одной записью после обработчиков"""
+
+    def __init__(self):
+        self.updates = 0
+        self.reads = 0
+        self.writes = 0
+        self.max_ops = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        state = data.get("state")
+        if state is None:
+            return await handler(event, data)
+
+        context = SnapshotFSMContext(state.storage, state.key, data.get("raw_state"))
+        data["state"] = context
+        try:
+            return await handler(event, data)
+        finally:
+            # Запись и при ошибке обработчика: изменения до ошибки раньше тоже сохранялись
+            try:
+                await context.flush()
+            finally:
+                self._count(context)
+
+    def _count(self, context: SnapshotFSMContext):
+        ops = context.reads + context.writes
+        self.updates += 1
+        self.reads += context.reads
+        self.writes += context.writes
+        self.max_ops = max(self.max_ops, ops)
+        logger.debug(f"🗂 FSM: {context.reads} чтений, {context.writes} записей за апдейт")
+
+    def stats(self):
+        """Обращения к FSM-хранилищу за апдейт"""
+        return {
+            "updates": self.updates,
+            "reads": self.reads,
+            "writes": self.writes,
+            "avg_ops": (self.reads + self.writes) / self.updates if self.updates else 0.0,
+            "max_ops": self.max_ops,
+        }
+
+
+state_snapshot_middleware = StateSnapshotMiddleware()
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# Бот запускается из папки bot/ и импортирует модули верхнего уровня (config, database, ...)
+BOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot")
+sys.path.insert(0, BOT_DIR)
+
+# Тесты не ходят в Supabase и на Яндекс.Диск: локальное хранилище во временной папке
+_tmp = tempfile.mkdtemp(prefix="foodbot-tests-")
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(_tmp, "foodbot.sqlite3"))
+os.environ.setdefault("SURVEY_JOURNAL_PATH", os.path.join(_tmp, "survey_journal.sqlite3"))
+os.environ.setdefault("YANDEX_DISK_TOKEN", "test")
@@ -0,0 +1,77 @@
+"""SQLite-хранилище: save_survey и daily_meal_stats"""
+import asyncio
+import sqlite3
+
+import pytest
+
+from database.db_sqlite import SQLiteClient
+
+DATE = "2026-10-16"
+
+
+def save_survey(client, telegram_id, ratings, full_name="Иванов Иван", class_name="5А"):
+    user = {"telegram_id": telegram_id, "full_name": full_name, "class": class_name, "has_profile": True}
+    survey = {"date": DATE, "eats_at_school": True, "overall_satisfaction": 4, "overall_comment": ""}
+    ratings = [{"meal_type": meal_type, "rating": rating} for meal_type, rating in ratings]
+    return client.save_survey(user, survey, ratings, [])
+
+
+async def meal_stats(client):
+    rows = (await client.get_daily_meal_stats(DATE)).data
+    return {
+        (row["class"], row["meal_type"]): (
+            row["ratings_count"], row["ratings_sum"], *(row[f"r{rating}"] for rating in range(1, 6))
+        )
+        for row in rows if row["ratings_count"]
+    }
+
+
+def test_bad_rating_rolls_back_whole_survey(tmp_path):
+    client = SQLiteClient(str(tmp_path / "foodbot.sqlite3"))
+
+    async def main():
+        await save_survey(client, 1, [("первое", 3)])
+
+        for telegram_id, ratings in [
+            (1, [("первое", 5), ("второе", "отлично")]),
+            (2, [("первое", "плохо")]),
+            (1, [("первое", 7)]),
+            (1, [("первое", 2.5)]),
+        ]:
+            with pytest.raises(ValueError):
+                await save_survey(client, telegram_id, ratings, full_name="Петров Петр")
+
+        user = (await client.get_user(1)).data[0]
+        stranger = (await client.get_user(2)).data
+        survey_id = (await client.get_user_survey_for_date(1, DATE)).data[0]["id"]
+        ratings = (await client.get_meal_ratings_by_survey(survey_id)).data
+        stats = await meal_stats(client)
+        await client.close()
+        return user, stranger, ratings, stats
+
+    user, stranger, ratings, stats = asyncio.run(main())
+
+    # Ни профиль, ни анкета, ни агрегат не изменились
+    assert user["full_name"] == "Иванов Иван"
+    assert stranger == []
+    assert [(r["meal_type"], r["rating"]) for r in ratings] == [("первое", 3)]
+    assert stats == {("5А", "первое"): (1, 3, 0, 0, 1, 0, 0)}
+
+
+def test_rating_check_constraint(tmp_path):
+    path = str(tmp_path / "foodbot.sqlite3")
+    client = SQLiteClient(path)
+
+    async def main():
+        await save_survey(client, 1, [("первое", 3)])
+        await client.close()
+
+    asyncio.run(main())
+
+    # Запись в обход save_survey тоже не пропускает плохую оценку
+    with sqlite3.connect(path) as conn:
+        for rating in ("плохо", 0, 6, 2.5):
+            with pytest.raises(sqlite3.IntegrityError):
+                conn.execute(
+                    "INSERT INTO meal_ratings (survey_id, meal_type, rating) VALUES (1, 'второе', ?)", (rating,)
+                )
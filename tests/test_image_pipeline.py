@@ -0,0 +1,85 @@
+"""Кэш оптимизированных фото на диске: возраст и размер"""
+import asyncio
+import io
+import os
+import time
+
+from PIL import Image
+
+from functions.image_pipeline import PhotoOptimizer
+
+DAY = 24 * 3600
+
+
+def jpeg_bytes(color="red"):
+    output = io.BytesIO()
+    Image.new("RGB", (32, 32), color).save(output, format="JPEG")
+    return output.getvalue()
+
+
+class FakeDisk:
+    def __init__(self):
+        self.downloads = 0
+
+    async def download_photo(self, path):
+        self.downloads += 1
+        return jpeg_bytes()
+
+
+def put(cache_dir, name, size, age):
+    path = os.path.join(cache_dir, name)
+    with open(path, "wb") as file:
+        file.write(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_cleanup_removes_expired_then_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path)
+    optimizer = PhotoOptimizer(FakeDisk(), cache_dir=cache_dir, max_bytes=250, max_age_days=30)
+    put(cache_dir, "expired.jpg", 10, 40 * DAY)
+    put(cache_dir, "old.jpg", 100, 3 * DAY)
+    put(cache_dir, "recent.jpg", 100, 2 * DAY)
+    put(cache_dir, "newest.jpg", 100, 1 * DAY)
+    put(cache_dir, "writing.jpg.tmp", 100, 0)
+    put(cache_dir, "abandoned.jpg.tmp", 100, 31 * DAY)
+
+    asyncio.run(optimizer.cleanup())
+
+    # Просроченные удалены по возрасту; из свежих 300 байт удален самый старый
+    assert sorted(os.listdir(cache_dir)) == ["newest.jpg", "recent.jpg", "writing.jpg.tmp"]
+    assert optimizer.stats()["evicted"] == 3
+
+
+def test_cache_hit_protects_file_from_eviction(tmp_path):
+    cache_dir = str(tmp_path)
+    disk = FakeDisk()
+    optimizer = PhotoOptimizer(disk, cache_dir=cache_dir, max_bytes=10 ** 6, max_age_days=30)
+    meal = {"md5": "abc", "path": "/FoodSchool64/16.10.2026/Первое/суп.jpg", "type": "первое", "date": "16.10.2026"}
+
+    async def main():
+        first = await optimizer.get_photo(meal)
+        # Давно использованный файл: без чтения из кэша его удалила бы очистка по возрасту
+        cached = os.path.join(cache_dir, "abc.jpg")
+        os.utime(cached, (time.time() - 29 * DAY,) * 2)
+        second = await optimizer.get_photo(meal)
+        optimizer.max_age = 28 * DAY
+        await optimizer.cleanup()
+        return first, second
+
+    first, second = asyncio.run(main())
+
+    assert first == second
+    assert disk.downloads == 1
+    assert os.listdir(cache_dir) == ["abc.jpg"]
+
+
+def test_write_triggers_cleanup(tmp_path):
+    cache_dir = str(tmp_path)
+    optimizer = PhotoOptimizer(FakeDisk(), cache_dir=cache_dir, max_bytes=10 ** 6, max_age_days=30)
+    put(cache_dir, "expired.jpg", 10, 40 * DAY)
+    meal = {"md5": "def", "path": "/FoodSchool64/16.10.2026/Второе/каша.jpg", "type": "второе", "date": "16.10.2026"}
+
+    assert asyncio.run(optimizer.get_photo(meal)) is not None
+    assert os.listdir(cache_dir) == ["def.jpg"]
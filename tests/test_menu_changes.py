@@ -0,0 +1,127 @@
+"""Проверка Диска на замененные фото и окно, в котором она работает"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import yadisk
+
+from functions.menu_prewarm import MenuPrewarmer
+from functions.yandex_disk import MEAL_TYPES, YandexDiskManager
+
+DAY = date(2026, 10, 16)
+DATE_STR = DAY.strftime("%d.%m.%Y")
+MSK = timezone(timedelta(hours=3))
+
+
+class FakeDiskClient:
+    """Папки блюд в памяти: {папка: [(имя файла, md5)]}; считает листинги по полям"""
+
+    def __init__(self, folders):
+        self.folders = folders
+        self.listings = []
+
+    async def listdir(self, path, fields=None, limit=None):
+        self.listings.append((path, tuple(fields)))
+        folder = path.rsplit("/", 1)[1]
+        if folder not in self.folders:
+            raise yadisk.exceptions.PathNotFoundError()
+        for name, md5 in self.folders[folder]:
+            yield SimpleNamespace(
+                type="file", name=name, md5=md5, size=100, path=f"{path}/{name}",
+                modified=datetime(2026, 10, 16, 7, 0, tzinfo=MSK), file=f"https://disk/{md5}"
+            )
+
+    async def get_download_link(self, path):
+        return f"https://disk/{path}"
+
+
+def make_disk(folders):
+    disk = YandexDiskManager()
+    disk.y = FakeDiskClient(folders)
+    return disk
+
+
+async def warm(disk):
+    meals = await disk._get_meals_for_date_internal(DATE_STR)
+    disk.cached_meals = meals
+    disk.last_check_date = DAY
+    return meals
+
+
+def test_file_replaced_under_same_name_is_detected():
+    disk = make_disk({"Первое": [("суп.jpg", "a1")], "Второе": [("каша.jpg", "b1")]})
+
+    async def main():
+        await warm(disk)
+        disk.y.listings.clear()
+        unchanged = await disk.detect_changes()
+        # Новое фото под тем же именем: дата изменения папки та же, md5 другой
+        disk.y.folders["Первое"] = [("суп.jpg", "a2")]
+        disk.y.listings.clear()
+        changed = await disk.detect_changes()
+        return unchanged, changed
+
+    unchanged, changed = asyncio.run(main())
+
+    assert unchanged == []
+    assert [(old["md5"], new["md5"]) for old, new in changed] == [("a1", "a2")]
+    assert disk.cached_meals[0]["md5"] == "a2"
+    # Дешевые листинги всех папок, полностью перечитано только изменившееся блюдо
+    cheap = [path for path, fields in disk.y.listings if "file" not in fields]
+    full = [path for path, fields in disk.y.listings if "file" in fields]
+    assert len(cheap) == len(MEAL_TYPES)
+    assert full == [f"/FoodSchool64/{DATE_STR}/Первое"]
+
+
+def test_new_photo_in_empty_folder_is_detected():
+    disk = make_disk({"Первое": [("суп.jpg", "a1")]})
+
+    async def main():
+        await warm(disk)
+        disk.y.folders["Напиток"] = [("компот.jpg", "c1")]
+        return await disk.detect_changes()
+
+    changed = asyncio.run(main())
+
+    assert [(old["has_image"], new["type"], new["md5"]) for old, new in changed] == [(False, "напиток", "c1")]
+
+
+class Stop(Exception):
+    pass
+
+
+def run_scheduler_once(monkeypatch, now):
+    """Первый шаг _run после готового прогрева: [("poll" или "sleep", секунды)]"""
+    disk = make_disk({})
+    disk._get_moscow_time = lambda: now
+    prewarmer = MenuPrewarmer(disk, prewarm_time="07:30", poll_end="17:00")
+    prewarmer.date = DAY
+    prewarmer.ready = True
+    calls = []
+
+    async def poll_changes_for(seconds):
+        calls.append(("poll", seconds))
+        raise Stop()
+
+    async def sleep(seconds):
+        calls.append(("sleep", seconds))
+        raise Stop()
+
+    monkeypatch.setattr(prewarmer, "_poll_changes_for", poll_changes_for)
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    try:
+        asyncio.run(prewarmer._run())
+    except Stop:
+        pass
+    return calls
+
+
+def test_changes_are_polled_until_end_of_school_day(monkeypatch):
+    calls = run_scheduler_once(monkeypatch, datetime(2026, 10, 16, 16, 30, tzinfo=MSK))
+    assert calls == [("poll", 30 * 60)]
+
+
+def test_no_polling_after_end_of_school_day(monkeypatch):
+    calls = run_scheduler_once(monkeypatch, datetime(2026, 10, 16, 23, 0, tzinfo=MSK))
+    # Спим до прогрева следующего дня в 07:30, вчерашнюю дату не проверяем
+    assert calls == [("sleep", 8.5 * 3600)]
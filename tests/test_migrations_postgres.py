@@ -0,0 +1,219 @@
+"""Миграции 001–005 на одноразовом Postgres: save_survey и daily_meal_stats
+
+Сервер берется из TEST_POSTGRES_DSN, а если переменная не задана - поднимается
+локально через pgserver. Без них тесты пропускаются.
+"""
+import json
+import os
+import uuid
+
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "..", "bot", "database", "migrations")
+MIGRATIONS = [
+    "001_save_survey.sql", "002_daily_summary.sql", "003_daily_meal_stats.sql", "004_meal_rating_check.sql",
+    "005_survey_class_name_not_null.sql",
+]
+
+# Таблицы в том виде, в каком они созданы в Supabase до миграций
+BASE_SCHEMA = """
+CREATE TABLE users (
+    id bigserial PRIMARY KEY,
+    telegram_id bigint NOT NULL UNIQUE,
+    full_name text NOT NULL DEFAULT '',
+    class text NOT NULL DEFAULT '',
+    has_profile boolean NOT NULL DEFAULT false,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE surveys (
+    id bigserial PRIMARY KEY,
+    telegram_id bigint NOT NULL REFERENCES users (telegram_id),
+    date date NOT NULL DEFAULT current_date,
+    eats_at_school boolean NOT NULL DEFAULT false,
+    no_school_reason text NOT NULL DEFAULT '',
+    overall_satisfaction integer,
+    overall_comment text NOT NULL DEFAULT '',
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE meal_ratings (
+    id bigserial PRIMARY KEY,
+    survey_id bigint NOT NULL REFERENCES surveys (id) ON DELETE CASCADE,
+    meal_type text NOT NULL,
+    rating integer NOT NULL
+);
+
+CREATE TABLE meal_comments (
+    id bigserial PRIMARY KEY,
+    survey_id bigint NOT NULL REFERENCES surveys (id) ON DELETE CASCADE,
+    meal_type text NOT NULL,
+    reason_comment text NOT NULL DEFAULT '',
+    alternative_comment text NOT NULL DEFAULT ''
+);
+"""
+
+DATE = "2026-10-16"
+
+
+@pytest.fixture(scope="module")
+def server_dsn(tmp_path_factory):
+    dsn = os.getenv("TEST_POSTGRES_DSN")
+    if dsn:
+        yield dsn
+        return
+
+    pgserver = pytest.importorskip("pgserver", reason="нужен TEST_POSTGRES_DSN или pgserver")
+    server = pgserver.get_server(tmp_path_factory.mktemp("pgdata"), cleanup_mode="stop")
+    try:
+        yield server.get_uri()
+    finally:
+        server.cleanup()
+
+
+def apply_migrations(conn, migrations):
+    for migration in migrations:
+        with open(os.path.join(MIGRATIONS_DIR, migration), encoding="utf-8") as file:
+            conn.execute(file.read())
+
+
+@pytest.fixture
+def base_db(server_dsn):
+    """Отдельная база на тест с базовыми таблицами, без миграций"""
+    name = f"foodbot_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(server_dsn, autocommit=True) as admin:
+        admin.execute(f'CREATE DATABASE "{name}"')
+
+    dsn = psycopg.conninfo.make_conninfo(server_dsn, dbname=name)
+    conn = psycopg.connect(dsn, autocommit=True)
+    try:
+        conn.execute(BASE_SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+        with psycopg.connect(server_dsn, autocommit=True) as admin:
+            admin.execute(f'DROP DATABASE "{name}"')
+
+
+@pytest.fixture
+def db(base_db):
+    """Базовые таблицы + все миграции по порядку"""
+    apply_migrations(base_db, MIGRATIONS)
+    return base_db
+
+
+def save_survey(conn, telegram_id, ratings, comments=(), full_name="Иванов Иван", class_name="5А"):
+    user = {"telegram_id": telegram_id, "full_name": full_name, "class": class_name, "has_profile": True}
+    survey = {"date": DATE, "eats_at_school": True, "overall_satisfaction": 4, "overall_comment": ""}
+    ratings = [{"meal_type": meal_type, "rating": rating} for meal_type, rating in ratings]
+    comments = [
+        {"meal_type": meal_type, "reason_comment": comment, "alternative_comment": ""}
+        for meal_type, comment in comments
+    ]
+    return conn.execute(
+        "SELECT save_survey(%s::jsonb, %s::jsonb, %s::jsonb, %s::jsonb)",
+        (json.dumps(user), json.dumps(survey), json.dumps(ratings), json.dumps(comments))
+    ).fetchone()[0]
+
+
+def meal_stats(conn):
+    rows = conn.execute(
+        "SELECT class, meal_type, ratings_count, ratings_sum, r1, r2, r3, r4, r5"
+        " FROM daily_meal_stats WHERE date = %s AND ratings_count <> 0 ORDER BY class, meal_type",
+        (DATE,)
+    ).fetchall()
+    return {(row[0], row[1]): row[2:] for row in rows}
+
+
+def test_save_survey_upserts_by_telegram_id_and_date(db):
+    first = save_survey(db, 1, [("первое", 2), ("второе", 5)], [("первое", "Пересолено")])
+    second = save_survey(db, 1, [("первое", 4)])
+
+    assert first["created"] is True
+    assert second["created"] is False
+    assert second["survey_id"] == first["survey_id"]
+    assert db.execute("SELECT count(*) FROM surveys WHERE telegram_id = 1").fetchone()[0] == 1
+    # Старые оценки и комментарии анкеты заменены новыми
+    assert db.execute(
+        "SELECT meal_type, rating FROM meal_ratings WHERE survey_id = %s", (first["survey_id"],)
+    ).fetchall() == [("первое", 4)]
+    assert db.execute(
+        "SELECT count(*) FROM meal_comments WHERE survey_id = %s", (first["survey_id"],)
+    ).fetchone()[0] == 0
+
+
+def test_bad_rating_rolls_back_whole_survey(db):
+    save_survey(db, 1, [("первое", 3)])
+
+    with pytest.raises(psycopg.errors.InvalidTextRepresentation):
+        save_survey(db, 1, [("первое", 5), ("второе", "отлично")], full_name="Петров Петр")
+    with pytest.raises(psycopg.errors.InvalidTextRepresentation):
+        save_survey(db, 2, [("первое", "плохо")])
+    with pytest.raises(psycopg.errors.CheckViolation):
+        save_survey(db, 1, [("первое", 7)])
+
+    # Ни профиль, ни анкета, ни агрегат не изменились
+    assert db.execute("SELECT full_name FROM users WHERE telegram_id = 1").fetchone()[0] == "Иванов Иван"
+    assert db.execute("SELECT count(*) FROM users WHERE telegram_id = 2").fetchone()[0] == 0
+    assert db.execute(
+        "SELECT r.meal_type, r.rating FROM meal_ratings r JOIN surveys s ON s.id = r.survey_id"
+        " WHERE s.telegram_id = 1"
+    ).fetchall() == [("первое", 3)]
+    assert meal_stats(db) == {("5А", "первое"): (1, 3, 0, 0, 1, 0, 0)}
+
+
+def test_resubmit_subtracts_old_ratings_from_daily_meal_stats(db):
+    save_survey(db, 1, [("первое", 2), ("напиток", 5)])
+    save_survey(db, 2, [("первое", 4)])
+    assert meal_stats(db) == {
+        ("5А", "напиток"): (1, 5, 0, 0, 0, 0, 1),
+        ("5А", "первое"): (2, 6, 0, 1, 0, 1, 0),
+    }
+
+    # Повторная отправка после смены класса: старые оценки вычитаются из старого класса
+    save_survey(db, 1, [("первое", 5)], class_name="6Б")
+    assert meal_stats(db) == {
+        ("5А", "первое"): (1, 4, 0, 0, 0, 1, 0),
+        ("6Б", "первое"): (1, 5, 0, 0, 0, 0, 1),
+    }
+
+    # Агрегат совпадает с пересчетом по meal_ratings
+    recomputed = db.execute(
+        "SELECT s.class_name, r.meal_type, count(*), sum(r.rating) FROM meal_ratings r"
+        " JOIN surveys s ON s.id = r.survey_id WHERE s.date = %s GROUP BY 1, 2 ORDER BY 1, 2",
+        (DATE,)
+    ).fetchall()
+    assert [(key[0], key[1], value[0], value[1]) for key, value in meal_stats(db).items()] == recomputed
+
+    summary = db.execute("SELECT daily_summary(%s::date)", (DATE,)).fetchone()[0]
+    assert summary["total_surveys"] == 2
+    assert summary["ratings_count"] == 2
+    assert summary["meals"]["первое"]["distribution"] == {"1": 0, "2": 0, "3": 0, "4": 1, "5": 1}
+
+
+def test_survey_class_name_is_required_with_empty_default(db):
+    save_survey(db, 1, [("первое", 3)])
+    db.execute(
+        "INSERT INTO surveys (telegram_id, date) VALUES (1, %s::date + 1)", (DATE,)
+    )
+
+    assert db.execute(
+        "SELECT class_name FROM surveys WHERE telegram_id = 1 ORDER BY date"
+    ).fetchall() == [("5А",), ("",)]
+    with pytest.raises(psycopg.errors.NotNullViolation):
+        db.execute("UPDATE surveys SET class_name = NULL")
+
+
+def test_class_name_backfilled_from_users_before_not_null(base_db):
+    apply_migrations(base_db, MIGRATIONS[:-1])
+    save_survey(base_db, 1, [("первое", 3)], class_name="7В")
+    # Анкета, записанная в обход save_survey до миграции 005
+    base_db.execute("INSERT INTO surveys (telegram_id, date) VALUES (1, %s::date + 1)", (DATE,))
+
+    apply_migrations(base_db, MIGRATIONS[-1:])
+
+    assert base_db.execute(
+        "SELECT class_name FROM surveys WHERE telegram_id = 1 ORDER BY date"
+    ).fetchall() == [("7В",), ("7В",)]
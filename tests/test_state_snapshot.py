@@ -0,0 +1,186 @@
+"""Снимок FSM-состояния: обращения к хранилищу за апдейт и запись до отправки карточки"""
+import asyncio
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+
+import callbacks.type_callback as type_callback
+from functions.yandex_disk import yandex_disk
+from middlewares.state_snapshot import StateSnapshotMiddleware
+from test_survey_concurrency import BOT_ID, MENU_DATE, FakeCallback, make_meals
+
+USER_ID = 1001
+KEY = StorageKey(bot_id=BOT_ID, chat_id=USER_ID, user_id=USER_ID)
+RATING_STATE = type_callback.SurveyStates.waiting_for_meal_rating.state
+
+
+class CountingStorage(MemoryStorage):
+    """MemoryStorage, который считает чтения и записи"""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+        self.writes = 0
+
+    def reset(self):
+        self.reads = self.writes = 0
+
+    async def get_state(self, key):
+        self.reads += 1
+        return await super().get_state(key)
+
+    async def get_data(self, key):
+        self.reads += 1
+        return await super().get_data(key)
+
+    async def set_state(self, key, state=None):
+        self.writes += 1
+        await super().set_state(key, state)
+
+    async def set_data(self, key, data):
+        self.writes += 1
+        await super().set_data(key, data)
+
+    def peek(self):
+        """Состояние и данные в хранилище без учета в счетчиках"""
+        record = self.storage[KEY]
+        return record.state, dict(record.data)
+
+
+@pytest.fixture
+def cards(monkeypatch):
+    """Подменяет меню и отправку карточек; возвращает снимки хранилища в момент отправки"""
+    sent = []
+
+    async def get_menu_meal(date_str, index):
+        return make_meals(date_str)[index]
+
+    async def send_meal_card(message, meal, caption, reply_markup):
+        sent.append(message.storage_at_send())
+        return await message.answer(caption)
+
+    monkeypatch.setattr(yandex_disk, "get_menu_meal", get_menu_meal)
+    monkeypatch.setattr(type_callback, "send_meal_card", send_meal_card)
+    return sent
+
+
+async def start_survey(storage):
+    state = FSMContext(storage, KEY)
+    await state.set_state(RATING_STATE)
+    await state.set_data({
+        "menu_date": MENU_DATE,
+        "current_meal_index": 0,
+        "meal_ratings": [],
+        "low_rated_meals": [],
+        "current_meal_message_id": 1,
+    })
+    storage.reset()
+
+
+async def press(middleware, storage, handler, event, isolation=None):
+    """Апдейт как в боте: FSMContextMiddleware читает состояние (под блокировкой сессии), затем снимок"""
+    async def process():
+        context = FSMContext(storage, KEY)
+        data = {"state": context, "raw_state": await context.get_state()}
+
+        async def call(event, data):
+            return await handler(event, data["state"])
+
+        await middleware(call, event, data)
+
+    if isolation is None:
+        await process()
+    else:
+        async with isolation.lock(KEY):
+            await process()
+
+
+def rating_press(storage, rating):
+    event = FakeCallback(f"rating_meal_{rating}")
+    event.message.storage_at_send = storage.peek
+    return event
+
+
+def test_rating_update_reads_once_and_writes_before_next_card(cards):
+    storage = CountingStorage()
+    middleware = StateSnapshotMiddleware()
+
+    async def main():
+        await start_survey(storage)
+        await press(middleware, storage, type_callback.process_meal_rating, rating_press(storage, 4))
+
+    asyncio.run(main())
+
+    # Одно чтение состояния и одно чтение данных за апдейт
+    assert storage.reads == 2
+    # До карточки - данные с оценкой (состояние то же и не пишется), после - id карточки
+    assert storage.writes == 2
+    assert middleware.stats() == {"updates": 1, "reads": 2, "writes": 2, "avg_ops": 4.0, "max_ops": 4}
+
+    state_at_send, data_at_send = cards[0]
+    assert state_at_send == RATING_STATE
+    assert data_at_send["meal_ratings"] == [4]
+    assert data_at_send["current_meal_index"] == 1
+
+
+def test_unchanged_state_is_not_written():
+    storage = CountingStorage()
+    middleware = StateSnapshotMiddleware()
+
+    async def handler(event, state):
+        await state.set_state(RATING_STATE)
+        data = await state.get_data()
+        await state.update_data(current_meal_index=data["current_meal_index"])
+
+    async def main():
+        await start_survey(storage)
+        await press(middleware, storage, handler, None)
+
+    asyncio.run(main())
+
+    assert (storage.reads, storage.writes) == (2, 0)
+
+
+def test_list_changed_in_place_is_written():
+    storage = CountingStorage()
+    middleware = StateSnapshotMiddleware()
+
+    async def handler(event, state):
+        data = await state.get_data()
+        ratings = data["meal_ratings"]
+        ratings.append(5)
+        await state.update_data(meal_ratings=ratings)
+
+    async def main():
+        await start_survey(storage)
+        await press(middleware, storage, handler, None)
+
+    asyncio.run(main())
+
+    assert storage.writes == 1
+    assert storage.peek()[1]["meal_ratings"] == [5]
+
+
+def test_double_tap_with_event_isolation_loses_no_rating(cards):
+    storage = CountingStorage()
+    middleware = StateSnapshotMiddleware()
+    isolation = SimpleEventIsolation()
+
+    async def main():
+        await start_survey(storage)
+        await asyncio.gather(*(
+            press(middleware, storage, type_callback.process_meal_rating, rating_press(storage, rating), isolation)
+            for rating in (2, 5)
+        ))
+
+    asyncio.run(main())
+
+    # Второе нажатие видит результат первого, а не тот же снимок
+    state, data = storage.peek()
+    assert data["meal_ratings"] == [2, 5]
+    assert data["current_meal_index"] == 2
+    assert data["low_rated_meals"] == [0]
+    assert state == RATING_STATE
+    assert len(cards) == 2
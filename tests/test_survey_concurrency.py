@@ -0,0 +1,172 @@
+"""Одновременные опросы многих учеников: каждая анкета уходит со своим telegram_id"""
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import callbacks.type_callback as type_callback
+import handlers.special_mark_handler as special_mark_handler
+from database.survey_queue import survey_queue
+from functions.yandex_disk import MEAL_TYPES, yandex_disk
+from middlewares.state_snapshot import StateSnapshotMiddleware
+
+USERS = 60
+BOT_ID = 999
+MENU_DATE = "16.10.2026"
+
+
+def make_meals(date_str):
+    return [
+        {**yandex_disk._meal_without_image(date_str, meal_type), "has_image": True, "download_url": "url"}
+        for meal_type in MEAL_TYPES
+    ]
+
+
+class FakeMessage:
+    """Сообщение бота: from_user - сам бот, поэтому ученика можно взять только из ключа FSM"""
+
+    def __init__(self, text=None):
+        self.text = text
+        self.message_id = random.randint(1, 10 ** 6)
+        self.chat = SimpleNamespace(id=BOT_ID)
+        self.from_user = SimpleNamespace(id=BOT_ID)
+        self.bot = SimpleNamespace(delete_message=self._noop)
+
+    async def _noop(self, **kwargs):
+        await asyncio.sleep(0)
+
+    async def answer(self, *args, **kwargs):
+        # Случайные задержки перемешивают шаги разных учеников
+        await asyncio.sleep(random.random() / 1000)
+        return FakeMessage()
+
+    async def delete(self):
+        await asyncio.sleep(0)
+
+
+class FakeCallback:
+    def __init__(self, data):
+        self.data = data
+        self.message = FakeMessage()
+
+    async def answer(self, *args, **kwargs):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """Подменяет меню, отправку карточек и журнал опросов; возвращает сохраненные анкеты"""
+    surveys = []
+
+    async def enqueue(user, survey, ratings, comments):
+        await asyncio.sleep(random.random() / 1000)
+        surveys.append((user, survey, ratings, comments))
+
+    async def get_meals_for_date(date_str):
+        await asyncio.sleep(0)
+        return make_meals(date_str)
+
+    async def get_today_meals():
+        return await get_meals_for_date(MENU_DATE)
+
+    async def send_meal_card(message, meal, caption, reply_markup):
+        return await message.answer(caption)
+
+    monkeypatch.setattr(survey_queue, "enqueue", enqueue)
+    monkeypatch.setattr(yandex_disk, "get_meals_for_date", get_meals_for_date)
+    monkeypatch.setattr(yandex_disk, "get_today_meals", get_today_meals)
+    monkeypatch.setattr(type_callback, "send_meal_card", send_meal_card)
+    monkeypatch.setattr(special_mark_handler, "send_meal_card", send_meal_card)
+    return surveys
+
+
+def expected_answers(user_id):
+    """Оценки и комментарии, по которым видно, чья это анкета"""
+    ratings = [1 + (user_id + index) % 5 for index in range(len(MEAL_TYPES))]
+    comments = {
+        MEAL_TYPES[index]: f"комментарий {user_id} к {MEAL_TYPES[index]}"
+        for index, rating in enumerate(ratings) if rating <= 3 and index % 2 == 0
+    }
+    return ratings, comments
+
+
+async def press(middleware, storage, key, handler, event):
+    """Один апдейт так же, как в боте: FSMContextMiddleware, затем снимок состояния"""
+    context = FSMContext(storage, key)
+    data = {"state": context, "raw_state": await context.get_state()}
+
+    async def call(event, data):
+        return await handler(event, data["state"])
+
+    await middleware(call, event, data)
+
+
+async def run_survey(flow, middleware, storage, user_id):
+    key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+    state = FSMContext(storage, key)
+    await state.update_data(
+        eats_at_school=True,
+        full_name=f"Ученик {user_id}",
+        class_name=f"{user_id % 11 + 1}А",
+        overall_satisfaction=5,
+        survey_date="2026-10-16",
+    )
+    await flow["start"](FakeMessage(), state)
+
+    ratings, comments = expected_answers(user_id)
+    for rating in ratings:
+        await press(middleware, storage, key, flow["rate"], FakeCallback(f"rating_meal_{rating}"))
+
+    low_rated = [MEAL_TYPES[index] for index, rating in enumerate(ratings) if rating <= 3]
+    for meal_type in low_rated:
+        if meal_type in comments:
+            await press(middleware, storage, key, flow["comment"], FakeMessage(comments[meal_type]))
+        else:
+            await press(middleware, storage, key, flow["skip"], FakeCallback("skip_meal_comment"))
+
+
+FLOWS = {
+    "mark": {
+        "start": type_callback.start_meal_rating,
+        "rate": type_callback.process_meal_rating,
+        "comment": type_callback.process_meal_comment,
+        "skip": type_callback.skip_meal_comment,
+    },
+    "mark_special": {
+        "start": special_mark_handler.start_special_meal_rating,
+        "rate": special_mark_handler.process_special_meal_rating,
+        "comment": special_mark_handler.process_special_meal_comment,
+        "skip": special_mark_handler.skip_special_meal_comment,
+    },
+}
+
+
+@pytest.mark.parametrize("flow_name", FLOWS)
+def test_concurrent_surveys_are_attributed_to_their_users(saved, flow_name):
+    storage = MemoryStorage()
+    middleware = StateSnapshotMiddleware()
+    user_ids = list(range(1001, 1001 + USERS))
+
+    async def main():
+        await asyncio.gather(*(
+            run_survey(FLOWS[flow_name], middleware, storage, user_id) for user_id in user_ids
+        ))
+
+    random.seed(22)
+    asyncio.run(main())
+
+    assert sorted(user["telegram_id"] for user, *_ in saved) == user_ids
+    for user, survey, ratings, comments in saved:
+        user_id = user["telegram_id"]
+        expected_ratings, expected_comments = expected_answers(user_id)
+
+        assert user["full_name"] == f"Ученик {user_id}"
+        assert user["class"] == f"{user_id % 11 + 1}А"
+        assert [(r["meal_type"], r["rating"]) for r in ratings] == list(zip(MEAL_TYPES, expected_ratings))
+        assert {
+            c["meal_type"]: c["reason_comment"] for c in comments if c["reason_comment"]
+        } == expected_comments
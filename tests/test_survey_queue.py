@@ -0,0 +1,123 @@
+"""Выгрузка журнала опросов: отклоненные записи против недоступной БД"""
+import asyncio
+import json
+
+import httpx
+
+from database.db_supabase import SupabaseClient, SupabaseError
+from database.survey_queue import SurveyJournal, SurveyWriteBehind
+
+DATE = "2026-10-16"
+POISON_ID = 13
+
+
+class FakeStorage:
+    """save_survey отклоняет опрос POISON_ID как PostgREST (400), а при down=True
+    недоступен для всех, как при обрыве сети"""
+
+    def __init__(self):
+        self.down = False
+        self.saved = []
+        self.calls = []
+
+    def is_unavailable_error(self, error):
+        # Ошибки классифицируются так же, как в настоящем клиенте Supabase
+        return SupabaseClient.__new__(SupabaseClient).is_unavailable_error(error)
+
+    async def save_survey(self, user, survey, ratings, comments):
+        self.calls.append(user["telegram_id"])
+        await asyncio.sleep(0)
+        if self.down:
+            raise httpx.ConnectError("connection refused")
+        if user["telegram_id"] == POISON_ID:
+            raise SupabaseError(400, 'invalid input syntax for type integer: "bad"')
+        self.saved.append(user["telegram_id"])
+
+
+def make_queue(tmp_path, storage, **kwargs):
+    journal = SurveyJournal(str(tmp_path / "journal.sqlite3"))
+    return SurveyWriteBehind(storage, journal, **{"batch_size": 10, "max_attempts": 3, **kwargs})
+
+
+async def enqueue(queue, telegram_id, date=DATE):
+    await queue.enqueue({"telegram_id": telegram_id}, {"date": date}, [], [])
+
+
+def dead_rows(queue):
+    return queue.journal._connection().execute(
+        "SELECT telegram_id, date, attempts, last_error FROM dead_surveys"
+    ).fetchall()
+
+
+def test_lone_poison_row_is_dead_lettered(tmp_path):
+    storage = FakeStorage()
+    queue = make_queue(tmp_path, storage)
+
+    async def main():
+        await enqueue(queue, POISON_ID)
+        results = [await queue.flush() for _ in range(queue.max_attempts)]
+        return results
+
+    results = asyncio.run(main())
+
+    # Отклонение не считается недоступностью БД: паузы между проходами нет
+    assert results == [True] * queue.max_attempts
+    assert storage.calls == [POISON_ID] * queue.max_attempts
+    assert queue.journal.depth() == 0
+    assert dead_rows(queue) == [(POISON_ID, DATE, queue.max_attempts, '400: invalid input syntax for type integer: "bad"')]
+    assert queue.dead_lettered == 1
+
+
+def test_poison_row_does_not_hold_back_healthy_surveys(tmp_path):
+    storage = FakeStorage()
+    # Пачка из двух записей: отравленная запись и ее новая версия попадают
+    # в разные пачки, но в одном проходе повторно не отправляются
+    queue = make_queue(tmp_path, storage, batch_size=2)
+
+    async def main():
+        await enqueue(queue, POISON_ID)
+        for telegram_id in range(1, 4):
+            await enqueue(queue, telegram_id)
+        await enqueue(queue, POISON_ID)
+        await enqueue(queue, 4)
+        return await queue.flush()
+
+    assert asyncio.run(main()) is True
+    assert sorted(storage.saved) == [1, 2, 3, 4]
+    assert storage.calls.count(POISON_ID) == 1
+    assert queue.journal.depth() == 2
+    assert queue.journal._connection().execute(
+        "SELECT attempts FROM pending_surveys ORDER BY seq"
+    ).fetchall() == [(1,), (0,)]
+
+
+def test_outage_does_not_count_attempts(tmp_path):
+    storage = FakeStorage()
+    queue = make_queue(tmp_path, storage)
+
+    async def main():
+        await enqueue(queue, POISON_ID)
+        await enqueue(queue, 1)
+        storage.down = True
+        outage = [await queue.flush() for _ in range(queue.max_attempts + 2)]
+        storage.down = False
+        return outage, await queue.flush()
+
+    outage, recovered = asyncio.run(main())
+
+    assert outage == [False] * (queue.max_attempts + 2)
+    assert recovered is True
+    assert storage.saved == [1]
+    # Отравленная запись получила одну попытку - за отклонение после восстановления
+    assert queue.journal._connection().execute(
+        "SELECT telegram_id, attempts FROM pending_surveys"
+    ).fetchall() == [(POISON_ID, 1)]
+    assert dead_rows(queue) == []
+
+
+def test_server_errors_count_as_unavailable():
+    client = SupabaseClient.__new__(SupabaseClient)
+    assert client.is_unavailable_error(SupabaseError(503, "Service Unavailable"))
+    assert client.is_unavailable_error(httpx.ReadTimeout("timeout"))
+    assert not client.is_unavailable_error(SupabaseError(400, "bad request"))
+    assert not client.is_unavailable_error(ValueError(json.dumps({"rating": "bad"})))